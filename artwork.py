@@ -0,0 +1,209 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+FOLDER_ART_NAMES = ('cover.jpg', 'folder.jpg', 'front.jpg', 'cover.png', 'folder.png')
+SIZE_STEP = 64  # Thumbnail sizes are rounded up to this so small layout changes reuse the cache
+MISSING_RETRY_SECONDS = 7 * 24 * 3600  # Tracks without art are searched again after this, in case a cover was added
+DISK_BLOCK = 4096
+
+
+def extract_cover(path):
+    # Embedded picture bytes (ID3 APIC, FLAC/Ogg pictures, MP4 covr), else a folder image next to the file
+    from mutagen import File as MutagenFile
+    try:
+        audio = MutagenFile(path)
+    except Exception as e:
+        logger.warning("Error reading cover art: %s", e)
+        audio = None
+    if audio is not None:
+        tags = audio.tags
+        if tags is not None and hasattr(tags, 'getall'):
+            frames = tags.getall('APIC')
+            if frames:
+                # Prefer the front cover (picture type 3) when there are several
+                frames.sort(key=lambda frame: frame.type != 3)
+                return frames[0].data
+        pictures = getattr(audio, 'pictures', None)
+        if pictures:
+            return pictures[0].data
+        if tags is not None and 'covr' in tags:
+            return bytes(tags['covr'][0])
+    folder = os.path.dirname(path)
+    for name in FOLDER_ART_NAMES:
+        candidate = os.path.join(folder, name)
+        if os.path.isfile(candidate):
+            with open(candidate, 'rb') as f:
+                return f.read()
+    return None
+
+
+def make_thumbnail(data, size):
+    from PIL import Image as PILImage
+    image = PILImage.open(io.BytesIO(data))
+    image.draft('RGB', size)  # Lets the JPEG decoder skip detail we would throw away anyway
+    image = image.convert('RGBA')
+    image.thumbnail(size)
+    return image
+
+
+class Thumbnail:
+    def __init__(self, width, height, pixels):
+        self.width = width
+        self.height = height
+        self.pixels = pixels  # RGBA, top row first
+
+    @property
+    def nbytes(self):
+        return len(self.pixels)
+
+
+def disk_usage(size):
+    # What a file takes on disk; empty "no art" markers still cost a block
+    return max(1, -(-size // DISK_BLOCK)) * DISK_BLOCK
+
+
+class ThumbnailCache:
+    # Decoded thumbnails in LRU order, bounded by the total size of their pixel buffers
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            thumb = self.entries.get(key)
+            if thumb is not None:
+                self.entries.move_to_end(key)
+            return thumb
+
+    def put(self, key, thumb):
+        if thumb.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous.nbytes
+            self.entries[key] = thumb
+            self.total_bytes += thumb.nbytes
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+
+
+class ArtworkLoader:
+    # Extracts and downscales cover art on a worker thread. on_ready(path, thumb) is called from
+    # the worker (thumb is None when the track has no art); cache hits return straight from request().
+    # The disk cache is kept under max_disk_bytes by dropping the least recently used files.
+    def __init__(self, cache_dir, on_ready, max_bytes=16 * 1024 * 1024, max_disk_bytes=64 * 1024 * 1024,
+                 missing_retry=MISSING_RETRY_SECONDS):
+        self.cache_dir = cache_dir
+        self.on_ready = on_ready
+        self.memory = ThumbnailCache(max_bytes)
+        self.max_disk_bytes = max_disk_bytes
+        self.missing_retry = missing_retry
+        self.disk_bytes = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='artwork')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.executor.submit(self.prune_disk)  # Also counts what's there, off the startup path
+
+    def cache_key(self, path, size):
+        stat = os.stat(path)
+        width, height = (-(-int(side) // SIZE_STEP) * SIZE_STEP for side in size)
+        raw = f'{path}|{stat.st_mtime}|{stat.st_size}|{width}x{height}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest(), (width, height)
+
+    def request(self, path, size):
+        try:
+            key, size = self.cache_key(path, size)
+        except OSError:
+            return None
+        thumb = self.memory.get(key)
+        if thumb is None:
+            self.executor.submit(self.load, path, key, size)
+        return thumb
+
+    def load(self, path, key, size):
+        disk_path = os.path.join(self.cache_dir, key + '.png')
+        missing_path = os.path.join(self.cache_dir, key + '.none')
+        thumb = None
+        try:
+            if os.path.exists(disk_path):
+                from PIL import Image as PILImage
+                with PILImage.open(disk_path) as image:
+                    image = image.convert('RGBA')
+                os.utime(disk_path)  # Recently used, so pruning keeps it
+            elif self.recently_missing(missing_path):
+                image = None
+            else:
+                data = extract_cover(path)
+                image = make_thumbnail(data, size) if data else None
+                if image is None:
+                    open(missing_path, 'w').close()  # Remember "no art" so we don't search again for a while
+                    self.disk_bytes += disk_usage(0)
+                else:
+                    image.save(disk_path)
+                    self.disk_bytes += disk_usage(os.path.getsize(disk_path))
+                if self.disk_bytes > self.max_disk_bytes:
+                    self.prune_disk()
+            if image is not None:
+                thumb = Thumbnail(image.width, image.height, image.tobytes())
+                self.memory.put(key, thumb)
+        except Exception as e:
+            logger.warning("Error loading cover art: %s", e)
+        self.on_ready(path, thumb)
+
+    def recently_missing(self, missing_path):
+        try:
+            age = time.time() - os.path.getmtime(missing_path)
+        except OSError:
+            return False
+        if age <= self.missing_retry:
+            return True
+        os.remove(missing_path)
+        self.disk_bytes -= disk_usage(0)
+        return False
+
+    def prune_disk(self):
+        # Runs on the worker: drops expired "no art" markers, then the least recently used files
+        # until the cache is well under its limit, so it isn't listed again for every new cover
+        now = time.time()
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.cache_dir) as listing:
+                for entry in listing:
+                    try:
+                        stat = entry.stat()
+                        if entry.name.endswith('.none') and now - stat.st_mtime > self.missing_retry:
+                            os.remove(entry.path)
+                            continue
+                    except OSError:
+                        continue
+                    usage = disk_usage(stat.st_size)
+                    entries.append((stat.st_mtime, entry.path, usage))
+                    total += usage
+            if total > self.max_disk_bytes:
+                entries.sort()
+                for _, path, usage in entries:
+                    if total <= self.max_disk_bytes * 3 // 4:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= usage
+        except OSError as e:
+            logger.warning("Error pruning the artwork cache: %s", e)
+        self.disk_bytes = total
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,305 @@
+import io
+import struct
+
+import numpy as np
+
+from formats import decode_blocks, read_tags
+
+BLOCK_FRAMES = 2048  # Frames processed per call; all buffers are sized for this once
+SUB_FRAMES = 32  # Frames per sub-block in the block biquad solve (see Biquad)
+LIMITER_CEILING = 0.98  # Peak output level, a little under full scale
+LIMITER_RELEASE = 0.3  # Seconds for the limiter gain to recover from silence to 1
+
+class Biquad:
+    # One biquad section run a block at a time without a per-sample loop. The feed-forward half
+    # is three shifted multiply-adds. The recursive half is linear, so each sub-block of M frames
+    # comes out as its response from rest (one matmul by an M x M matrix for every sub-block and
+    # channel at once) plus its response to the two outputs before it (an M x 2 matmul). Those
+    # two outputs for every sub-block follow from the rest responses through powers of the
+    # M-step state transition, one more matmul. The matrices are built when the coefficients are
+    # set, and every buffer is allocated up front. Signals are planar, (channels, frames), so a
+    # channel's sub-blocks are consecutive rows and none of this needs a transposed copy.
+    def __init__(self, coefficients, channels, block_frames=BLOCK_FRAMES, sub_frames=SUB_FRAMES):
+        self.m = m = sub_frames
+        self.k = k = block_frames // sub_frames
+        self.channels = channels
+        self.x_history = np.zeros((channels, 2))  # x[-2], x[-1]
+        self.y_history = np.zeros((channels, 2))  # y[-1], y[-2]
+        self.padded = np.zeros((channels, block_frames + 2))
+        self.scratch = np.empty((channels, block_frames))
+        self.feed_forward = np.empty((channels, block_frames))
+        self.states = np.empty((channels, 2 * k))  # Start state of sub-block 0, then rest end states
+        self.solved = np.empty((channels, 2 * k))
+        self.correction = np.empty((channels * k, m))
+        self.set_coefficients(coefficients)
+
+    def set_coefficients(self, coefficients):
+        self.b0, self.b1, self.b2, a1, a2 = coefficients
+        m, k = self.m, self.k
+
+        def all_pole(y1, y2, impulse):
+            # m outputs of y[n] = x[n] - a1 y[n-1] - a2 y[n-2] from the given previous outputs
+            out = np.zeros(m)
+            for n in range(m):
+                out[n] = (impulse if n == 0 else 0.0) - a1 * y1 - a2 * y2
+                y1, y2 = out[n], y1
+            return out
+
+        h = all_pole(0.0, 0.0, 1.0)
+        impulse = np.zeros((m, m))
+        for n in range(m):
+            impulse[n:, n] = h[:m - n]
+        from_state = np.column_stack((all_pole(1.0, 0.0, 0.0), all_pole(0.0, 1.0, 0.0)))
+        step = from_state[[m - 1, m - 2]]  # (y[m-1], y[m-2]) from (y[-1], y[-2])
+        powers = [np.eye(2)]
+        for _ in range(k):
+            powers.append(step @ powers[-1])
+        # Start state of sub-block i = step^i s0 + sum over j < i of step^(i-1-j) e_j
+        propagate = np.zeros((2 * k, 2 * k))
+        for i in range(k):
+            propagate[2 * i:2 * i + 2, 0:2] = powers[i]
+            for j in range(i):
+                propagate[2 * i:2 * i + 2, 2 * j + 2:2 * j + 4] = powers[i - 1 - j]
+        # Stored transposed, as the right-hand operand for row-per-sub-block signals
+        self.impulse_t = np.ascontiguousarray(impulse.T)
+        self.from_state_t = np.ascontiguousarray(from_state.T)
+        self.propagate_t = np.ascontiguousarray(propagate.T)
+
+    def reset(self):
+        self.x_history.fill(0.0)
+        self.y_history.fill(0.0)
+
+    def process(self, x, out, frames):
+        # x and out are (channels, block_frames); state carries on from frame `frames`
+        m, k, c = self.m, self.k, self.channels
+        padded = self.padded
+        padded[:, :2] = self.x_history
+        padded[:, 2:] = x
+        self.x_history[:] = padded[:, frames:frames + 2]
+        feed_forward = self.feed_forward
+        np.multiply(padded[:, 2:], self.b0, out=feed_forward)
+        np.multiply(padded[:, 1:-1], self.b1, out=self.scratch)
+        feed_forward += self.scratch
+        np.multiply(padded[:, :-2], self.b2, out=self.scratch)
+        feed_forward += self.scratch
+        rest = out.reshape(c * k, m)
+        np.matmul(feed_forward.reshape(c * k, m), self.impulse_t, out=rest)
+        rest = out.reshape(c, k, m)
+        states = self.states
+        states[:, 0:2] = self.y_history
+        states[:, 2::2] = rest[:, :k - 1, m - 1]
+        states[:, 3::2] = rest[:, :k - 1, m - 2]
+        np.matmul(states, self.propagate_t, out=self.solved)
+        np.matmul(self.solved.reshape(c * k, 2), self.from_state_t, out=self.correction)
+        out += self.correction.reshape(c, k * m)
+        self.y_history[:, 1] = out[:, frames - 2] if frames > 1 else self.y_history[:, 0]
+        self.y_history[:, 0] = out[:, frames - 1]
+
+
+class Limiter:
+    # Peak limiter with one sub-block of look-ahead inside each block: each sub-block's gain is
+    # the most it and the next sub-block can take without going over the ceiling, rising back by
+    # at most 1 / LIMITER_RELEASE per second, and ramps linearly from the previous sub-block's.
+    # The release recursion g = min(target, g' + step) has a closed form (a running minimum), so
+    # there's no per-sample or per-sub-block loop. Where a peak starts a block, the ramp is cut
+    # down to that sub-block's own target instead.
+    def __init__(self, rate, channels, block_frames=BLOCK_FRAMES, sub_frames=SUB_FRAMES):
+        self.m = sub_frames
+        self.k = block_frames // sub_frames
+        self.step = sub_frames / (rate * LIMITER_RELEASE)
+        self.ramp = np.arange(self.k) * self.step
+        self.fraction = (np.arange(self.m) + 1.0) / self.m
+        self.gain = 1.0
+        self.magnitude = np.empty((channels, block_frames))
+        self.peaks = np.empty(self.k)
+        self.targets = np.empty(self.k)
+        self.ahead = np.empty(self.k)
+        self.gains = np.empty(self.k)
+        self.previous = np.empty(self.k)
+        self.envelope = np.empty((self.k, self.m))
+
+    def reset(self):
+        self.gain = 1.0
+
+    def process(self, x, frames):
+        np.abs(x, out=self.magnitude)
+        np.max(self.magnitude.reshape(-1, self.k, self.m), axis=(0, 2), out=self.peaks)
+        np.maximum(self.peaks, LIMITER_CEILING, out=self.peaks)
+        np.divide(LIMITER_CEILING, self.peaks, out=self.targets)
+        np.minimum(self.targets[:-1], self.targets[1:], out=self.ahead[:-1])
+        self.ahead[-1] = self.targets[-1]
+        gains = self.gains
+        np.subtract(self.ahead, self.ramp, out=gains)
+        np.minimum.accumulate(gains, out=gains)
+        gains += self.ramp
+        np.add(self.ramp, self.gain + self.step, out=self.previous)
+        np.minimum(gains, self.previous, out=gains)
+        self.previous[0] = self.gain
+        self.previous[1:] = gains[:-1]
+        np.subtract(gains, self.previous, out=self.peaks)
+        np.multiply(self.peaks[:, None], self.fraction, out=self.envelope)
+        self.envelope += self.previous[:, None]
+        np.minimum(self.envelope, self.targets[:, None], out=self.envelope)
+        sub_blocks = x.reshape(-1, self.k, self.m)
+        sub_blocks *= self.envelope
+        self.gain = gains[(frames - 1) // self.m]
+
+
+class EqualizerChain:
+    # Preamp, bands and limiter for one stream at a fixed rate and channel count. process() takes
+    # up to BLOCK_FRAMES float frames and returns 16-bit PCM in a buffer reused by the next call.
+    # Audio is made planar on the way in and interleaved again on the way out, once per block.
+    def __init__(self, rate, channels, preset=None, block_frames=BLOCK_FRAMES):
+        self.rate = rate
+        self.channels = channels
+        self.block_frames = block_frames
+        self.preset = None
+        self.sections = []
+        self.limiter = Limiter(rate, channels, block_frames)
+        self.buffers = (np.zeros((channels, block_frames)), np.zeros((channels, block_frames)))
+        self.pcm = np.zeros((block_frames, channels), dtype=np.int16)
+        self.set_preset(preset)
+
+    def set_preset(self, preset):
+        # Sections are rebuilt only here; ones that carry over keep their state, so there's no click
+        if preset is self.preset:
+            return
+        self.preset = preset
+        bands = [band.coefficients(self.rate) for band in preset.bands] if preset else []
+        coefficients = [c for c in bands if c is not None]
+        sections = self.sections[:len(coefficients)]
+        for section, c in zip(sections, coefficients):
+            section.set_coefficients(c)
+        sections.extend(Biquad(c, self.channels, self.block_frames) for c in coefficients[len(sections):])
+        self.sections = sections
+        self.preamp = 10.0 ** (preset.preamp / 20.0) if preset else 1.0
+
+    def reset(self):
+        for section in self.sections:
+            section.reset()
+        self.limiter.reset()
+
+    def process(self, block):
+        frames = len(block)
+        x, y = self.buffers
+        x[:, :frames] = block.T
+        x[:, frames:] = 0.0
+        if self.preset is not None:
+            if self.preamp != 1.0:
+                x *= self.preamp
+            for section in self.sections:
+                section.process(x, y, frames)
+                x, y = y, x
+            if self.preset.limiter:
+                self.limiter.process(x, frames)
+        np.clip(x, -1.0, 1.0, out=x)
+        x *= 32767.0
+        np.copyto(self.pcm, x.T, casting='unsafe')
+        return self.pcm[:frames]
+
+
+def wav_header(rate, channels, frames):
+    data_size = frames * channels * 2
+    return b''.join((
+        b'RIFF', struct.pack('<I', 36 + data_size), b'WAVE',
+        b'fmt ', struct.pack('<IHHIIHH', 16, 1, channels, rate, rate * channels * 2, channels * 2, 16),
+        b'data', struct.pack('<I', data_size),
+    ))
+
+
+class EqualizedSource(io.RawIOBase):
+    # A track decoded, run through the equalizer and read as a 16-bit WAV file, for StreamServer
+    # to hand to the sound backend. The length comes from the tags so the header is right from the
+    # first byte and Range requests work; decoded audio is padded or cut to match. A read away from
+    # the current block restarts the decoder at that time with fresh filter state. preset_of() is
+    # checked every block, so switching presets applies mid-track; None passes the audio through.
+    def __init__(self, path, preset_of):
+        self.path = path
+        self.preset_of = preset_of
+        duration = read_tags(path)['duration']
+        self.blocks = decode_blocks(path)
+        try:
+            rate, block = next(self.blocks)
+        except StopIteration:
+            raise ValueError(f"Nothing decoded from {path}")
+        if not duration:
+            raise ValueError(f"Unknown length: {path}")
+        self.rate = rate
+        self.channels = block.shape[1]
+        self.frame_size = 2 * self.channels
+        self.frames = int(round(duration * rate))
+        self.header = wav_header(rate, self.channels, self.frames)
+        self.size = len(self.header) + self.frames * self.frame_size
+        self.chain = EqualizerChain(rate, self.channels, preset_of())
+        self.block = block  # Decoded audio not processed yet
+        self.pcm = memoryview(b'')  # Processed audio not read yet, starting at frame self.pcm_frame
+        self.pcm_frame = 0
+        self.next_frame = 0  # First frame of the next processed chunk
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.offset < len(self.header):
+            count = min(len(buffer), len(self.header) - self.offset)
+            buffer[:count] = self.header[self.offset:self.offset + count]
+            self.offset += count
+            return count
+        position = self.offset - len(self.header)
+        start = self.pcm_frame * self.frame_size
+        if not start <= position < start + len(self.pcm):
+            frame = position // self.frame_size
+            if frame >= self.frames:
+                return 0
+            if frame != self.next_frame:
+                self.restart(frame)
+            if not self.fill():
+                return 0
+            start = self.pcm_frame * self.frame_size
+        count = min(len(buffer), start + len(self.pcm) - position)
+        buffer[:count] = self.pcm[position - start:position - start + count]
+        self.offset += count
+        return count
+
+    def fill(self):
+        # Processes the next chunk into self.pcm; False at the end of the track
+        remaining = self.frames - self.next_frame
+        if remaining <= 0:
+            return False
+        while self.block is not None and not len(self.block):
+            self.block = next(self.blocks, (None, None))[1]
+        count = min(self.chain.block_frames, remaining)
+        if self.block is None:
+            chunk = np.zeros((count, self.channels), dtype=np.float32)  # Decoded short of the tagged length
+        else:
+            chunk, self.block = self.block[:count], self.block[count:]
+        self.chain.set_preset(self.preset_of())
+        self.pcm = memoryview(self.chain.process(chunk)).cast('B')
+        self.pcm_frame = self.next_frame
+        self.next_frame += len(chunk)
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.offset, io.SEEK_END: self.size}[whence]
+        self.offset = max(0, base + offset)  # The decoder is restarted by the next read if need be
+        return self.offset
+
+    def restart(self, frame):
+        self.blocks.close()
+        self.blocks = decode_blocks(self.path, frame / self.rate)
+        self.block = np.zeros((0, self.channels), dtype=np.float32)
+        self.chain.reset()
+        self.pcm = memoryview(b'')
+        self.pcm_frame = self.next_frame = frame
+
+    def tell(self):
+        return self.offset
+
+    def close(self):
+        if not self.closed:
+            self.blocks.close()
+        super().close()
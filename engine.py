@@ -0,0 +1,749 @@
+import logging
+import os
+import threading
+import time
+import wave
+
+from equalizer import load_eq_presets
+from formats import can_decode
+from history import PlayHistory
+from instrumentation import instruments
+from loader import TrackLoader
+from loudness import LoudnessAnalyzer
+from metadata import MetadataStore, TagIndexer
+from playback import PlaybackClock
+from playlist import Playlist, PlayOrder
+from playlists import CatalogStore, PlaylistCatalog
+from scanner import LibraryScanner
+from search import SearchIndex
+from smartlists import SmartResults, load_smart_playlists
+from storage import PlaylistStore
+from streaming import StreamServer, is_url, open_source
+from transitions import CURVES, FADE_STEP, HANDOFF_SLACK, Crossfade
+
+logger = logging.getLogger(__name__)
+
+
+def call_later(delay, callback):
+    # Headless stand-in for the UI clock: runs callback on a timer thread; the handle has cancel()
+    timer = threading.Timer(delay, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def call_now(callback):
+    callback()
+
+
+class EngineListener:
+    # Events PlayerEngine reports to its owner. The UI implements these; headless callers can
+    # use this class as-is or override only what they need.
+    def track_loading(self, song):
+        pass
+
+    def track_started(self, index, song):
+        pass
+
+    def track_failed(self, song, error):
+        pass
+
+    def playback_toggled(self, playing):
+        pass
+
+    def playlist_reset(self):
+        pass
+
+    def playlist_opened(self, name):
+        pass
+
+    def songs_added(self, songs):
+        pass
+
+    def tags_updated(self, paths):
+        pass
+
+    def search_ready(self):
+        pass
+
+    def smart_playlists_updated(self):
+        pass
+
+    def duplicates_found(self, groups):
+        pass
+
+    def state_changed(self):
+        pass
+
+
+class PlayerEngine:
+    # The player without a window: playlist, play order, track loading and playback, persistence
+    # and tag lookups. Worker threads hand results back through schedule(callback), which the UI
+    # points at its main loop; headless callers can leave it running callbacks immediately.
+    def __init__(self, playlist_file, load_sound, listener=None, schedule=call_now, time_source=time.monotonic,
+                 stream_local_from=None, schedule_later=call_later, content_dedup=False):
+        self.playlist_file = playlist_file
+        self.load_sound = load_sound
+        self.listener = listener or EngineListener()
+        self.schedule = schedule
+        self.schedule_later = schedule_later  # (delay, callback) -> handle with cancel(); runs on the owner thread
+        self.time_source = time_source
+        self.stream_local_from = stream_local_from  # Local files this size or larger are streamed too
+        self.stream_server = None  # Started on the first streamed track
+        self.content_dedup = content_dedup  # Also reject copies of a song that sit at another path
+
+        self.sound = None
+        self.current_index = 0
+        self.current_song = None
+        self.repeat_one = False
+        self.volume = 1.0
+        self.load_token = 0
+        self.resume_at = None
+
+        # Track transitions: the next track is started from the known length of this one instead
+        # of waiting for its stop event. Consecutive tracks from one album are joined gaplessly.
+        self.crossfade_seconds = 0.0
+        self.crossfade_curve = 'equal_power'
+        self.gapless_albums = True
+        self.handoff_event = None
+        self.fade_event = None
+        self.outgoing = None  # (sound, ends_at) between a handoff and the next track starting
+        self.crossfade = None
+        self.listen_started = None  # (song, wall-clock start) of the listen in progress
+
+        library_dir = os.path.dirname(os.path.abspath(playlist_file))
+        self.library_db = os.path.join(library_dir, 'library.db')
+        # playlist.json is the library; named playlists live in library.db and are read when opened
+        self.library_store = PlaylistStore(playlist_file)
+        self.playlists = PlaylistCatalog(self.library_db)
+        state = self.library_store.load_state()
+        self.playlist_name = state.get('playlist')
+        if self.playlist_name not in self.playlists:
+            self.playlist_name = None
+        self.playlist_store = self.store_for(self.playlist_name)
+        self.load_playlist()
+        self.metadata = MetadataStore(self.library_db)
+        self.tag_indexer = TagIndexer(self.metadata, on_indexed=lambda paths: self.schedule(
+            lambda: self.tags_indexed(paths)))
+        self.library_scanner = LibraryScanner(self.library_db)
+        self.loudness = LoudnessAnalyzer(self.library_db, on_analyzed=lambda paths: self.schedule(
+            lambda: self.loudness_analyzed(paths)))
+        self.fingerprints = None  # FingerprintIndex, opened by the first find_duplicates()
+        self.duplicate_groups = None  # Last find_duplicates() result for the open playlist
+        self.play_order = PlayOrder(self.playlist, artist_of=self.artist_of)
+        self.track_loader = TrackLoader(self.open_track)
+        self.playback_clock = PlaybackClock(time_source)
+        self.search_index = None
+        self.search_pending = None  # Paths that changed while the search index was being built
+        self.history = PlayHistory(self.library_db)
+        self.smart_playlists = load_smart_playlists(os.path.join(library_dir, 'smart_playlists.json'))
+        self.smart_results = {}  # name -> SmartResults, evaluated as far as the UI has asked
+        self.eq_presets = load_eq_presets(os.path.join(library_dir, 'eq_presets.json'))
+        self.equalizer = None  # EqPreset in use, None for plain playback
+        self.restore_state(state)
+
+    def store_for(self, name):
+        return self.library_store if name is None else CatalogStore(self.playlists, name)
+
+    def load_playlist(self):
+        # Songs already in the saved playlist aren't stat'ed or hashed at startup; only new additions are
+        self.playlist = Playlist(self.playlist_store.load())
+        self.playlist.content_dedup = self.content_dedup
+
+    def close(self):
+        self.flush()
+        self.finish_listen()
+        self.finish_transition()
+        self.playlist_store.compact(self.playlist.songs)
+        self.track_loader.shutdown()
+        if self.stream_server:
+            self.stream_server.shutdown()
+        self.tag_indexer.shutdown()
+        self.loudness.close()
+        if self.fingerprints:
+            self.fingerprints.close()
+        self.history.close()
+        self.playlists.close()
+        self.metadata.close()
+
+    # Playback
+
+    def play(self):
+        switch_started = time.perf_counter()
+        if not self.outgoing:
+            self.finish_transition()  # A manual skip cuts any fade short
+        self.finish_listen()
+        self.playback_clock.detach()
+        if self.sound:
+            self.sound.stop()
+            self.sound.unload()
+            self.sound = None
+        if not self.current_song:
+            self.listener.track_failed(None, "No song selected")
+            return
+        # Any load still in flight for an older request is dropped when it completes
+        self.load_token += 1
+        token = self.load_token
+        warm = self.track_loader.is_ready(self.current_song)
+        future = self.track_loader.take(self.current_song)
+        if future.done():
+            self.start_sound(future, token, switch_started, warm)
+        else:
+            self.listener.track_loading(self.current_song)
+            future.add_done_callback(lambda f: self.schedule(
+                lambda: self.start_sound(f, token, switch_started, warm)))
+
+    def start_sound(self, future, token, switch_started, warm):
+        sound = None if future.exception() else future.result()
+        if token != self.load_token:
+            if sound:
+                sound.unload()
+            return
+        self.sound = sound
+        if not self.sound:
+            self.finish_transition()
+            self.listener.track_failed(self.current_song, future.exception() or "Failed to load sound")
+            return
+        # on_stop is dispatched mid-way through the sound's own update, so switch tracks afterwards
+        self.playback_clock.start(self.sound, on_track_end=lambda: self.schedule(self.track_ended),
+                                  position=self.resume_position())
+        self.resume_at = None
+        self.sound.volume = self.effective_volume()
+        self.start_crossfade()
+        self.schedule_handoff()
+        self.listen_started = (self.current_song, time.time())
+        elapsed = time.perf_counter() - switch_started
+        instruments.record('track.switch', elapsed, switch_started)
+        elapsed_ms = elapsed * 1000
+        logger.info("Playing: %s (%s start in %.1f ms)", self.current_song, 'warm' if warm else 'cold', elapsed_ms)
+        self.listener.track_started(self.current_index, self.current_song)
+        self.listener.state_changed()
+        self.preload_next()
+
+    def finish_listen(self):
+        # Logs the listen in progress as a play or a skip, depending on how far it got
+        if not self.listen_started:
+            return
+        song, started = self.listen_started
+        self.listen_started = None
+        self.history.record(song, started, self.playback_clock.position(), self.playback_clock.length())
+        self.update_smart_playlists([song])
+
+    def open_track(self, song):
+        # Runs on the loader thread. URLs, and local files of at least stream_local_from bytes, reach
+        # the sound backend through the loopback stream server instead of as a plain path. With the
+        # equalizer on, local files go through it too, decoded and equalized on the way.
+        location = song
+        equalize = self.equalizer is not None and not is_url(song) and can_decode(song)
+        if equalize or is_url(song) or (self.stream_local_from is not None and
+                                        os.path.getsize(song) >= self.stream_local_from):
+            if self.stream_server is None:
+                self.stream_server = StreamServer()
+            if equalize:
+                location = self.stream_server.url_for(song, opener=self.open_equalized, extension='.wav')
+            else:
+                location = self.stream_server.url_for(song)
+        return self.load_sound(location)
+
+    def open_equalized(self, path):
+        # Runs on a stream server thread; a file the equalizer can't take is served as it is
+        from dsp import EqualizedSource  # Imported on first use to keep it out of app startup
+        try:
+            return EqualizedSource(path, preset_of=lambda: self.equalizer)
+        except (OSError, ValueError, EOFError, wave.Error) as e:
+            logger.warning("Playing without the equalizer: %s", e)
+            return open_source(path)
+
+    def toggle_play(self):
+        if not self.sound:
+            self.play()
+            return
+        if self.playback_clock.playing:
+            self.finish_transition()
+            self.playback_clock.pause()
+            self.listener.state_changed()
+        else:
+            self.playback_clock.resume()
+            self.schedule_handoff()
+        self.listener.playback_toggled(self.playback_clock.playing)
+
+    def seek(self, position):
+        self.playback_clock.seek(position)
+        self.schedule_handoff()
+        self.listener.state_changed()
+
+    def set_volume(self, volume):
+        self.volume = volume
+        if self.sound:
+            self.sound.volume = self.effective_volume()
+        if self.crossfade:
+            self.crossfade.in_volume = self.effective_volume()
+        self.listener.state_changed()
+
+    def set_equalizer(self, name):
+        # None switches it off. A track already going through the equalizer changes preset (or is
+        # passed through unchanged) within a block; one that isn't picks it up from the next track.
+        if name is not None and name not in self.eq_presets:
+            raise ValueError(f"Unknown equalizer preset: {name}")
+        self.equalizer = self.eq_presets.get(name)
+        logger.info("Equalizer: %s", name or 'off')
+        self.listener.state_changed()
+
+    def effective_volume(self):
+        # The slider value scaled by the current track's normalization gain
+        return self.volume * self.loudness.gain_for(self.current_song)
+
+    def loudness_analyzed(self, paths):
+        if self.sound and self.current_song in paths:
+            self.sound.volume = self.effective_volume()
+            if self.crossfade:
+                self.crossfade.in_volume = self.effective_volume()
+
+    def track_ended(self):
+        if self.repeat_one:
+            self.play()
+        else:
+            self.next()
+
+    # Transitions
+
+    def set_crossfade(self, seconds, curve=None):
+        if curve is not None and curve not in CURVES:
+            raise ValueError(f"Unknown crossfade curve: {curve}")
+        self.crossfade_seconds = max(0.0, seconds)
+        self.crossfade_curve = curve or self.crossfade_curve
+        self.schedule_handoff()
+        self.listener.state_changed()
+
+    def transition_overlap(self):
+        # Seconds the next track overlaps this one; 0 means a gapless join at the exact end
+        if not self.crossfade_seconds or not self.playlist:
+            return 0.0
+        if self.gapless_albums:
+            album = (self.track_info(self.current_song) or {}).get('album')
+            next_info = self.track_info(self.playlist[self.next_index()]) or {}
+            if album and album == next_info.get('album'):
+                return 0.0
+        return self.crossfade_seconds
+
+    def schedule_handoff(self):
+        # Re-armed whenever the position can jump: track start, seek, resume, setting changes
+        if self.handoff_event:
+            self.handoff_event.cancel()
+            self.handoff_event = None
+        clock = self.playback_clock
+        length = clock.length()
+        if not self.sound or not clock.playing or not length or self.repeat_one or not self.playlist:
+            return  # Track end falls back to the sound's own stop event
+        overlap = min(self.transition_overlap(), length / 2)
+        delay = max(0.0, length - overlap - clock.position())
+        self.handoff_event = self.schedule_later(delay, lambda: self.handoff(overlap))
+
+    def handoff(self, overlap):
+        self.handoff_event = None
+        clock = self.playback_clock
+        if not self.sound or not clock.playing:
+            return
+        remaining = clock.length() - clock.position()
+        if remaining > overlap + HANDOFF_SLACK:
+            # The timer came early (or the backend clock lagged): wait out the rest
+            self.handoff_event = self.schedule_later(remaining - overlap, lambda: self.handoff(overlap))
+            return
+        # The outgoing sound keeps playing on its own; the clock lets go so its stop event is ignored
+        self.outgoing = (self.sound, self.time_source() + max(remaining, 0.0))
+        self.finish_listen()
+        clock.detach()
+        self.sound = None
+        self.current_index = self.play_order.next(self.current_index)
+        self.current_song = self.playlist[self.current_index]
+        self.play()
+
+    def start_crossfade(self):
+        if not self.outgoing:
+            return
+        if self.crossfade:
+            # The track that just ended was shorter than the fade into it: that fade is cut short
+            # so the sound before it is released, and the new one starts from full volume
+            self.fade_event.cancel()
+            self.crossfade.finish()
+        outgoing, ends_at = self.outgoing
+        self.outgoing = None
+        duration = max(0.0, ends_at - self.time_source())
+        curve = self.crossfade_curve if duration > HANDOFF_SLACK and self.crossfade_seconds else 'gapless'
+        self.crossfade = Crossfade(outgoing, outgoing.volume, self.sound, self.effective_volume(), duration,
+                                   curve=curve, time_source=self.time_source)
+        self.fade_tick()
+
+    def fade_tick(self):
+        self.fade_event = None
+        if self.crossfade.step():
+            self.crossfade = None
+        else:
+            self.fade_event = self.schedule_later(FADE_STEP, self.fade_tick)
+
+    def finish_transition(self):
+        for event in (self.handoff_event, self.fade_event):
+            if event:
+                event.cancel()
+        self.handoff_event = self.fade_event = None
+        if self.crossfade:
+            self.crossfade.finish()
+            self.crossfade = None
+        if self.outgoing:
+            sound, _ = self.outgoing
+            sound.stop()
+            sound.unload()
+            self.outgoing = None
+
+    # Navigation
+
+    def play_index(self, index):
+        self.play_order.jump(self.current_index, index)
+        self.current_index = index
+        self.current_song = self.playlist[index]
+        self.play()
+
+    def next(self):
+        if self.playlist:
+            self.current_index = self.play_order.next(self.current_index)
+            self.current_song = self.playlist[self.current_index]
+            self.play()
+
+    def previous(self):
+        if self.playlist:
+            self.current_index = self.play_order.previous(self.current_index)
+            self.current_song = self.playlist[self.current_index]
+            self.play()
+
+    def next_index(self):
+        if self.repeat_one:
+            return self.current_index
+        return self.play_order.peek_next(self.current_index)
+
+    def preload_next(self):
+        # Open the track that will follow this one so the handoff at track end is immediate
+        if self.playlist:
+            self.track_loader.preload(self.playlist[self.next_index()])
+
+    def toggle_repeat(self):
+        self.repeat_one = not self.repeat_one
+        self.preload_next()
+        self.schedule_handoff()
+        self.listener.state_changed()
+        return self.repeat_one
+
+    def toggle_shuffle(self):
+        # Only the play order changes; the stored playlist stays as it is
+        self.play_order.set_shuffle(not self.play_order.shuffle, current=self.current_index)
+        self.preload_next()
+        self.schedule_handoff()
+        self.listener.state_changed()
+        return self.play_order.shuffle
+
+    # Library
+
+    def add_path(self, path):
+        # Returns the song's index; a file rejected as a copy resolves to the song it duplicates
+        index = self.playlist.find(path)
+        if index is not None:
+            return index
+        if not self.playlist.append(path):
+            return self.playlist.duplicate_of(path)
+        self.playlist_store.record_add([path])
+        self.update_search([path])
+        self.update_smart_playlists([path])
+        self.listener.songs_added([path])
+        self.listener.state_changed()
+        self.tag_indexer.scan([path])
+        self.loudness.analyze([path])
+        return len(self.playlist) - 1
+
+    def select_path(self, path):
+        index = self.add_path(path)
+        if index is None:
+            self.current_song = path
+        else:
+            self.play_order.jump(self.current_index, index)
+            self.current_index = index
+            self.current_song = self.playlist[index]
+        self.play()
+
+    def scan_folder(self, path):
+        threading.Thread(target=self.run_scan, args=(path,), daemon=True).start()
+
+    def run_scan(self, path):
+        # Runs on a worker thread; each batch of changes is applied on the owner thread as it arrives
+        counts = self.library_scanner.scan(path, self.on_scan_changes)
+        logger.info("Scanned %s: %s", path, counts)
+        return counts
+
+    def on_scan_changes(self, added, modified, removed):
+        # Still on the scan thread: for content dedup, stat new files here rather than on the UI thread.
+        # Only files whose size matches another song's are then hashed.
+        sizes = {}
+        if self.content_dedup:
+            for song in added:
+                try:
+                    sizes[song] = os.path.getsize(song)
+                except OSError:
+                    pass
+        self.schedule(lambda: self.apply_scan_changes(added, modified, removed, sizes))
+
+    def apply_scan_changes(self, added, modified, removed, sizes=None):
+        removed = self.playlist.remove_many(removed)
+        if removed:
+            index = self.playlist.find(self.current_song) if self.current_song else None
+            self.current_index = index if index is not None else min(self.current_index, max(len(self.playlist) - 1, 0))
+            self.play_order.reset()
+            self.play_order.clear_history()
+            self.playlist_store.record_remove(removed)
+            self.update_search(removed)
+            self.smart_results.clear()  # "added" order is playlist position, which just shifted
+            self.listener.playlist_reset()
+        new_songs = self.playlist.extend(added, sizes)
+        if new_songs:
+            self.playlist_store.record_add(new_songs)
+            self.update_search(new_songs)
+            self.update_smart_playlists(new_songs)
+            self.listener.songs_added(new_songs)
+        if removed or new_songs:
+            self.listener.state_changed()
+        self.tag_indexer.scan(new_songs + modified)
+        self.loudness.analyze(new_songs + modified)
+
+    def index_tags(self):
+        self.tag_indexer.scan(self.playlist)
+        self.loudness.analyze(self.playlist)
+
+    def tags_indexed(self, paths):
+        self.update_search(paths)
+        self.update_smart_playlists(paths)
+        self.listener.tags_updated(paths)
+
+    # Playlists
+
+    def open_playlist(self, name):
+        # Makes another playlist the one being played and edited (None: the library). The current
+        # track keeps playing; if the new list doesn't have it, next() starts from the top.
+        if name == self.playlist_name:
+            return
+        if name is not None and name not in self.playlists:
+            raise ValueError(f"No such playlist: {name}")
+        self.flush()
+        self.playlist_name = name
+        self.playlist_store = self.store_for(name)
+        self.load_playlist()
+        shuffle = self.play_order.shuffle
+        self.play_order = PlayOrder(self.playlist, artist_of=self.artist_of)
+        index = self.playlist.find(self.current_song) if self.current_song else 0
+        self.current_index = index if index is not None else -1
+        if shuffle:
+            self.play_order.set_shuffle(True, current=self.current_index)
+        # Search and smart playlist results described the old list
+        rebuild_search = self.search_index is not None or self.search_pending is not None
+        self.search_index = self.search_pending = None
+        if rebuild_search:
+            self.build_search_index()
+        self.smart_results.clear()
+        self.duplicate_groups = None
+        self.index_tags()
+        if self.sound:
+            self.preload_next()
+            self.schedule_handoff()
+        self.listener.playlist_opened(name)
+        self.listener.state_changed()
+
+    def create_playlist(self, name, songs=()):
+        self.playlists.create(name, songs)
+
+    def delete_playlist(self, name):
+        if name == self.playlist_name:
+            self.open_playlist(None)
+        self.playlists.delete(name)
+
+    def add_to_playlist(self, name, songs):
+        # Adds songs to a named playlist without opening it
+        if name == self.playlist_name:
+            for song in songs:
+                self.add_path(song)
+            return
+        self.playlists.append(name, songs)
+
+    # Duplicates
+
+    def find_duplicates(self):
+        # Fingerprints the open playlist in the background (cached fingerprints are reused) and
+        # reports groups of the same recording through listener.duplicates_found
+        if self.fingerprints is None:
+            from fingerprint import FingerprintIndex  # Imported on first use to keep it out of app startup
+            self.fingerprints = FingerprintIndex(self.library_db)
+        playlist = self.playlist
+        self.fingerprints.find_duplicates(list(playlist), on_done=lambda groups: self.schedule(
+            lambda: self.duplicates_checked(playlist, groups)))
+
+    def duplicates_checked(self, playlist, groups):
+        if playlist is not self.playlist:
+            return  # Another playlist was opened meanwhile
+        self.duplicate_groups = [[path for path in group if path in playlist] for group in groups]
+        self.duplicate_groups = [group for group in self.duplicate_groups if len(group) > 1]
+        self.listener.duplicates_found(self.duplicate_groups)
+
+    def merge_duplicates(self):
+        # Keeps one copy from each group found by find_duplicates (the highest bitrate, then the
+        # earliest in the list) and removes the others from the playlist; files stay on disk
+        removed = []
+        for group in self.duplicate_groups or ():
+            keep = max(group, key=lambda path: ((self.metadata.cached(path) or {}).get('bitrate') or 0,
+                                                -group.index(path)))
+            removed.extend(path for path in group if path != keep)
+        self.duplicate_groups = None
+        if removed:
+            logger.info("Merged %d duplicate tracks", len(removed))
+            self.apply_scan_changes([], [], removed)
+        return removed
+
+    # Smart playlists
+
+    def smart_playlist(self, name, limit=500):
+        # Playlist indices for the first `limit` rows of a smart playlist, in its own order
+        results = self.smart_results.get(name)
+        if results is None:
+            results = self.smart_results[name] = SmartResults(self.smart_playlists[name], self.metadata,
+                                                              self.history, self.playlist)
+        indices = (self.playlist.find(path) for path in results.take(limit))
+        return [index for index in indices if index is not None]
+
+    def update_smart_playlists(self, paths):
+        changed = False
+        for results in self.smart_results.values():
+            changed = results.update(paths) or changed
+        if changed:
+            self.listener.smart_playlists_updated()
+
+    # Search
+
+    def build_search_index(self):
+        if self.search_index is not None or self.search_pending is not None:
+            return
+        self.search_pending = set()
+        threading.Thread(target=self.run_search_build, args=(self.playlist, list(self.playlist)),
+                         daemon=True).start()
+
+    def run_search_build(self, playlist, songs):
+        tags = self.metadata.all_tags()
+        index = SearchIndex()
+        index.add_many((song,) + tags.get(song, ()) for song in songs)
+        self.schedule(lambda: self.search_index_built(playlist, index))
+
+    def search_index_built(self, playlist, index):
+        if playlist is not self.playlist:
+            return  # Another playlist was opened while this one was being indexed
+        pending, self.search_pending = self.search_pending, None
+        self.search_index = index
+        self.update_search(pending)
+        self.listener.search_ready()
+
+    def update_search(self, paths):
+        if self.search_pending is not None:
+            self.search_pending.update(paths)
+            return
+        if self.search_index is None:
+            return
+        for path in paths:
+            if path in self.playlist:
+                info = self.metadata.cached(path) or {}
+                self.search_index.add(path, info.get('title'), info.get('artist'), info.get('album'))
+            else:
+                self.search_index.remove(path)
+
+    def search(self, query, limit=500):
+        # Playlist indices matching query, in playlist order; None until the index has been built
+        if self.search_index is None:
+            return None
+        indices = (self.playlist.find(path) for path in self.search_index.first(query, limit))
+        return sorted(index for index in indices if index is not None)
+
+    def track_info(self, song):
+        # Cached tags for song, or None (and queue it for indexing) if unknown or changed on disk
+        info = self.metadata.lookup(song)
+        if info is None:
+            self.tag_indexer.scan([song])
+        return info
+
+    def song_label(self, song):
+        info = self.metadata.cached(song)
+        if info and info['title']:
+            return f"{info['artist']} - {info['title']}" if info['artist'] else info['title']
+        return os.path.basename(song)
+
+    def artist_of(self, index):
+        info = self.metadata.cached(self.playlist[index])
+        return info['artist'] if info else None
+
+    # Persistence
+
+    def flush(self):
+        try:
+            self.playlist_store.flush(self.playlist.songs)
+            self.library_store.save_state(self.playback_state())
+        except OSError as e:
+            logger.error("Error saving playlist: %s", e)
+
+    def playback_state(self):
+        return {
+            'playlist': self.playlist_name,
+            'current_index': self.current_index,
+            'current_song': self.current_song,
+            'position': self.playback_clock.position() if self.sound else self.resume_position(),
+            'volume': self.volume,
+            'repeat_one': self.repeat_one,
+            'crossfade_seconds': self.crossfade_seconds,
+            'crossfade_curve': self.crossfade_curve,
+            'equalizer': self.equalizer.name if self.equalizer else None,
+            'shuffle': self.play_order.shuffle,
+            'shuffle_seed': self.play_order.seed,
+            'history': self.play_order.history[-50:],
+        }
+
+    def status(self):
+        # Snapshot for remote controllers; the receiver extrapolates position while playing is set
+        song = self.current_song
+        info = self.metadata.cached(song) if song else None
+        return {
+            'playlist': self.playlist_name,
+            'index': self.current_index if song else None,
+            'song': song,
+            'title': info['title'] if info and info['title'] else (os.path.basename(song) if song else None),
+            'artist': info['artist'] if info else None,
+            'playing': self.playback_clock.playing,
+            'position': self.playback_clock.position() if self.sound else self.resume_position(),
+            'length': self.playback_clock.length(),
+            'volume': self.volume,
+            'equalizer': self.equalizer.name if self.equalizer else None,
+            'repeat_one': self.repeat_one,
+            'shuffle': self.play_order.shuffle,
+        }
+
+    def restore_state(self, state):
+        self.volume = state.get('volume', 1.0)
+        self.repeat_one = state.get('repeat_one', False)
+        self.crossfade_seconds = state.get('crossfade_seconds', 0.0)
+        curve = state.get('crossfade_curve')
+        self.crossfade_curve = curve if curve in CURVES else 'equal_power'
+        self.equalizer = self.eq_presets.get(state.get('equalizer'))
+        self.play_order.history = [i for i in state.get('history', []) if 0 <= i < len(self.playlist)]
+        self.resume_at = None
+        song = state.get('current_song')
+        if song and song in self.playlist:
+            index = state.get('current_index', 0)
+            self.current_index = index if 0 <= index < len(self.playlist) and self.playlist[index] == song \
+                else self.playlist.find(song)
+            self.current_song = song
+            self.resume_at = (song, state.get('position', 0))  # Applied by start_sound on the next play
+        if state.get('shuffle'):
+            self.play_order.set_shuffle(True, current=self.current_index, seed=state.get('shuffle_seed'))
+
+    def resume_position(self):
+        if self.resume_at and self.resume_at[0] == self.current_song:
+            return self.resume_at[1]
+        return 0
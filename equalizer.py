@@ -0,0 +1,91 @@
+import logging
+import math
+
+from storage import atomic_write_json, read_json
+
+logger = logging.getLogger(__name__)
+
+BAND_TYPES = ('peaking', 'low_shelf', 'high_shelf')
+
+# Written to eq_presets.json the first time, as a starting point to edit
+DEFAULT_EQ_PRESETS = [
+    {'name': 'Flat', 'bands': []},
+    {'name': 'Bass boost', 'preamp': -5, 'bands': [
+        {'type': 'low_shelf', 'freq': 120, 'gain': 5, 'q': 0.7},
+        {'type': 'peaking', 'freq': 60, 'gain': 2, 'q': 1.0},
+    ]},
+    {'name': 'Vocal', 'preamp': -3, 'bands': [
+        {'type': 'peaking', 'freq': 200, 'gain': -2, 'q': 0.8},
+        {'type': 'peaking', 'freq': 2500, 'gain': 3, 'q': 1.0},
+        {'type': 'high_shelf', 'freq': 8000, 'gain': -1, 'q': 0.7},
+    ]},
+    {'name': 'Treble boost', 'preamp': -4, 'bands': [{'type': 'high_shelf', 'freq': 6000, 'gain': 4, 'q': 0.7}]},
+    {'name': 'Loudness', 'preamp': -6, 'bands': [
+        {'type': 'peaking', 'freq': freq, 'gain': gain, 'q': 1.4}
+        for freq, gain in zip((31, 62, 125, 250, 500, 1000, 2000, 4000, 8000, 16000), (6, 5, 3, 1, 0, -1, 0, 2, 4, 5))
+    ]},
+]
+
+
+class Band:
+    def __init__(self, type, freq, gain, q=0.7):
+        if type not in BAND_TYPES:
+            raise ValueError(f"Unknown band type: {type}")
+        if not freq > 0 or not q > 0:
+            raise ValueError(f"Band frequency and q must be positive: {freq}, {q}")
+        self.type = type
+        self.freq = float(freq)
+        self.gain = float(gain)
+        self.q = float(q)
+
+    def coefficients(self, rate):
+        # (b0, b1, b2, a1, a2) normalized by a0, from the RBJ Audio EQ Cookbook; None when the band
+        # does nothing at this rate (no gain, or above the Nyquist frequency)
+        if not self.gain or self.freq >= 0.49 * rate:
+            return None
+        a = 10.0 ** (self.gain / 40.0)
+        w0 = 2.0 * math.pi * self.freq / rate
+        cos, alpha = math.cos(w0), math.sin(w0) / (2.0 * self.q)
+        if self.type == 'peaking':
+            b = (1 + alpha * a, -2 * cos, 1 - alpha * a)
+            a_ = (1 + alpha / a, -2 * cos, 1 - alpha / a)
+        else:
+            root = 2.0 * math.sqrt(a) * alpha
+            sign = 1 if self.type == 'low_shelf' else -1
+            b = (a * ((a + 1) - sign * (a - 1) * cos + root), sign * 2 * a * ((a - 1) - sign * (a + 1) * cos),
+                 a * ((a + 1) - sign * (a - 1) * cos - root))
+            a_ = ((a + 1) + sign * (a - 1) * cos + root, -sign * 2 * ((a - 1) + sign * (a + 1) * cos),
+                  (a + 1) + sign * (a - 1) * cos - root)
+        return b[0] / a_[0], b[1] / a_[0], b[2] / a_[0], a_[1] / a_[0], a_[2] / a_[0]
+
+
+class EqPreset:
+    # Parametric bands in series, a preamp (dB) ahead of them and an optional peak limiter after
+    def __init__(self, name, bands=(), preamp=0.0, limiter=True):
+        self.name = name
+        self.bands = [Band(**band) for band in bands]
+        self.preamp = float(preamp)
+        self.limiter = bool(limiter)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data.get('bands', ()), data.get('preamp', 0.0), data.get('limiter', True))
+
+
+def load_eq_presets(path):
+    data = read_json(path, None)
+    if data is None:
+        data = DEFAULT_EQ_PRESETS
+        try:
+            atomic_write_json(path, data)
+        except OSError as e:
+            logger.error("Error writing equalizer presets: %s", e)
+    presets = {}
+    for entry in data:
+        try:
+            preset = EqPreset.from_dict(entry)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Skipping equalizer preset %r: %s", entry, e)
+            continue
+        presets[preset.name] = preset
+    return presets
@@ -0,0 +1,238 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import wave
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from formats import decode_blocks
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_SECONDS = 30.0  # Only the start of each track is decoded
+ANALYSIS_RATE = 5500  # Audio is boxcar-decimated to about this rate; the bands stop at 2 kHz
+FRAME_SECONDS = 0.2
+HOP_SECONDS = 0.025  # Heavy overlap, so rips that start a few ms apart still hash alike
+BAND_EDGES = np.geomspace(300.0, 2000.0, 34)  # 33 bands -> 32 bits per frame
+KEY_SAMPLING = 4  # Only hashes divisible by this are indexed; the choice doesn't depend on alignment
+MAX_POSTINGS = 64  # Keys shared by more tracks than this (silence, test tones) are ignored
+MIN_VOTES = 2  # Key hits at one alignment before a candidate is compared in full
+MIN_OVERLAP = 200  # Frames (5 s) two fingerprints must overlap to be compared
+MATCH_BIT_ERRORS = 0.3  # Fraction of differing bits below which two tracks are the same recording
+
+
+def downmix(blocks, seconds=FINGERPRINT_SECONDS):
+    # (analysis rate, mono float32 samples) for the first `seconds` of the decoded blocks
+    parts, rate, factor, frames = [], 0, 1, 0
+    for rate, samples in blocks:
+        factor = max(1, round(rate / ANALYSIS_RATE))
+        parts.append(samples.mean(axis=1))
+        frames += len(samples)
+        if frames >= seconds * rate:
+            break
+    if not parts or not rate:
+        return ANALYSIS_RATE, np.zeros(0, dtype=np.float32)
+    mono = np.concatenate(parts)[:int(seconds * rate)]
+    mono = mono[:len(mono) - len(mono) % factor].reshape(-1, factor).mean(axis=1)
+    return rate / factor, mono
+
+
+def spectral_hashes(rate, mono):
+    # One 32-bit hash per frame: bit m is set when the energy difference between bands m and m+1
+    # grew since the previous frame (Haitsma & Kalker). Only the signs of differences are kept,
+    # so gain, EQ and lossy encoding barely change the result.
+    frame = int(rate * FRAME_SECONDS)
+    count = int((len(mono) - frame) / (rate * HOP_SECONDS)) + 1
+    if count < 3:
+        return np.zeros(0, dtype=np.uint32)
+    # Frames start at exact multiples of the hop time, so tracks at other sample rates don't drift apart
+    starts = np.round(np.arange(count) * rate * HOP_SECONDS).astype(np.int64)
+    frames = np.lib.stride_tricks.sliding_window_view(mono, frame)[starts] * np.hanning(frame)
+    power = np.square(np.abs(np.fft.rfft(frames, axis=1)))
+    edges = np.searchsorted(np.fft.rfftfreq(frame, 1.0 / rate), BAND_EDGES)
+    energy = np.add.reduceat(power, edges, axis=1)[:, :-1]  # The last slice is everything above 2 kHz
+    difference = energy[:, :-1] - energy[:, 1:]
+    bits = (difference[1:] - difference[:-1]) > 0
+    return np.packbits(bits, axis=1, bitorder='little').view('<u4').ravel().astype(np.uint32)
+
+
+def fingerprint_file(path):
+    # Runs on a worker thread; None if the track can't be decoded
+    try:
+        return spectral_hashes(*downmix(decode_blocks(path)))
+    except (OSError, ValueError, EOFError, wave.Error) as e:
+        logger.warning("Error fingerprinting: %s", e)
+        return None
+
+
+def index_keys(hashes):
+    # (hash, frame) of the first occurrence of each sampled hash
+    keys, frames = np.unique(hashes, return_index=True)
+    sampled = (keys % KEY_SAMPLING == 0) & (keys != 0)
+    return zip(keys[sampled].tolist(), frames[sampled].tolist())
+
+
+def bit_error_rate(a, b, offset):
+    # Differing bits between a and b with b shifted by offset frames; 1.0 if they barely overlap
+    if offset >= 0:
+        a, b = a[offset:], b
+    else:
+        a, b = a, b[-offset:]
+    count = min(len(a), len(b))
+    if count < MIN_OVERLAP:
+        return 1.0
+    differing = np.unpackbits(np.bitwise_xor(a[:count], b[:count]).view(np.uint8)).sum()
+    return differing / (32.0 * count)
+
+
+def pack_hashes(hashes):
+    return hashes.astype('<u4').tobytes()
+
+
+def unpack_hashes(blob):
+    return np.frombuffer(blob, dtype='<u4').astype(np.uint32)
+
+
+class FingerprintIndex:
+    # Spectral fingerprints of the first 30 s of each track, cached in library.db by path + mtime
+    # + size. A sample of each fingerprint's hashes is kept in a key -> (track, frame) table
+    # clustered by key, so looking up a track's candidates costs one indexed probe per key
+    # whatever the library size; only candidates that agree on an alignment are compared in full.
+    # Decoding runs on a thread pool, as in LoudnessAnalyzer.
+    def __init__(self, db_file, workers=None):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints ('
+            'id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER, hashes BLOB)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprint_keys ('
+            'key INTEGER, track INTEGER, frame INTEGER, PRIMARY KEY (key, track, frame)) WITHOUT ROWID'
+        )
+        self.conn.commit()
+        workers = workers or min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fingerprint')
+        self.dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fingerprint-dispatch')
+
+    def find_duplicates(self, paths, on_done):
+        # Fingerprints whatever isn't cached yet, then calls on_done(groups) from the worker thread
+        paths = list(paths)
+        self.dispatcher.submit(lambda: on_done(self.run(paths)))
+
+    def run(self, paths, batch_size=32):
+        started = time.perf_counter()
+        fingerprinted = 0
+        for start in range(0, len(paths), batch_size):
+            fingerprinted += self.update(paths[start:start + batch_size])
+        if fingerprinted:
+            elapsed = time.perf_counter() - started
+            logger.info("Fingerprints: %d tracks in %.1f s (%.1f tracks/s)", fingerprinted, elapsed,
+                        fingerprinted / elapsed)
+        groups = self.duplicate_groups(paths)
+        logger.info("Fingerprints: %d groups of duplicates in %.1f s", len(groups), time.perf_counter() - started)
+        return groups
+
+    def update(self, paths):
+        # Fingerprints the paths whose cached entry is missing or stale; returns how many were done
+        stale = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            with self.lock:
+                row = self.conn.execute('SELECT mtime, size FROM fingerprints WHERE path = ?', (path,)).fetchone()
+            if row is None or row[0] != stat.st_mtime or row[1] != stat.st_size:
+                stale.append((path, stat.st_mtime, stat.st_size))
+        if not stale:
+            return 0
+        results = list(self.executor.map(fingerprint_file, [entry[0] for entry in stale]))
+        with self.lock, self.conn:
+            for (path, mtime, size), hashes in zip(stale, results):
+                self.store(path, mtime, size, hashes if hashes is not None else np.zeros(0, dtype=np.uint32))
+        return len(stale)
+
+    def store(self, path, mtime, size, hashes):
+        # Called with the lock held, inside a transaction
+        row = self.conn.execute('SELECT id, hashes FROM fingerprints WHERE path = ?', (path,)).fetchone()
+        if row is not None:
+            track = row[0]
+            self.conn.executemany('DELETE FROM fingerprint_keys WHERE key = ? AND track = ? AND frame = ?',
+                                  [(key, track, frame) for key, frame in index_keys(unpack_hashes(row[1]))])
+            self.conn.execute('UPDATE fingerprints SET mtime = ?, size = ?, hashes = ? WHERE id = ?',
+                              (mtime, size, pack_hashes(hashes), track))
+        else:
+            track = self.conn.execute('INSERT INTO fingerprints (path, mtime, size, hashes) VALUES (?, ?, ?, ?)',
+                                      (path, mtime, size, pack_hashes(hashes))).lastrowid
+        self.conn.executemany('INSERT OR IGNORE INTO fingerprint_keys VALUES (?, ?, ?)',
+                              [(key, track, frame) for key, frame in index_keys(hashes)])
+
+    def fingerprint(self, path):
+        # (track id, hashes) from the cache, or None
+        with self.lock:
+            row = self.conn.execute('SELECT id, hashes FROM fingerprints WHERE path = ?', (path,)).fetchone()
+        return (row[0], unpack_hashes(row[1])) if row else None
+
+    def matches(self, path):
+        # Paths of cached tracks that sound like path (its fingerprint must be cached too)
+        entry = self.fingerprint(path)
+        if entry is None:
+            return []
+        track, hashes = entry
+        votes = Counter()
+        with self.lock:
+            for key, frame in index_keys(hashes):
+                postings = self.conn.execute(
+                    'SELECT track, frame FROM fingerprint_keys WHERE key = ? LIMIT ?', (key, MAX_POSTINGS + 1)
+                ).fetchall()
+                if len(postings) > MAX_POSTINGS:
+                    continue
+                for other, other_frame in postings:
+                    if other != track:
+                        votes[other, frame - other_frame] += 1
+        found, checked = [], set()
+        for (other, offset), count in votes.most_common():
+            if count < MIN_VOTES:
+                break
+            if other in checked:
+                continue
+            with self.lock:
+                row = self.conn.execute('SELECT path, hashes FROM fingerprints WHERE id = ?', (other,)).fetchone()
+            if row is None:
+                continue
+            checked.add(other)
+            if bit_error_rate(hashes, unpack_hashes(row[1]), offset) <= MATCH_BIT_ERRORS:
+                found.append(row[0])
+        return found
+
+    def duplicate_groups(self, paths):
+        # Groups (two or more paths, in the given order) of tracks among paths that are the same recording
+        order = {path: i for i, path in enumerate(paths)}
+        parent = {}
+
+        def root(path):
+            while parent.get(path, path) != path:
+                path = parent[path]
+            return path
+
+        for path in paths:
+            for other in self.matches(path):
+                if other in order:
+                    a, b = sorted((root(path), root(other)), key=order.get)
+                    if a != b:
+                        parent[b] = a
+        groups = {}
+        for path in parent:
+            groups.setdefault(root(path), [root(path)]).append(path)
+        return sorted((sorted(group, key=order.get) for group in groups.values()), key=lambda group: order[group[0]])
+
+    def close(self):
+        self.dispatcher.shutdown(wait=False, cancel_futures=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,530 @@
+import io
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import urllib.parse
+import wave
+
+from streaming import is_url, open_source
+
+logger = logging.getLogger(__name__)
+
+CHUNK_FRAMES = 1 << 16
+HEAD_SIZE = 64  # Bytes read to recognise a file by its magic number
+TAIL_SIZES = (8 * 1024, 64 * 1024)  # Tried in turn to find the last Ogg page; pages are at most ~64 KB
+MAX_TAG_BYTES = 1024 * 1024  # Text tags never need more; cover art beyond this is not read
+
+
+class AudioFormat:
+    # One entry in the registry. read_tags(f, size) gets a seekable binary file and returns the
+    # metadata.TAG_FIELDS dict, reading only the header/trailer regions it needs; it raises
+    # ValueError (or struct.error) when the file is outside what it handles, and the generic
+    # mutagen reader is used instead. decode(path, start=0.0) yields (sample rate, float32 frames x
+    # channels) blocks from start seconds in.
+    def __init__(self, name, extensions, magic=(), read_tags=None, decode=None):
+        self.name = name
+        self.extensions = tuple(extensions)
+        self.magic = tuple(magic)  # (offset, bytes) pairs, any of which identifies the format
+        self.read_tags = read_tags
+        self.decode = decode
+
+    def sniff(self, head):
+        return any(head[offset:offset + len(value)] == value for offset, value in self.magic)
+
+
+FORMATS = []
+
+
+def register(audio_format):
+    # Later registrations take precedence, so a plugin can replace a built-in reader
+    FORMATS.insert(0, audio_format)
+    return audio_format
+
+
+def audio_extensions():
+    return tuple(dict.fromkeys(ext for audio_format in FORMATS for ext in audio_format.extensions))
+
+
+def extension_of(location):
+    path = urllib.parse.urlsplit(location).path if is_url(location) else location
+    return os.path.splitext(path)[1].lower()
+
+
+def format_for(location, head=None):
+    # The extension decides unless the file's first bytes say otherwise; an ID3 header can
+    # front any format, so it doesn't count against the extension
+    by_extension = next((fmt for fmt in FORMATS if extension_of(location) in fmt.extensions), None)
+    if head is None or (by_extension and (by_extension.sniff(head) or head.startswith(b'ID3'))):
+        return by_extension
+    return next((fmt for fmt in FORMATS if fmt.sniff(head)), by_extension)
+
+
+def open_location(location):
+    # (binary file, size in bytes); a URL is read through Range requests, so seeks are cheap
+    if is_url(location):
+        source = open_source(location)
+        return io.BufferedReader(source), source.size or 0
+    f = open(location, 'rb')
+    return f, os.fstat(f.fileno()).st_size
+
+
+def read_tags(location):
+    f, size = open_location(location)
+    with f:
+        audio_format = format_for(location, f.read(HEAD_SIZE))
+        if audio_format is not None and audio_format.read_tags is not None:
+            try:
+                f.seek(0)
+                return audio_format.read_tags(f, size)
+            except (ValueError, EOFError, struct.error, UnicodeDecodeError) as e:
+                logger.debug("Falling back to mutagen for %s: %s", location, e)
+        f.seek(0)
+        return read_tags_mutagen(location, f)
+
+
+def read_tags_mutagen(location, f):
+    from mutagen import File as MutagenFile  # Imported on first use to keep it out of app startup
+    audio = MutagenFile(f, easy=True)
+    if audio is None:
+        raise ValueError(f"Unsupported audio file: {location}")
+    tags = audio.tags or {}
+    info = audio.info
+
+    def first(key):
+        values = tags.get(key)
+        return values[0] if values else None
+
+    return {
+        'title': first('title'),
+        'artist': first('artist'),
+        'album': first('album'),
+        'duration': getattr(info, 'length', 0) or 0,
+        'bitrate': getattr(info, 'bitrate', 0) or 0,
+    }
+
+
+def make_tags(title=None, artist=None, album=None, duration=0, bitrate=0):
+    return {'title': title, 'artist': artist, 'album': album, 'duration': duration or 0, 'bitrate': int(bitrate or 0)}
+
+
+def read_exactly(f, count):
+    data = f.read(count)
+    if len(data) < count:
+        raise EOFError("Truncated file")
+    return data
+
+
+# Vorbis comments (FLAC, Ogg Vorbis, Opus)
+
+COMMENT_FIELDS = {'TITLE': 'title', 'ARTIST': 'artist', 'ALBUM': 'album'}
+
+
+def parse_vorbis_comment(data, offset=0):
+    # Stops quietly at the end of the data, so a packet cut short at MAX_TAG_BYTES still yields what it has
+    found = {}
+    vendor_length, = struct.unpack_from('<I', data, offset)
+    offset += 4 + vendor_length
+    count, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    for _ in range(count):
+        if offset + 4 > len(data):
+            break
+        length, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        key, _, value = data[offset:offset + length].decode('utf-8', 'replace').partition('=')
+        offset += length
+        field = COMMENT_FIELDS.get(key.upper())
+        if field and field not in found:
+            found[field] = value
+    return found
+
+
+# WAV
+
+INFO_FIELDS = {b'INAM': 'title', b'IART': 'artist', b'IPRD': 'album'}
+
+
+def read_wav_tags(f, size):
+    riff, _, wave_id = struct.unpack('<4sI4s', read_exactly(f, 12))
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+    found, byte_rate, data_size = {}, 0, 0
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        skip = chunk_size + (chunk_size & 1)
+        if chunk_id == b'fmt ':
+            byte_rate, = struct.unpack_from('<I', read_exactly(f, chunk_size), 8)
+            skip -= chunk_size
+        elif chunk_id == b'data':
+            data_size = min(chunk_size, size - f.tell())
+        elif chunk_id == b'LIST' and chunk_size <= MAX_TAG_BYTES:
+            body = read_exactly(f, chunk_size)
+            skip -= chunk_size
+            offset = 4 if body[:4] == b'INFO' else len(body)
+            while offset + 8 <= len(body):
+                sub_id, sub_size = struct.unpack_from('<4sI', body, offset)
+                if sub_id in INFO_FIELDS:
+                    found[INFO_FIELDS[sub_id]] = body[offset + 8:offset + 8 + sub_size].split(b'\0')[0].decode(
+                        'utf-8', 'replace')
+                offset += 8 + sub_size + (sub_size & 1)
+        f.seek(skip, io.SEEK_CUR)  # The sample data itself is never read
+    if not byte_rate:
+        raise ValueError("WAV file without a fmt chunk")
+    return make_tags(duration=data_size / byte_rate, bitrate=byte_rate * 8, **found)
+
+
+# MP3: ID3v2 frames up front, then the first MPEG frame header and its Xing/Info/VBRI header
+
+ID3_FIELDS = {b'TIT2': 'title', b'TPE1': 'artist', b'TALB': 'album', b'TT2': 'title', b'TP1': 'artist',
+              b'TAL': 'album'}
+ID3_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+MPEG_BITRATES = {  # (MPEG 1?, layer) -> kbit/s by bitrate index
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MPEG_BITRATES[False, 3] = MPEG_BITRATES[False, 2]
+MPEG_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}  # By version bits
+SYNC_SEARCH = (4 * 1024, 64 * 1024)  # Tried in turn when looking past the tag for the first MPEG frame
+
+
+def syncsafe(data):
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+
+def decode_id3_text(body):
+    if not body:
+        return None
+    encoding = ID3_ENCODINGS[body[0]] if body[0] < len(ID3_ENCODINGS) else 'latin-1'
+    text = body[1:].decode(encoding, 'replace')
+    return text.split('\0')[0] or None
+
+
+def read_id3v2(f):
+    # Text frames from an ID3v2.2-2.4 tag at the start of f; returns (fields, size of the tag)
+    header = read_exactly(f, 10)
+    if header[:3] != b'ID3':
+        f.seek(0)
+        return {}, 0
+    version, flags, tag_size = header[3], header[5], syncsafe(header[6:10])
+    end = 10 + tag_size + (10 if flags & 0x10 else 0)
+    if flags & 0x80 and version < 4:
+        raise ValueError("Unsynchronised ID3 tag")
+    if flags & 0x40:
+        extended = read_exactly(f, 4)
+        f.seek((syncsafe(extended) - 4) if version >= 4 else struct.unpack('>I', extended)[0], io.SEEK_CUR)
+    id_size, header_size = (3, 6) if version == 2 else (4, 10)
+    found = {}
+    while f.tell() + header_size <= 10 + tag_size and len(found) < 3:
+        frame_header = read_exactly(f, header_size)
+        frame_id = frame_header[:id_size]
+        if not frame_id.strip(b'\0'):
+            break  # Padding
+        if version == 2:
+            frame_size = int.from_bytes(frame_header[3:6], 'big')
+        elif version >= 4:
+            frame_size = syncsafe(frame_header[4:8])
+        else:
+            frame_size, = struct.unpack_from('>I', frame_header, 4)
+        field = ID3_FIELDS.get(frame_id)
+        if field and field not in found and frame_size <= MAX_TAG_BYTES:
+            if version >= 3 and frame_header[9] & (0x0f if version >= 4 else 0xc0):
+                raise ValueError("Compressed or encrypted ID3 frame")
+            found[field] = decode_id3_text(read_exactly(f, frame_size))
+        else:
+            f.seek(frame_size, io.SEEK_CUR)  # Pictures and the like are skipped, not read
+    return found, end
+
+
+def read_id3v1(f, size):
+    if size < 128:
+        return {}
+    f.seek(size - 128)
+    tail = f.read(128)
+    if tail[:3] != b'TAG':
+        return {}
+    fields = (('title', tail[3:33]), ('artist', tail[33:63]), ('album', tail[63:93]))
+    return {field: value.split(b'\0')[0].decode('latin-1').strip() or None for field, value in fields}
+
+
+def parse_mpeg_header(header):
+    # (sample rate, kbit/s, samples per frame, side info size, frame length) or None if not a frame header
+    if header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version, layer_bits = header[1] >> 3 & 3, header[1] >> 1 & 3
+    bitrate_index, rate_index = header[2] >> 4, header[2] >> 2 & 3
+    if version == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1, layer = version == 3, 4 - layer_bits
+    rate = MPEG_RATES[version][rate_index]
+    kbps = MPEG_BITRATES[mpeg1, layer][bitrate_index]
+    samples = 384 if layer == 1 else 1152 if mpeg1 or layer == 2 else 576
+    mono = header[3] >> 6 == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    padding = header[2] >> 1 & 1
+    length = (12 * kbps * 1000 // rate + padding) * 4 if layer == 1 else samples // 8 * kbps * 1000 // rate + padding
+    return rate, kbps, samples, side_info, length
+
+
+def find_mpeg_frame(window):
+    # (offset, parsed header) of the first frame in window, or (None, None)
+    position = window.find(b'\xff')
+    while 0 <= position <= len(window) - 4:
+        frame = parse_mpeg_header(window[position:position + 4])
+        # A second header right after this frame rules out a stray 0xFF in the data
+        if frame and window[position + frame[4]:position + frame[4] + 1] in (b'\xff', b''):
+            return position, frame
+        position = window.find(b'\xff', position + 1)
+    return None, None
+
+
+def read_mp3_tags(f, size):
+    found, audio_start = read_id3v2(f)
+    for limit in SYNC_SEARCH:
+        f.seek(audio_start)
+        window = f.read(limit)
+        position, frame = find_mpeg_frame(window)
+        if frame is not None:
+            break
+    else:
+        raise ValueError("No MPEG frame found")
+    rate, kbps, samples, side_info, _ = frame
+    audio_start += position
+    audio_size = size - audio_start
+    v1 = read_id3v1(f, size)
+    if v1:
+        audio_size -= 128
+    for field, value in v1.items():
+        found.setdefault(field, value)
+    duration = 0
+    xing = position + 4 + side_info
+    if window[xing:xing + 4] in (b'Xing', b'Info') and struct.unpack_from('>I', window, xing + 4)[0] & 1:
+        flags, frames = struct.unpack_from('>II', window, xing + 4)
+        played = frames * samples
+        # A LAME tag after the optional fields says how much of that is encoder delay and padding
+        lame = xing + 12 + (4 if flags & 2 else 0) + (100 if flags & 4 else 0) + (4 if flags & 8 else 0)
+        if window[lame:lame + 4] == b'LAME' and len(window) >= lame + 24:
+            delay = window[lame + 21] << 4 | window[lame + 22] >> 4
+            padding = (window[lame + 22] & 0xF) << 8 | window[lame + 23]
+            played = max(0, played - delay - padding)
+        duration = played / rate
+    elif window[position + 36:position + 40] == b'VBRI':
+        duration = struct.unpack_from('>I', window, position + 50)[0] * samples / rate
+    if duration:
+        bitrate = audio_size * 8 / duration
+    else:
+        bitrate = kbps * 1000  # Constant bitrate without a header
+        duration = audio_size * 8 / bitrate
+    return make_tags(duration=duration, bitrate=bitrate, **found)
+
+
+# FLAC: the metadata blocks before the first audio frame
+
+def read_flac_tags(f, size):
+    _, offset = read_id3v2(f)  # Some taggers put one in front anyway
+    f.seek(offset)
+    if read_exactly(f, 4) != b'fLaC':
+        raise ValueError("Not a FLAC file")
+    found, duration, last = {}, 0, False
+    while not last:
+        header = read_exactly(f, 4)
+        last, block_type, length = header[0] & 0x80, header[0] & 0x7F, int.from_bytes(header[1:4], 'big')
+        if block_type == 0:  # STREAMINFO
+            info = read_exactly(f, length)
+            packed = int.from_bytes(info[10:18], 'big')
+            rate, total = packed >> 44, packed & 0xFFFFFFFFF
+            duration = total / rate if rate else 0
+        elif block_type == 4 and length <= MAX_TAG_BYTES:  # VORBIS_COMMENT
+            found = parse_vorbis_comment(read_exactly(f, length))
+        else:
+            f.seek(length, io.SEEK_CUR)  # Pictures, seek tables, padding
+    bitrate = (size - f.tell()) * 8 / duration if duration else 0
+    return make_tags(duration=duration, bitrate=bitrate, **found)
+
+
+# Ogg Vorbis and Opus: the first two packets, and the granule position of the last page
+
+def ogg_packets(f, count):
+    # The first `count` packets of the stream at the start of f, each cut off at MAX_TAG_BYTES
+    packets, current = [], bytearray()
+    while len(packets) < count:
+        header = read_exactly(f, 27)
+        if header[:4] != b'OggS':
+            raise ValueError("Lost Ogg page sync")
+        lacing = read_exactly(f, header[26])
+        body = read_exactly(f, sum(lacing))
+        offset = 0
+        for value in lacing:
+            if len(current) < MAX_TAG_BYTES:
+                current += body[offset:offset + value]
+            offset += value
+            if value < 255:
+                packets.append(bytes(current))
+                current = bytearray()
+        if len(current) >= MAX_TAG_BYTES:
+            packets.append(bytes(current))  # The rest is most likely cover art; stop reading here
+            current = bytearray()
+    return packets[:count]
+
+
+def last_granule(f, size):
+    for span in TAIL_SIZES:
+        f.seek(max(0, size - span))
+        tail = f.read(span)
+        position = tail.rfind(b'OggS')
+        if 0 <= position <= len(tail) - 14:
+            return struct.unpack_from('<q', tail, position + 6)[0]
+    raise ValueError("No Ogg page at the end of the file")
+
+
+def read_ogg_tags(f, size):
+    ident, comment = ogg_packets(f, 2)
+    if ident.startswith(b'\x01vorbis'):
+        rate, _, nominal = struct.unpack_from('<IiI', ident, 12)
+        duration = last_granule(f, size) / rate
+        bitrate = nominal or (size * 8 / duration if duration else 0)
+        found = parse_vorbis_comment(comment, 7) if comment.startswith(b'\x03vorbis') else {}
+    elif ident.startswith(b'OpusHead'):
+        pre_skip, = struct.unpack_from('<H', ident, 10)
+        duration = max(0, last_granule(f, size) - pre_skip) / 48000  # Opus granules always count 48 kHz samples
+        bitrate = size * 8 / duration if duration else 0
+        found = parse_vorbis_comment(comment, 8) if comment.startswith(b'OpusTags') else {}
+    else:
+        raise ValueError("Unknown Ogg codec")  # Ogg FLAC, Speex: left to mutagen
+    return make_tags(duration=duration, bitrate=bitrate, **found)
+
+
+# MP4/M4A: atoms are walked with seeks; only mvhd and the ilst text items are read
+
+MP4_CONTAINERS = {b'moov', b'udta', b'ilst'}
+MP4_FIELDS = {b'\xa9nam': 'title', b'\xa9ART': 'artist', b'\xa9alb': 'album'}
+
+
+def mp4_atoms(f, end):
+    # (type, body start, body end) for each atom between the current position and end
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        atom_size, atom_type = struct.unpack('>I4s', read_exactly(f, 8))
+        header = 8
+        if atom_size == 1:
+            atom_size, = struct.unpack('>Q', read_exactly(f, 8))
+            header = 16
+        elif atom_size == 0:
+            atom_size = end - start
+        if atom_size < header:
+            raise ValueError("Bad MP4 atom size")
+        yield atom_type, start + header, min(start + atom_size, end)
+        f.seek(min(start + atom_size, end))
+
+
+def read_mp4_tags(f, size):
+    found, duration = {}, 0
+
+    def walk(end):
+        nonlocal duration
+        for atom_type, body, atom_end in mp4_atoms(f, end):
+            if atom_type in MP4_CONTAINERS:
+                walk(atom_end)
+            elif atom_type == b'meta':
+                f.seek(body + 4)  # Version and flags come before the child atoms
+                walk(atom_end)
+            elif atom_type == b'mvhd':
+                data = read_exactly(f, 32)
+                if data[0] == 1:
+                    timescale, length = struct.unpack_from('>IQ', data, 20)
+                else:
+                    timescale, length = struct.unpack_from('>II', data, 12)
+                duration = length / timescale if timescale else 0
+            elif atom_type in MP4_FIELDS and atom_end - body <= MAX_TAG_BYTES:
+                for child_type, child_body, child_end in mp4_atoms(f, atom_end):
+                    if child_type == b'data':
+                        f.seek(child_body + 8)  # Type and locale
+                        found[MP4_FIELDS[atom_type]] = read_exactly(f, child_end - child_body - 8).decode(
+                            'utf-8', 'replace')
+                        break
+
+    if read_exactly(f, 8)[4:8] != b'ftyp':
+        raise ValueError("Not an MP4 file")
+    f.seek(0)
+    walk(size)
+    return make_tags(duration=duration, bitrate=size * 8 / duration if duration else 0, **found)
+
+
+# Decoders
+
+def decode_wav(path, start=0.0):
+    import numpy as np  # Imported on first use to keep it out of app startup
+    with wave.open(path, 'rb') as f:
+        channels, width, rate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+        if width not in (1, 2, 4):
+            raise ValueError(f"Unsupported WAV sample width: {width}")
+        if start:
+            f.setpos(min(int(start * rate), f.getnframes()))
+        dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+        scale = float(1 << (8 * width - 1))
+        while True:
+            raw = f.readframes(CHUNK_FRAMES)
+            if not raw:
+                break
+            samples = np.frombuffer(raw, dtype=dtype).astype(np.float32)
+            if width == 1:
+                samples -= 128.0
+            yield rate, (samples / scale).reshape(-1, channels)
+
+
+def decode_ffmpeg(path, start=0.0, rate=44100, channels=2):
+    if not shutil.which('ffmpeg'):
+        raise ValueError(f"No decoder available for {path}")
+    return decode_ffmpeg_blocks(path, start, rate, channels)
+
+
+def decode_ffmpeg_blocks(path, start, rate, channels):
+    import numpy as np  # Imported on first use to keep it out of app startup
+    process = subprocess.Popen(
+        ['ffmpeg', '-v', 'quiet', '-ss', f'{start:.6f}', '-i', path, '-f', 'f32le', '-ac', str(channels),
+         '-ar', str(rate), '-'],
+        stdout=subprocess.PIPE
+    )
+    try:
+        while True:
+            raw = process.stdout.read(CHUNK_FRAMES * channels * 4)
+            if not raw:
+                break
+            usable = len(raw) - len(raw) % (channels * 4)
+            yield rate, np.frombuffer(raw[:usable], dtype=np.float32).reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def decode_blocks(path, start=0.0):
+    # WAV is decoded here; other formats need an ffmpeg binary on PATH
+    audio_format = format_for(path)
+    if audio_format is None or audio_format.decode is None:
+        raise ValueError(f"No decoder available for {path}")
+    return audio_format.decode(path, start)
+
+
+def can_decode(path):
+    # Whether decode_blocks(path) has what it needs, without starting a decoder
+    audio_format = format_for(path)
+    if audio_format is None or audio_format.decode is None:
+        return False
+    return audio_format.decode is not decode_ffmpeg or shutil.which('ffmpeg') is not None
+
+
+register(AudioFormat('mp4', ('.m4a', '.m4b', '.mp4'), magic=[(4, b'ftyp')], read_tags=read_mp4_tags,
+                     decode=decode_ffmpeg))
+register(AudioFormat('ogg', ('.ogg', '.oga', '.opus'), magic=[(0, b'OggS')], read_tags=read_ogg_tags,
+                     decode=decode_ffmpeg))
+register(AudioFormat('flac', ('.flac',), magic=[(0, b'fLaC')], read_tags=read_flac_tags, decode=decode_ffmpeg))
+register(AudioFormat('wav', ('.wav',), magic=[(0, b'RIFF')], read_tags=read_wav_tags, decode=decode_wav))
+register(AudioFormat('mp3', ('.mp3',), magic=[(0, b'ID3'), (0, b'\xff\xfb'), (0, b'\xff\xf3'), (0, b'\xff\xf2')],
+                     read_tags=read_mp3_tags, decode=decode_ffmpeg))
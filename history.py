@@ -0,0 +1,144 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 5.0  # Seconds between background flushes
+FLUSH_BATCH = 500  # Flush early once this many events are waiting
+PLAY_THRESHOLD = 0.5  # Completion at which a listen counts as a play rather than a skip
+PLAY_SECONDS = 240.0  # ...or this much listening, for long tracks
+
+
+class PlayHistory:
+    # Listening history in library.db. Events are buffered in memory and written by a background
+    # thread in one transaction per batch, together with the rollups the queries read from:
+    # track_stats (per track) and daily_stats (per day), so query cost doesn't grow with the event count.
+    def __init__(self, db_file, flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH):
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = []
+        self.wakeup = threading.Event()
+        self.closing = False
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')  # Readers on other connections don't wait on the writer
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS play_events ('
+            'id INTEGER PRIMARY KEY, path TEXT, started REAL, listened REAL, duration REAL, '
+            'completion REAL, skipped INTEGER)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS track_stats ('
+            'path TEXT PRIMARY KEY, plays INTEGER, skips INTEGER, listened REAL, last_played REAL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS track_stats_by_plays ON track_stats(plays, path)')
+        # Play counts used to be kept in a plays (path, count) table; carry them over once
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plays'").fetchone():
+            self.conn.execute('INSERT OR IGNORE INTO track_stats SELECT path, count, 0, 0, 0 FROM plays')
+            self.conn.execute('DROP TABLE plays')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS daily_stats (day TEXT PRIMARY KEY, plays INTEGER, skips INTEGER, listened REAL)'
+        )
+        self.conn.commit()
+        self.stats = None  # path -> [plays, skips, listened, last_played], including unflushed events
+        self.db_lock = threading.Lock()
+        self.writer = threading.Thread(target=self.run, daemon=True, name='history-writer')
+        self.writer.start()
+
+    def record(self, path, started, listened, duration):
+        # One finished listen; returns whether it counted as a play (False: a skip)
+        completion = min(listened / duration, 1.0) if duration > 0 else 0.0
+        skipped = completion < PLAY_THRESHOLD and listened < PLAY_SECONDS
+        stats = self.load_stats().setdefault(path, [0, 0, 0.0, 0.0])
+        stats[1 if skipped else 0] += 1
+        stats[2] += listened
+        stats[3] = started
+        with self.lock:
+            self.pending.append((path, started, listened, duration, completion, int(skipped)))
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.set()
+        return not skipped
+
+    def run(self):
+        while not self.closing:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            events, self.pending = self.pending, []
+        if not events:
+            return
+        tracks, days = {}, {}
+        for path, started, listened, duration, completion, skipped in events:
+            track = tracks.setdefault(path, [0, 0, 0.0, 0.0])
+            day = days.setdefault(time.strftime('%Y-%m-%d', time.localtime(started)), [0, 0, 0.0])
+            track[skipped] += 1
+            day[skipped] += 1
+            track[2] += listened
+            day[2] += listened
+            track[3] = max(track[3], started)
+        try:
+            with self.db_lock, self.conn:
+                self.conn.executemany(
+                    'INSERT INTO play_events (path, started, listened, duration, completion, skipped) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', events
+                )
+                self.conn.executemany(
+                    'INSERT INTO track_stats VALUES (?, ?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET '
+                    'plays = plays + excluded.plays, skips = skips + excluded.skips, '
+                    'listened = listened + excluded.listened, last_played = MAX(last_played, excluded.last_played)',
+                    [(path,) + tuple(values) for path, values in tracks.items()]
+                )
+                self.conn.executemany(
+                    'INSERT INTO daily_stats VALUES (?, ?, ?, ?) ON CONFLICT(day) DO UPDATE SET '
+                    'plays = plays + excluded.plays, skips = skips + excluded.skips, '
+                    'listened = listened + excluded.listened',
+                    [(day,) + tuple(values) for day, values in days.items()]
+                )
+        except sqlite3.Error as e:
+            logger.error("Error saving play history: %s", e)
+
+    # Queries. Per-track numbers include events still in the buffer; library-wide ones are read
+    # from the rollups and can trail by up to one flush interval.
+
+    def load_stats(self):
+        if self.stats is None:
+            with self.db_lock:
+                rows = self.conn.execute('SELECT path, plays, skips, listened, last_played FROM track_stats').fetchall()
+            self.stats = {row[0]: list(row[1:]) for row in rows}
+        return self.stats
+
+    def play_count(self, path):
+        stats = self.load_stats().get(path)
+        return stats[0] if stats else 0
+
+    def top_tracks(self, limit=50):
+        with self.db_lock:
+            return self.conn.execute(
+                'SELECT path, plays FROM track_stats ORDER BY plays DESC, path DESC LIMIT ?', (limit,)
+            ).fetchall()
+
+    def skip_rate(self, path=None, since_day=None):
+        # Skips / listens, for one track or (optionally from a 'YYYY-MM-DD' day on) the whole library
+        if path is not None:
+            plays, skips = (self.load_stats().get(path) or [0, 0])[:2]
+        else:
+            with self.db_lock:
+                plays, skips = self.conn.execute(
+                    'SELECT COALESCE(SUM(plays), 0), COALESCE(SUM(skips), 0) FROM daily_stats WHERE day >= ?',
+                    (since_day or '',)
+                ).fetchone()
+        return skips / (plays + skips) if plays + skips else 0.0
+
+    def close(self):
+        self.closing = True
+        self.wakeup.set()
+        self.writer.join()
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,122 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+BUCKETS_MS = (1, 2, 4, 8, 16, 33, 50, 100, 250, 500, 1000, 5000)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of samples
+        target, seen = fraction * self.count, 0
+        for bound, count in zip(BUCKETS_MS + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max, 3),
+            'buckets_ms': dict(zip([f'<={b}' for b in BUCKETS_MS] + ['more'], self.counts)),
+        }
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.record(self.name, time.perf_counter() - self.started, self.started)
+        return False
+
+
+class Instruments:
+    # Named timing histograms plus a bounded trace of recent spans. While disabled, timer()
+    # hands back a shared no-op context manager and record() returns straight away.
+    def __init__(self, max_events=10000):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.events = deque(maxlen=max_events)
+        self.origin = time.perf_counter()
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def record(self, name, seconds, started=None):
+        if not self.enabled:
+            return
+        ms = seconds * 1000
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(ms)
+            if started is None:
+                started = time.perf_counter() - seconds
+            self.events.append((name, started, seconds, threading.get_ident()))
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.events.clear()
+
+    def summary(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def trace_events(self):
+        # Chrome trace-event format ("X" complete events, microseconds)
+        pid = os.getpid()
+        with self.lock:
+            return [
+                {'name': name, 'ph': 'X', 'ts': round((started - self.origin) * 1e6), 'dur': round(seconds * 1e6),
+                 'pid': pid, 'tid': tid}
+                for name, started, seconds, tid in self.events
+            ]
+
+    def export(self, summary_path, trace_path):
+        summary = self.summary()
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        with open(trace_path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events()}, f)
+
+
+instruments = Instruments()
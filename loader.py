@@ -0,0 +1,60 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import instruments
+
+
+class TrackLoader:
+    # Opens sounds on a worker thread so the UI never waits on disk; keeps a small set of preloaded tracks
+    def __init__(self, load, max_preloaded=2):
+        self.load = load
+        self.max_preloaded = max_preloaded
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='track-loader')
+        self.lock = threading.Lock()
+        self.pending = {}  # path -> Future, oldest first
+
+    def request(self, path):
+        with self.lock:
+            future = self.pending.get(path)
+            if future is None:
+                future = self.executor.submit(self.timed_load, path)
+                self.pending[path] = future
+            return future
+
+    def timed_load(self, path):
+        with instruments.timer('track.load'):
+            return self.load(path)
+
+    def take(self, path):
+        # Hands the (possibly still loading) sound over to the caller; it is no longer tracked here
+        future = self.request(path)
+        with self.lock:
+            self.pending.pop(path, None)
+        return future
+
+    def preload(self, path):
+        self.request(path)
+        with self.lock:
+            while len(self.pending) > self.max_preloaded:
+                oldest = next(iter(self.pending))
+                self.release(self.pending.pop(oldest))
+
+    def is_ready(self, path):
+        with self.lock:
+            future = self.pending.get(path)
+        return future is not None and future.done()
+
+    def release(self, future):
+        def unload(done):
+            sound = None if done.cancelled() or done.exception() else done.result()
+            if sound:
+                sound.unload()
+        if not future.cancel():
+            future.add_done_callback(unload)
+
+    def shutdown(self):
+        with self.lock:
+            pending, self.pending = list(self.pending.values()), {}
+        for future in pending:
+            self.release(future)
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,176 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from formats import decode_blocks
+
+logger = logging.getLogger(__name__)
+
+TARGET_LOUDNESS = -18.0  # ReplayGain 2.0 reference level, in LUFS
+BLOCK_SECONDS = 0.4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+def parse_gain(value):
+    # "-6.52 dB" -> -6.52
+    return float(value.lower().replace('db', '').strip())
+
+
+def read_replaygain(path):
+    from mutagen import File as MutagenFile
+    try:
+        audio = MutagenFile(path, easy=True)
+    except Exception:
+        return None
+    tags = getattr(audio, 'tags', None)
+    if not tags or 'replaygain_track_gain' not in tags:
+        return None
+    try:
+        gain = parse_gain(tags['replaygain_track_gain'][0])
+        peak = float(tags['replaygain_track_peak'][0]) if 'replaygain_track_peak' in tags else 1.0
+    except (ValueError, KeyError, IndexError):
+        return None
+    return gain, peak
+
+
+def measure_loudness(blocks):
+    # Gated mean-square loudness over 400 ms blocks (BS.1770 gating, without the K-weighting filter)
+    import numpy as np  # Imported on first use to keep it out of app startup
+    energies, peak, carry, block_frames = [], 0.0, None, None
+    for rate, samples in blocks:
+        if block_frames is None:
+            block_frames = max(1, int(rate * BLOCK_SECONDS))
+        if samples.size:
+            peak = max(peak, float(np.abs(samples).max()))
+        if carry is not None:
+            samples = np.concatenate((carry, samples))
+        whole = len(samples) - len(samples) % block_frames
+        if whole:
+            blocks_view = samples[:whole].reshape(-1, block_frames, samples.shape[1])
+            # Mean square per channel, summed across channels
+            energies.append(np.square(blocks_view).mean(axis=1).sum(axis=1))
+        carry = samples[whole:]
+    if not energies:
+        return None, peak
+    energy = np.concatenate(energies)
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(energy)
+    gated = energy[loudness > ABSOLUTE_GATE]
+    if not gated.size:
+        return None, peak
+    relative = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE
+    gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+    return -0.691 + 10 * math.log10(gated.mean()), peak
+
+
+def analyze_file(path):
+    # Runs on a worker thread: (gain_db, peak, source) or None if nothing could be measured
+    tagged = read_replaygain(path)
+    if tagged:
+        return tagged + ('tag',)
+    try:
+        loudness, peak = measure_loudness(decode_blocks(path))
+    except (OSError, ValueError, EOFError, wave.Error) as e:
+        logger.warning("Error analysing loudness: %s", e)
+        return None
+    if loudness is None:
+        return None
+    return TARGET_LOUDNESS - loudness, peak, 'analysis'
+
+
+def gain_factor(gain_db, peak):
+    # Sound.volume tops out at 1.0, so loud tracks are brought down to the target and quiet ones
+    # play as they are; the peak keeps boosts from clipping
+    factor = 10 ** (gain_db / 20)
+    if peak > 0:
+        factor = min(factor, 1.0 / peak)
+    return min(factor, 1.0)
+
+
+class LoudnessAnalyzer:
+    # Per-track gain, cached in library.db by path + mtime + size and computed on a thread pool.
+    # NumPy and file reads release the GIL and ffmpeg decodes in its own process; forked workers
+    # could inherit an import lock held by the tag indexer and hang.
+    def __init__(self, db_file, on_analyzed=None, workers=None):
+        self.on_analyzed = on_analyzed
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS loudness ('
+            'path TEXT PRIMARY KEY, mtime REAL, size INTEGER, gain REAL, peak REAL, source TEXT)'
+        )
+        self.conn.commit()
+        self.gains = {}
+        self.queued = set()
+        workers = workers or min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='loudness')
+        self.dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='loudness-dispatch')
+
+    def gain_for(self, path):
+        # Volume multiplier for path; unanalysed tracks play unchanged
+        entry = self.gains.get(path)
+        if entry is None:
+            with self.lock:
+                entry = self.conn.execute(
+                    'SELECT mtime, size, gain, peak FROM loudness WHERE path = ?', (path,)
+                ).fetchone()
+            if entry is None:
+                return 1.0
+            self.gains[path] = entry
+        mtime, size, gain, peak = entry
+        return gain_factor(gain, peak) if gain is not None else 1.0
+
+    def analyze(self, paths):
+        paths = [path for path in paths if path not in self.queued]
+        self.queued.update(paths)
+        if paths:
+            self.dispatcher.submit(self.run, paths)
+
+    def run(self, paths, batch_size=32):
+        started, analysed = time.perf_counter(), 0
+        for start in range(0, len(paths), batch_size):
+            batch = []
+            for path in paths[start:start + batch_size]:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                cached = self.gains.get(path)
+                if cached is None:
+                    with self.lock:
+                        cached = self.conn.execute(
+                            'SELECT mtime, size, gain, peak FROM loudness WHERE path = ?', (path,)
+                        ).fetchone()
+                if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+                    continue
+                batch.append((path, stat.st_mtime, stat.st_size))
+            if not batch:
+                continue
+            results = list(self.executor.map(analyze_file, [entry[0] for entry in batch]))
+            rows = []
+            for (path, mtime, size), result in zip(batch, results):
+                gain, peak, source = result if result else (None, None, None)
+                self.gains[path] = (mtime, size, gain, peak)
+                rows.append((path, mtime, size, gain, peak, source))
+            with self.lock:
+                self.conn.executemany('INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self.conn.commit()
+            analysed += len(rows)
+            if self.on_analyzed:
+                self.on_analyzed([row[0] for row in rows])
+        if analysed:
+            elapsed = time.perf_counter() - started
+            logger.info("Loudness: analysed %d tracks in %.1f s (%.1f tracks/s)", analysed, elapsed, analysed / elapsed)
+        self.queued.difference_update(paths)
+
+    def close(self):
+        self.dispatcher.shutdown(wait=False, cancel_futures=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            self.conn.close()
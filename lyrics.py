@@ -0,0 +1,177 @@
+import bisect
+import logging
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from streaming import is_url
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP = re.compile(r'\[(\d+):(\d+(?:[.:]\d+)?)\]')
+OFFSET_TAG = re.compile(r'\[offset:\s*([+-]?\d+)\]', re.IGNORECASE)
+ID_TAG = re.compile(r'\[[a-z]+:.*\]$', re.IGNORECASE)  # [ar:...], [ti:...] and the like
+WORD_TIMING = re.compile(r'<\d+:\d+(?:[.:]\d+)?>')  # Enhanced LRC per-word times; only lines are used
+
+
+class Lyrics:
+    # Lines of lyrics. Synced ones keep their start times in an array of doubles, in line order,
+    # so the line playing at any position is one bisect however long the track is.
+    def __init__(self, lines, times=None):
+        self.lines = lines
+        self.times = times  # array('d') of start seconds, or None when unsynced
+
+    @property
+    def synced(self):
+        return bool(self.times)
+
+    def line_at(self, position):
+        # Index of the line playing at position seconds; -1 before the first (or when unsynced)
+        return bisect.bisect_right(self.times, position) - 1 if self.times else -1
+
+    def time_to_next(self, position):
+        # Seconds until the next line starts, or None after the last
+        if not self.times:
+            return None
+        index = bisect.bisect_right(self.times, position)
+        return self.times[index] - position if index < len(self.times) else None
+
+
+def parse_lrc(text):
+    # LRC text ("[mm:ss.xx]line", several stamps per line allowed, [offset:ms] honoured) into
+    # Lyrics; text without any timestamps comes back as unsynced lines
+    offset = OFFSET_TAG.search(text)
+    shift = -int(offset.group(1)) / 1000.0 if offset else 0.0  # A positive offset shows lines sooner
+    timed, plain = [], []
+    for raw in text.splitlines():
+        line = raw.strip()
+        stamps = []
+        while True:
+            match = TIMESTAMP.match(line)
+            if match is None:
+                break
+            stamps.append(int(match.group(1)) * 60 + float(match.group(2).replace(':', '.')))
+            line = line[match.end():]
+        if stamps:
+            line = WORD_TIMING.sub('', line).strip()
+            timed.extend((max(0.0, stamp + shift), line) for stamp in stamps)
+        elif not ID_TAG.match(line):
+            plain.append(raw.rstrip())
+    if not timed:
+        while plain and not plain[-1]:
+            plain.pop()
+        return Lyrics(tuple(plain))
+    timed.sort(key=lambda entry: entry[0])
+    return Lyrics(tuple(line for _, line in timed), array('d', (stamp for stamp, _ in timed)))
+
+
+class TrackDetails:
+    # The fields the info panel shows beyond the indexed tags; any of them may be None
+    def __init__(self, album=None, year=None, track=None, lyrics=None):
+        self.album = album
+        self.year = year
+        self.track = track
+        self.lyrics = lyrics
+
+
+def first_text(values):
+    if not values:
+        return None
+    value = values[0] if isinstance(values, list) else values
+    text = str(value).strip()
+    return text or None
+
+
+def read_details(path):
+    # Album, year, track number and lyrics. A .lrc file next to the track wins over embedded
+    # lyrics: SYLT (synced) or USLT frames in ID3, LYRICS comments in Vorbis/FLAC, ©lyr in MP4.
+    from mutagen import File as MutagenFile  # Imported on first use to keep it out of app startup
+    from mutagen.mp4 import MP4Tags
+    details = TrackDetails()
+    try:
+        audio = MutagenFile(path)
+    except Exception as e:
+        logger.warning("Error reading track details: %s", e)
+        audio = None
+    tags = audio.tags if audio is not None else None
+    lyrics_text = None
+    if tags is not None and hasattr(tags, 'getall'):
+        details.album, details.year, details.track = (
+            first_text(tags[frame].text) if frame in tags else None for frame in ('TALB', 'TDRC', 'TRCK')
+        )
+        synced = [frame for frame in tags.getall('SYLT') if frame.format == 2]  # 2: times in milliseconds
+        if synced:
+            entries = sorted(synced[0].text, key=lambda entry: entry[1])
+            details.lyrics = Lyrics(tuple(text.strip() for text, _ in entries),
+                                    array('d', (time / 1000.0 for _, time in entries)))
+        unsynced = tags.getall('USLT')
+        if unsynced:
+            lyrics_text = unsynced[0].text
+    elif isinstance(tags, MP4Tags):
+        details.album = first_text(tags.get('\xa9alb'))
+        details.year = first_text(tags.get('\xa9day'))
+        number = tags.get('trkn')
+        if number and number[0][0]:
+            details.track = f'{number[0][0]}/{number[0][1]}' if number[0][1] else str(number[0][0])
+        lyrics_text = first_text(tags.get('\xa9lyr'))
+    elif tags is not None:
+        details.album = first_text(tags.get('album'))
+        details.year = first_text(tags.get('date'))
+        details.track = first_text(tags.get('tracknumber'))
+        lyrics_text = first_text(tags.get('lyrics') or tags.get('unsyncedlyrics'))
+    if details.year:
+        details.year = details.year[:4]
+    sidecar = os.path.splitext(path)[0] + '.lrc'
+    if os.path.isfile(sidecar):
+        with open(sidecar, 'r', encoding='utf-8-sig', errors='replace') as f:
+            details.lyrics = parse_lrc(f.read())
+    elif details.lyrics is None and lyrics_text:
+        details.lyrics = parse_lrc(lyrics_text)  # Embedded lyrics are sometimes LRC text as well
+    return details
+
+
+class TrackDetailsLoader:
+    # Reads TrackDetails on a worker thread, only for tracks the panel is asked to show, and keeps
+    # the last few in memory keyed by path + mtime + size, so lyrics are parsed once per file.
+    # on_ready(path, details) is called from the worker; cache hits return straight from request().
+    def __init__(self, on_ready, max_entries=32):
+        self.on_ready = on_ready
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='details')
+
+    def request(self, path):
+        if is_url(path):
+            return TrackDetails()  # Nothing beyond the title and artist for streams
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            logger.warning("Error reading track details: %s", e)
+            return TrackDetails()  # Gone or unreadable: nothing to show, and nothing will come later
+        key = (path, stat.st_mtime, stat.st_size)
+        with self.lock:
+            details = self.entries.get(key)
+            if details is not None:
+                self.entries.move_to_end(key)
+                return details
+        self.executor.submit(self.load, path, key)
+        return None
+
+    def load(self, path, key):
+        try:
+            details = read_details(path)
+        except OSError as e:
+            logger.warning("Error reading lyrics: %s", e)
+            details = TrackDetails()
+        with self.lock:
+            self.entries[key] = details
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        self.on_ready(path, details)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,29 +1,54 @@
 import os
-import json
 os.environ['KIVY_GL_BACKEND'] = 'angle_sdl2'
-import random
+import logging
+logging.basicConfig(level=os.environ.get('MUSICPLAYER_LOG_LEVEL', 'INFO'))
+from startup import startup_timer
 from kivy.core.audio import SoundLoader
 from kivy.clock import Clock
 from kivy.metrics import dp, sp
 from kivy.core.window import Window
 from kivy.animation import Animation
 from kivy.uix.image import Image
+from kivy.uix.widget import Widget
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.relativelayout import RelativeLayout
 from kivy.uix.behaviors import DragBehavior
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.properties import NumericProperty
 from kivy.graphics import Color, Rectangle
-from kivy.utils import platform
+from kivy.graphics.texture import Texture
+from kivy.utils import escape_markup, platform
+startup_timer.mark('import kivy')
 
 from kivymd.app import MDApp
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.button import MDRaisedButton, MDIconButton
-from kivymd.uix.filemanager import MDFileManager
 from kivymd.uix.label import MDLabel
 from kivymd.uix.slider import MDSlider
-from kivymd.uix.list import OneLineListItem, MDList
-
-from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
+from kivymd.uix.list import OneLineListItem
+from kivymd.uix.textfield import MDTextField
+startup_timer.mark('import kivymd')
+
+from engine import PlayerEngine
+from formats import audio_extensions
+from artwork import ArtworkLoader
+from instrumentation import instruments
+from lyrics import TrackDetailsLoader
+from remote import RemoteControl
+from rows import HIGHLIGHT_COLOR, PlaylistRows
+from streaming import is_url
+from waveform import WaveformLoader, render_waveform
+startup_timer.mark('import player modules')
+
+BUTTON_OFF_COLOR = [0.1, 0.3, 0.1, 1]
+CROSSFADE_STEPS = (0, 2, 4, 8)  # Seconds; the crossfade button cycles through these
+# Details shown above the lyrics in the info panel, in order; any of album, year, track
+INFO_FIELDS = tuple(field.strip() for field in
+                    os.environ.get('MUSICPLAYER_INFO_FIELDS', 'album,year,track').split(','))
+LYRICS_CONTEXT = (2, 3)  # Synced lyrics lines shown before and after the current one
+
+logger = logging.getLogger(__name__)
 
 class DraggableSidebar(DragBehavior, RelativeLayout):
     def __init__(self, **kwargs):
@@ -44,8 +69,89 @@ class DraggableSidebar(DragBehavior, RelativeLayout):
         self.shadow.size = self.size
         self.shadow.pos = self.pos
 
+class WaveformBar(Widget):
+    # Scrubbable seek bar drawn from a track's peaks. The waveform is rendered once per size into a
+    # texture; playback progress only changes how much of a second, tinted copy is shown.
+    progress = NumericProperty(0)  # 0-1
+
+    def __init__(self, on_seek, **kwargs):
+        super().__init__(**kwargs)
+        self.on_seek = on_seek  # Called with the 0-1 position where a scrub ended
+        self.peak_file = None
+        self.scrubbing = False
+        with self.canvas:
+            Color(0.45, 0.45, 0.55, 1)
+            self.wave_rect = Rectangle()
+            Color(*HIGHLIGHT_COLOR)
+            self.played_rect = Rectangle()
+        self.bind(pos=self.redraw, size=self.redraw, progress=self.update_played)
+
+    def set_peaks(self, peak_file):
+        self.peak_file = peak_file
+        self.redraw()
+
+    def redraw(self, *args):
+        width, height = max(int(self.width), 1), max(int(self.height), 1)
+        pixels = render_waveform(self.peak_file.peaks(width) if self.peak_file else None, width, height)
+        texture = Texture.create(size=(width, height), colorfmt='rgba')
+        texture.blit_buffer(pixels, colorfmt='rgba', bufferfmt='ubyte')
+        self.wave_rect.texture = texture
+        self.wave_rect.pos, self.wave_rect.size = self.pos, self.size
+        self.played_rect.texture = texture
+        self.update_played()
+
+    def update_played(self, *args):
+        progress = min(max(self.progress, 0), 1)
+        self.played_rect.pos = self.pos
+        self.played_rect.size = (self.width * progress, self.height)
+        self.played_rect.tex_coords = (0, 0, progress, 0, progress, 1, 0, 1)
+
+    def fraction_at(self, x):
+        return min(max((x - self.x) / self.width, 0), 1) if self.width else 0
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super().on_touch_down(touch)
+        touch.grab(self)
+        self.scrubbing = True
+        self.progress = self.fraction_at(touch.x)
+        return True
+
+    def on_touch_move(self, touch):
+        if touch.grab_current is not self:
+            return super().on_touch_move(touch)
+        self.progress = self.fraction_at(touch.x)
+        return True
+
+    def on_touch_up(self, touch):
+        if touch.grab_current is not self:
+            return super().on_touch_up(touch)
+        touch.ungrab(self)
+        self.scrubbing = False
+        self.on_seek(self.fraction_at(touch.x))
+        return True
+
+
+class PlaylistItem(OneLineListItem):
+    index = NumericProperty(0)
+
+    def on_release(self):
+        MDApp.get_running_app().play_song_by_index(self.index)
+
+class PlaylistView(PlaylistRows, RecycleView):
+    # Only the rows on screen get a PlaylistItem; the rest of the playlist lives in self.data
+    def __init__(self, row_text=os.path.basename, **kwargs):
+        RecycleView.__init__(self, **kwargs)
+        PlaylistRows.__init__(self, row_text)
+        self.viewclass = PlaylistItem
+        layout = RecycleBoxLayout(orientation='vertical', size_hint_y=None,
+                                  default_size=(None, dp(48)), default_size_hint=(1, None))
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+
 class MusicPlayer(MDApp):
     def build(self):
+        startup_timer.mark('build start')
         # Simplify screen resolution logic for compatibility with Pydroid 3
         if platform == "android":
             Window.fullscreen = True  # Use fullscreen mode for Android
@@ -55,19 +161,41 @@ class MusicPlayer(MDApp):
         self.theme_cls.theme_style = "Dark"
         self.theme_cls.primary_palette = "BlueGray"  # Changed primary theme color
 
-        self.playlist = []
-        self.current_index = 0
-        self.current_song = None
-        self.sound = None
+        self.screen_visible = True
 
         self.playlist_file = 'playlist.json'
-        self.load_playlist()
-
-        self.file_manager = MDFileManager(
-            exit_manager=self.exit_manager,
-            select_path=self.select_path,
-            ext=['.mp3', '.wav']
-        )
+        self.save_trigger = Clock.create_trigger(self.flush_library, 1.0)  # Coalesce bursts of edits
+        stream_local_mb = os.environ.get('MUSICPLAYER_STREAM_LOCAL_MB')
+        self.engine = PlayerEngine(self.playlist_file, SoundLoader.load, listener=self,
+                                   schedule=lambda callback: Clock.schedule_once(lambda dt: callback()),
+                                   schedule_later=lambda delay, callback: Clock.schedule_once(
+                                       lambda dt: callback(), delay),
+                                   stream_local_from=int(stream_local_mb) * 1024 * 1024 if stream_local_mb else None,
+                                   content_dedup=os.environ.get('MUSICPLAYER_CONTENT_DEDUP') == '1')
+
+        library_dir = os.path.dirname(self.engine.library_db)
+        self.artwork = ArtworkLoader(os.path.join(library_dir, 'art_cache'), on_ready=self.on_artwork_ready)
+        self.waveforms = WaveformLoader(os.path.join(library_dir, 'peaks'), on_ready=self.on_waveform_ready)
+        self.details_loader = TrackDetailsLoader(on_ready=self.on_details_ready)
+        self.details = None  # TrackDetails of the current track, read when the info panel is shown
+        self.lyrics_line = None  # Index of the highlighted lyrics line, so the text is only rebuilt when it moves
+        # Local control socket for kiosk controllers; off unless a port or socket path is configured
+        remote_port = os.environ.get('MUSICPLAYER_REMOTE_PORT')
+        remote_socket = os.environ.get('MUSICPLAYER_REMOTE_SOCKET')
+        self.remote = None
+        if remote_port or remote_socket:
+            self.remote = RemoteControl(self.remote_commands(),
+                                        schedule=lambda callback: Clock.schedule_once(lambda dt: callback()),
+                                        port=int(remote_port) if remote_port else None, unix_path=remote_socket)
+
+        # Created on first use; see file_manager_open, folder_manager_open, smart_menu_open,
+        # playlist_menu_open and equalizer_menu_open
+        self.file_manager = None
+        self.folder_manager = None
+        self.smart_menu = None
+        self.playlist_menu = None
+        self.equalizer_menu = None
+        self.smart_list = None  # Name of the smart playlist shown in the sidebar, None for the whole library
 
         main_layout = FloatLayout()
         main_layout.canvas.before.clear()
@@ -87,9 +215,36 @@ class MusicPlayer(MDApp):
         )
         self.sidebar.add_widget(close_button)
 
-        self.playlist_layout = MDList(size_hint=(1, 0.9))  # Adjust size_hint to fill the sidebar
+        self.search_field = MDTextField(
+            hint_text="Search or paste a URL",
+            size_hint=(None, None),
+            width=dp(160),
+            height=dp(40),
+            pos_hint={"x": 0, "top": 1}
+        )
+        self.search_field.bind(text=self.on_search_text, on_text_validate=self.on_search_enter)
+        self.sidebar.add_widget(self.search_field)
+
+        smart_list_button = MDIconButton(
+            icon="playlist-star",
+            size_hint=(None, None),
+            size=(dp(30), dp(30)),
+            pos_hint={"right": 1, "y": 0.9},
+            on_press=self.smart_menu_open
+        )
+        self.sidebar.add_widget(smart_list_button)
+
+        playlists_button = MDIconButton(
+            icon="format-list-bulleted-square",
+            size_hint=(None, None),
+            size=(dp(30), dp(30)),
+            pos_hint={"right": 0.82, "y": 0.9},
+            on_press=self.playlist_menu_open
+        )
+        self.sidebar.add_widget(playlists_button)
+
+        self.playlist_layout = PlaylistView(row_text=self.engine.song_label, size_hint=(1, 0.9))  # Adjust size_hint to fill the sidebar
         self.sidebar.add_widget(self.playlist_layout)
-        self.refresh_playlist_ui()
         main_layout.add_widget(self.sidebar)
 
         content_layout = MDBoxLayout(orientation='vertical', size_hint=(1, 1), padding=dp(5), spacing=dp(5),
@@ -99,9 +254,19 @@ class MusicPlayer(MDApp):
                                     padding=dp(5), spacing=dp(5))
         toggle_sidebar_btn = MDIconButton(icon='playlist-music', on_press=self.toggle_sidebar)  # Playlist icon
         header_layout.add_widget(toggle_sidebar_btn)
+        perf_overlay_btn = MDIconButton(icon='speedometer', on_press=self.toggle_perf_overlay)
+        header_layout.add_widget(perf_overlay_btn)
+        crossfade_btn = MDIconButton(icon='transition', on_press=self.cycle_crossfade)
+        crossfade_btn.md_bg_color = HIGHLIGHT_COLOR if self.engine.crossfade_seconds else BUTTON_OFF_COLOR
+        header_layout.add_widget(crossfade_btn)
+        self.equalizer_button = MDIconButton(icon='equalizer', on_press=self.equalizer_menu_open)
+        self.equalizer_button.md_bg_color = HIGHLIGHT_COLOR if self.engine.equalizer else BUTTON_OFF_COLOR
+        header_layout.add_widget(self.equalizer_button)
+        info_panel_btn = MDIconButton(icon='text-box-outline', on_press=self.toggle_info_panel)
+        header_layout.add_widget(info_panel_btn)
         content_layout.add_widget(header_layout)
 
-        self.album_art = Image(source='logo.png', size_hint=(1, 0.3))
+        self.album_art = Image(size_hint=(1, 0.3))  # Source is set after the first frame
         content_layout.add_widget(self.album_art)
 
         song_info_layout = MDBoxLayout(orientation='vertical', size_hint=(1, None), height=dp(60),
@@ -114,6 +279,9 @@ class MusicPlayer(MDApp):
         song_info_layout.add_widget(self.artist_name)
         content_layout.add_widget(song_info_layout)
 
+        self.waveform_bar = WaveformBar(on_seek=self.seek_fraction, size_hint=(1, None), height=dp(48))
+        content_layout.add_widget(self.waveform_bar)
+
         progress_layout = MDBoxLayout(orientation='horizontal', size_hint=(1, None), height=dp(25),
                                       padding=dp(5), spacing=dp(5))
         # Ensure the current time label is properly initialized
@@ -129,7 +297,7 @@ class MusicPlayer(MDApp):
         content_layout.add_widget(progress_layout)
 
         volume_layout = MDBoxLayout(orientation='horizontal', size_hint=(1, None), height=dp(30), spacing=dp(5))
-        self.volume_slider = MDSlider(min=0, max=1, value=1, size_hint=(0.8, 1))
+        self.volume_slider = MDSlider(min=0, max=1, value=self.engine.volume, size_hint=(0.8, 1))
         self.volume_slider.bind(value=self.set_volume)
         self.volume_label = MDLabel(text=f'Volume: {self.volume_slider.value:.2f}', size_hint=(0.2, 1),
                                     halign='center', theme_text_color='Custom', text_color=[0.9, 0.9, 0.9, 1],
@@ -141,7 +309,7 @@ class MusicPlayer(MDApp):
         controls_layout = MDBoxLayout(orientation='horizontal', size_hint=(1, None), height=dp(60), spacing=dp(10),
                                       padding=dp(10), pos_hint={'center_x': 0.5})
         shuffle_button = MDIconButton(icon='shuffle', size_hint=(None, None), size=(dp(50), dp(50)))
-        shuffle_button.md_bg_color = [0.1, 0.6, 0.1, 1]
+        shuffle_button.md_bg_color = HIGHLIGHT_COLOR if self.engine.play_order.shuffle else BUTTON_OFF_COLOR
         shuffle_button.bind(on_press=self.shuffle_playlist)
 
         prev_button = MDIconButton(icon='skip-previous', size_hint=(None, None), size=(dp(50), dp(50)))
@@ -156,7 +324,8 @@ class MusicPlayer(MDApp):
         next_button.md_bg_color = [0.1, 0.6, 0.1, 1]
         next_button.bind(on_press=self.play_next_song)
 
-        repeat_button = MDIconButton(icon='repeat', size_hint=(None, None), size=(dp(50), dp(50)))
+        repeat_button = MDIconButton(icon='repeat-once' if self.engine.repeat_one else 'repeat',
+                                     size_hint=(None, None), size=(dp(50), dp(50)))
         repeat_button.md_bg_color = [0.1, 0.6, 0.1, 1]
         repeat_button.bind(on_press=self.repeat_song)
 
@@ -168,23 +337,107 @@ class MusicPlayer(MDApp):
 
         content_layout.add_widget(controls_layout)
 
+        library_layout = MDBoxLayout(orientation='horizontal', size_hint=(1, None), height=dp(40), spacing=dp(10))
         select_song_button = MDRaisedButton(
             text="Select Song",
             size_hint=(0.5, None),
             height=dp(40),
-            pos_hint={'center_x': 0.5, 'center_y': 0.1},
             md_bg_color=[0.2, 0.6, 0.2, 1],
             theme_text_color="Custom",
             text_color=[1, 1, 1, 1]
         )
         select_song_button.bind(on_press=self.file_manager_open)
-        content_layout.add_widget(select_song_button)
+        scan_folder_button = MDRaisedButton(
+            text="Scan Folder",
+            size_hint=(0.5, None),
+            height=dp(40),
+            md_bg_color=[0.2, 0.6, 0.2, 1],
+            theme_text_color="Custom",
+            text_color=[1, 1, 1, 1]
+        )
+        scan_folder_button.bind(on_press=self.folder_manager_open)
+        library_layout.add_widget(select_song_button)
+        library_layout.add_widget(scan_folder_button)
+        content_layout.add_widget(library_layout)
 
         main_layout.add_widget(content_layout)
 
+        # Timing overlay, hidden until the speedometer button turns instrumentation on
+        self.perf_overlay = MDLabel(
+            text='',
+            size_hint=(None, None),
+            size=(dp(220), dp(180)),
+            pos_hint={'right': 1, 'top': 0.92},
+            valign='top',
+            theme_text_color='Custom',
+            text_color=[1, 1, 0.6, 1],
+            font_size=sp(10),
+            opacity=0
+        )
+        main_layout.add_widget(self.perf_overlay)
+
+        # Album details and lyrics over the album art, hidden until the info button is pressed
+        self.info_panel = MDLabel(
+            text='',
+            markup=True,
+            size_hint=(0.9, 0.3),
+            pos_hint={'center_x': 0.5, 'top': 0.92},
+            halign='center',
+            valign='middle',
+            theme_text_color='Custom',
+            text_color=[0.9, 0.9, 0.9, 1],
+            font_size=sp(13),
+            opacity=0
+        )
+        main_layout.add_widget(self.info_panel)
+
+        Window.bind(on_minimize=lambda *args: self.on_pause(), on_restore=lambda *args: self.on_resume())
+        Window.bind(on_flip=self.on_first_frame)
+
+        startup_timer.mark('build end')
         return main_layout
 
+    def on_first_frame(self, *args):
+        Window.unbind(on_flip=self.on_first_frame)
+        startup_timer.mark('first frame')
+        Clock.schedule_once(self.finish_startup)
+
+    def finish_startup(self, dt):
+        # Work that used to run inside build(), now done once the player chrome is on screen
+        self.album_art.source = 'logo.png'
+        self.engine.index_tags()
+        self.publish_state()
+        startup_timer.mark('deferred startup done')
+        logger.info("Startup timings: %s", startup_timer.report())
+        profile_path = os.environ.get('MUSICPLAYER_STARTUP_PROFILE')
+        if profile_path:
+            # Headless timing run: write the report and exit
+            startup_timer.dump(profile_path)
+            self.stop()
+
+    def on_pause(self):
+        # Nothing on screen to update, so stop waking up for progress ticks
+        self.screen_visible = False
+        Clock.unschedule(self.update_progress)
+        self.flush_library()
+        return True
+
+    def on_resume(self):
+        self.screen_visible = True
+        self.update_progress()
+
+    def on_stop(self):
+        if self.remote:
+            self.remote.close()
+        self.artwork.shutdown()
+        self.waveforms.shutdown()
+        self.details_loader.shutdown()
+        self.engine.close()
+
     def toggle_sidebar(self, instance):
+        if not self.playlist_layout.populated:
+            self.playlist_layout.set_songs(self.engine.playlist, self.engine.current_index)
+            self.engine.build_search_index()
         target_x = 0 if self.sidebar.x < 0 else -dp(200)
         Animation(x=target_x, duration=0.3).start(self.sidebar)
         if target_x == 0:
@@ -195,24 +448,42 @@ class MusicPlayer(MDApp):
                 parent.add_widget(self.sidebar)
 
     def file_manager_open(self, *args):
+        if self.file_manager is None:
+            from kivymd.uix.filemanager import MDFileManager
+            self.file_manager = MDFileManager(
+                exit_manager=self.exit_manager,
+                select_path=self.select_path,
+                ext=list(audio_extensions())
+            )
         self.file_manager.show(os.getcwd())
 
     def select_path(self, path):
         self.exit_manager()
-        if path not in self.playlist:
-            self.playlist.append(path)
-            self.current_index = len(self.playlist) - 1
-            self.save_playlist()
-            self.refresh_playlist_ui()
-        self.current_song = path
-        self.play_song()
+        Clock.unschedule(self.update_progress)
+        self.engine.select_path(path)
 
     def exit_manager(self, *args):
         self.file_manager.close()
 
+    def folder_manager_open(self, *args):
+        if self.folder_manager is None:
+            from kivymd.uix.filemanager import MDFileManager
+            self.folder_manager = MDFileManager(
+                exit_manager=self.exit_folder_manager,
+                select_path=self.select_folder,
+                selector='folder'
+            )
+        self.folder_manager.show(os.getcwd())
+
+    def exit_folder_manager(self, *args):
+        self.folder_manager.close()
+
+    def select_folder(self, path):
+        self.exit_folder_manager()
+        self.engine.scan_folder(path)
+
     def set_volume(self, instance, value):
-        if self.sound:
-            self.sound.volume = value
+        self.engine.set_volume(value)
         self.volume_label.text = f'Volume: {value:.2f}'
 
     def format_duration(self, duration):
@@ -220,117 +491,414 @@ class MusicPlayer(MDApp):
         seconds = int(duration % 60)
         return f'{minutes}:{seconds:02d}'
 
-    def update_progress(self, dt):
-        if self.sound and self.sound.state == 'play':
-            # Manually increment playback position
-            self.playback_position += dt
-            if self.sound.length and self.playback_position >= self.sound.length:
-                self.play_next_song(None)
-            else:
-                # Update the current time label with the manually tracked position
-                self.current_time_label.text = self.format_duration(self.playback_position)
-        else:
-            print("Warning: Sound is not playing")
-
-    def play_song(self):
-        if self.sound:
-            self.sound.stop()
-        if self.current_song:
-            self.sound = SoundLoader.load(self.current_song)
-            if self.sound:
-                self.sound.play()
-                self.sound.volume = self.volume_slider.value
-                self.update_metadata()
-                self.play_button.icon = 'pause-circle'
-                self.playback_position = 0  # Initialize manual playback position
-                Clock.unschedule(self.update_progress)
-                Clock.schedule_interval(self.update_progress, 0.5)
-                print(f"Playing: {self.current_song}")
-            else:
-                self.song_title.text = 'Failed to load song'
-                self.artist_name.text = ''
-                print("Error: Failed to load sound")
-        else:
-            self.song_title.text = 'No song selected'
-            self.artist_name.text = ''
-            print("Error: No song selected")
+    def update_progress(self, *args):
+        # Track end comes from the sound's on_stop; this only refreshes the label and reschedules itself
+        Clock.unschedule(self.update_progress)
+        playback_clock = self.engine.playback_clock
+        position = playback_clock.position()
+        self.current_time_label.text = self.format_duration(position)
+        length = playback_clock.length()
+        if length and not self.waveform_bar.scrubbing:
+            self.waveform_bar.progress = position / length
+        delay = playback_clock.time_to_next_second()
+        lyrics = self.details.lyrics if self.details and self.info_panel.opacity else None
+        if lyrics and lyrics.synced:
+            self.update_lyrics(lyrics.line_at(position))
+            until_next_line = lyrics.time_to_next(position)
+            if until_next_line is not None:
+                delay = min(delay, until_next_line + 0.01)  # Wake up for the next line as well
+        if playback_clock.playing and self.screen_visible:
+            Clock.schedule_once(self.update_progress, delay)
+
+    def seek(self, position):
+        self.engine.seek(position)
+        self.update_progress()
+
+    def seek_fraction(self, fraction):
+        peak_file = self.waveform_bar.peak_file
+        length = self.engine.playback_clock.length() or (peak_file.duration() if peak_file else 0)
+        if length:
+            self.seek(fraction * length)
 
     def update_metadata(self):
+        song = self.engine.current_song
         try:
-            if not self.current_song or not os.path.exists(self.current_song):
+            if not song or not os.path.exists(song):
                 raise FileNotFoundError("Current song file does not exist.")
-            
-            audio = EasyID3(self.current_song)
-            self.song_title.text = audio.get('title', ['Unknown Title'])[0]
-            self.artist_name.text = audio.get('artist', ['Unknown Artist'])[0]
+
+            info = self.engine.track_info(song)
+            if info is None:
+                # Not indexed yet (or changed on disk): show the filename until the indexer calls back
+                self.song_title.text = os.path.basename(song)
+                self.artist_name.text = "Unknown Artist"
+                return
+            self.song_title.text = info['title'] or os.path.basename(song)
+            self.artist_name.text = info['artist'] or 'Unknown Artist'
         except FileNotFoundError as e:
             self.song_title.text = "File Not Found"
             self.artist_name.text = ""
-            print(f"Error: {e}")
-        except Exception as e:
-            self.song_title.text = os.path.basename(self.current_song) if self.current_song else "Unknown Song"
-            self.artist_name.text = "Unknown Artist"
-            print(f"Error reading metadata: {e}")
+            logger.warning("Error: %s", e)
 
-    def play_pause_song(self, instance):
-        if self.sound:
-            if self.sound.state == 'play':
-                self.sound.stop()
-                instance.icon = 'play-circle'
-            else:
-                self.sound.play()
-                instance.icon = 'pause-circle'
+    def toggle_info_panel(self, *args):
+        if self.info_panel.opacity:
+            self.info_panel.opacity = 0
+        else:
+            self.info_panel.opacity = 1
+            self.update_details()
+
+    def update_details(self):
+        # Reads the extra fields and lyrics only while the panel is showing
+        self.details = None
+        self.lyrics_line = None
+        if not self.info_panel.opacity or not self.engine.current_song:
+            self.info_panel.text = ''
+            return
+        details = self.details_loader.request(self.engine.current_song)
+        if details is None:
+            self.info_panel.text = 'Loading...'
+        else:
+            self.apply_details(self.engine.current_song, details)
+
+    def on_details_ready(self, path, details):
+        # Called from the loader thread
+        Clock.schedule_once(lambda dt: self.apply_details(path, details))
+
+    def apply_details(self, path, details):
+        if path != self.engine.current_song or not self.info_panel.opacity:
+            return
+        self.details = details
+        self.lyrics_line = None
+        if details.lyrics and details.lyrics.synced:
+            self.update_progress()  # Highlights the current line and schedules the next one
+        else:
+            self.update_lyrics(-1)
+
+    def update_lyrics(self, line):
+        if line == self.lyrics_line:
+            return
+        self.lyrics_line = line
+        details = self.details
+        values = {'album': details.album, 'year': details.year,
+                  'track': f'Track {details.track}' if details.track else None}
+        header = ' · '.join(values[field] for field in INFO_FIELDS if values.get(field))
+        parts = [f'[b]{escape_markup(header)}[/b]'] if header else []
+        lyrics = details.lyrics
+        if lyrics and lyrics.synced:
+            before, after = LYRICS_CONTEXT
+            first = max(0, line - before)
+            for index in range(first, min(len(lyrics.lines), max(line, 0) + after + 1)):
+                text = escape_markup(lyrics.lines[index])
+                parts.append(f'[color=66dd66][b]{text}[/b][/color]' if index == line else text)
+        elif lyrics:
+            parts.append(escape_markup('\n'.join(lyrics.lines)))
+        self.info_panel.text = '\n'.join(parts) or 'No details'
+
+    def update_album_art(self):
+        thumb = self.artwork.request(self.engine.current_song, self.album_art.size)
+        if thumb:
+            self.show_thumbnail(thumb)
+
+    def on_artwork_ready(self, path, thumb):
+        # Called from the artwork worker
+        Clock.schedule_once(lambda dt: self.apply_artwork(path, thumb))
+
+    def apply_artwork(self, path, thumb):
+        if path != self.engine.current_song:
+            return
+        if thumb:
+            self.show_thumbnail(thumb)
         else:
-            self.play_song()
+            self.album_art.source = 'album_art.jpg'
+
+    def update_waveform(self):
+        # Cached peak files come back straight away; new tracks show a flat bar until the worker is done
+        self.waveform_bar.progress = 0
+        self.waveform_bar.set_peaks(self.waveforms.request(self.engine.current_song))
+
+    def on_waveform_ready(self, path, peak_file):
+        # Called from the waveform worker
+        Clock.schedule_once(lambda dt: self.apply_waveform(path, peak_file))
+
+    def apply_waveform(self, path, peak_file):
+        if path == self.engine.current_song and peak_file is not self.waveform_bar.peak_file:
+            self.waveform_bar.set_peaks(peak_file)
+
+    def show_thumbnail(self, thumb):
+        texture = Texture.create(size=(thumb.width, thumb.height), colorfmt='rgba')
+        texture.blit_buffer(thumb.pixels, colorfmt='rgba', bufferfmt='ubyte')
+        texture.flip_vertical()
+        self.album_art.source = ''  # So a later switch back to a file source always reloads
+        self.album_art.texture = texture
+
+    # PlayerEngine listener callbacks, always called on the UI thread
+
+    def track_loading(self, song):
+        self.song_title.text = 'Loading...'
+        self.artist_name.text = ''
+
+    def track_started(self, index, song):
+        self.update_metadata()
+        self.update_details()
+        self.update_album_art()
+        self.update_waveform()
+        self.play_button.icon = 'pause-circle'
+        self.playlist_layout.highlight(index)
+        self.update_progress()
+
+    def track_failed(self, song, error):
+        self.song_title.text = 'Failed to load song' if song else 'No song selected'
+        self.artist_name.text = ''
+        logger.error("Error: %s", error)
+        self.publish_state()
+
+    def playback_toggled(self, playing):
+        self.play_button.icon = 'pause-circle' if playing else 'play-circle'
+        self.update_progress()
+        self.publish_state()
+
+    def playlist_reset(self):
+        if self.search_field.text.strip() and self.playlist_layout.populated:
+            self.search_ready()  # Re-run the query so the results reflect the new playlist
+        else:
+            self.refresh_playlist_ui()
+
+    def songs_added(self, songs):
+        self.playlist_layout.extend_songs(songs)
+
+    def playlist_opened(self, name):
+        self.smart_list = None
+        self.search_field.text = ''
+        self.playlist_layout.show_list(name, self.engine.playlist, self.engine.current_index)
+
+    def tags_updated(self, paths):
+        self.playlist_layout.forget_saved_lists()  # Their row titles may be out of date now
+        playlist = self.engine.playlist
+        changed = set(paths)
+        indices = (playlist.find(path) for path in changed)
+        self.playlist_layout.refresh_rows((index, playlist[index]) for index in indices if index is not None)
+        if self.engine.current_song in changed:
+            self.update_metadata()
+            self.update_details()
+            self.publish_state()
+
+    def state_changed(self):
+        self.save_trigger()
+        self.publish_state()
+
+    def search_ready(self):
+        self.on_search_text(self.search_field, self.search_field.text)
+
+    def on_search_text(self, instance, text):
+        indices = self.engine.search(text) if text.strip() else None
+        if indices is None:
+            # Empty query, or the index is still being built: show the whole playlist
+            if self.playlist_layout.positions is not None:
+                self.refresh_playlist_ui()
+        else:
+            self.playlist_layout.set_results(self.engine.playlist, indices, self.engine.current_index)
+
+    def smart_playlists_updated(self):
+        if self.smart_list and not self.search_field.text.strip():
+            self.refresh_playlist_ui()
+
+    def smart_menu_open(self, instance):
+        if self.smart_menu is None:
+            from kivymd.uix.menu import MDDropdownMenu
+            items = [
+                {'viewclass': 'OneLineListItem', 'text': name or 'Library',
+                 'on_release': lambda name=name: self.show_smart_list(name)}
+                for name in [None] + list(self.engine.smart_playlists)
+            ]
+            items.append({'viewclass': 'OneLineListItem', 'text': 'Find duplicates',
+                          'on_release': self.find_duplicates})
+            items.append({'viewclass': 'OneLineListItem', 'text': 'Merge duplicates',
+                          'on_release': self.merge_duplicates})
+            self.smart_menu = MDDropdownMenu(caller=instance, items=items, width_mult=3)
+        self.smart_menu.open()
+
+    def show_smart_list(self, name):
+        self.smart_menu.dismiss()
+        self.smart_list = name
+        self.search_field.text = ''
+        self.refresh_playlist_ui()
+
+    def find_duplicates(self):
+        # Fingerprinting takes a while on a first run; the sidebar switches over when it's done
+        self.smart_menu.dismiss()
+        self.engine.find_duplicates()
+
+    def duplicates_found(self, groups):
+        # Each group's tracks end up next to each other, in the order of their first appearance
+        self.smart_list = None
+        self.search_field.text = ''
+        playlist = self.engine.playlist
+        indices = [playlist.find(path) for group in groups for path in group]
+        self.playlist_layout.set_results(playlist, [index for index in indices if index is not None],
+                                         self.engine.current_index)
+
+    def merge_duplicates(self):
+        self.smart_menu.dismiss()
+        if self.engine.duplicate_groups is None:
+            logger.info("Find duplicates before merging them")
+            return
+        self.engine.merge_duplicates()
+
+    def playlist_menu_open(self, instance):
+        # Rebuilt on every open, since playlists come and go
+        from kivymd.uix.menu import MDDropdownMenu
+        items = [
+            {'viewclass': 'OneLineListItem', 'text': name or 'Library',
+             'on_release': lambda name=name: self.open_playlist(name)}
+            for name in [None] + self.engine.playlists.names()
+        ]
+        items.append({'viewclass': 'OneLineListItem', 'text': 'New playlist', 'on_release': self.new_playlist})
+        self.playlist_menu = MDDropdownMenu(caller=instance, items=items, width_mult=3)
+        self.playlist_menu.open()
+
+    def open_playlist(self, name):
+        self.playlist_menu.dismiss()
+        self.engine.open_playlist(name)
+
+    def new_playlist(self):
+        # Saves what the sidebar is showing (search results or a smart playlist) as a new playlist,
+        # named after the query; with the whole list showing, starts an empty one
+        self.playlist_menu.dismiss()
+        songs = []
+        if self.playlist_layout.positions is not None:
+            songs = [self.engine.playlist[row['index']] for row in self.playlist_layout.data]
+        base = self.search_field.text.strip() or self.smart_list or 'Playlist'
+        names = set(self.engine.playlists.names())
+        name = base if base not in names else next(
+            f'{base} {n}' for n in range(2, len(names) + 3) if f'{base} {n}' not in names)
+        self.engine.create_playlist(name, songs)
+        self.engine.open_playlist(name)
+
+    def on_search_enter(self, instance):
+        url = instance.text.strip()
+        if is_url(url):
+            instance.text = ''
+            Clock.unschedule(self.update_progress)
+            self.engine.select_path(url)
+
+    # Button handlers
+
+    def play_pause_song(self, instance):
+        self.engine.toggle_play()
 
     def play_next_song(self, instance):
-        if self.playlist:
-            self.current_index = (self.current_index + 1) % len(self.playlist)
-            self.current_song = self.playlist[self.current_index]
-            self.play_song()
+        Clock.unschedule(self.update_progress)
+        self.engine.next()
 
     def play_previous_song(self, instance):
-        if self.playlist:
-            self.current_index = (self.current_index - 1) % len(self.playlist)
-            self.current_song = self.playlist[self.current_index]
-            self.play_song()
+        Clock.unschedule(self.update_progress)
+        self.engine.previous()
 
     def repeat_song(self, instance):
-        self.play_song()
+        instance.icon = 'repeat-once' if self.engine.toggle_repeat() else 'repeat'
 
     def shuffle_playlist(self, instance):
-        if self.playlist:
-            random.shuffle(self.playlist)
-            self.current_index = 0
-            self.save_playlist()
-            self.refresh_playlist_ui()
+        # Only the play order changes; the sidebar rows stay as they are
+        instance.md_bg_color = HIGHLIGHT_COLOR if self.engine.toggle_shuffle() else BUTTON_OFF_COLOR
+
+    def cycle_crossfade(self, instance):
+        # Off -> 2 s -> 4 s -> 8 s -> off; tracks from the same album still join gaplessly
+        later = [step for step in CROSSFADE_STEPS if step > self.engine.crossfade_seconds]
+        self.engine.set_crossfade(later[0] if later else 0)
+        instance.md_bg_color = HIGHLIGHT_COLOR if self.engine.crossfade_seconds else BUTTON_OFF_COLOR
+        logger.info("Crossfade: %s s", self.engine.crossfade_seconds)
+
+    def equalizer_menu_open(self, instance):
+        if self.equalizer_menu is None:
+            from kivymd.uix.menu import MDDropdownMenu
+            items = [
+                {'viewclass': 'OneLineListItem', 'text': name or 'Off',
+                 'on_release': lambda name=name: self.select_equalizer(name)}
+                for name in [None] + list(self.engine.eq_presets)
+            ]
+            self.equalizer_menu = MDDropdownMenu(caller=instance, items=items, width_mult=3)
+        self.equalizer_menu.open()
+
+    def select_equalizer(self, name):
+        if self.equalizer_menu:
+            self.equalizer_menu.dismiss()
+        self.engine.set_equalizer(name)
+        self.equalizer_button.md_bg_color = HIGHLIGHT_COLOR if self.engine.equalizer else BUTTON_OFF_COLOR
 
     def refresh_playlist_ui(self):
-        self.playlist_layout.clear_widgets()
-        for index, song in enumerate(self.playlist):
-            is_current = index == self.current_index
-            item = OneLineListItem(
-                text=os.path.basename(song),
-                theme_text_color="Custom",
-                text_color=[0.1, 0.6, 0.1, 1] if is_current else [1, 1, 1, 1],  # Highlight current song
-                on_press=lambda x, i=index: self.play_song_by_index(i)
-            )
-            self.playlist_layout.add_widget(item)
+        # Full reset of the row data; widgets are recycled, so cost doesn't grow with the playlist
+        if not self.playlist_layout.populated:
+            return
+        if self.smart_list:
+            indices = self.engine.smart_playlist(self.smart_list)
+            self.playlist_layout.set_results(self.engine.playlist, indices, self.engine.current_index)
+        else:
+            self.playlist_layout.set_songs(self.engine.playlist, self.engine.current_index)
 
     def play_song_by_index(self, index):
-        self.current_index = index
-        self.current_song = self.playlist[index]
-        self.play_song()
-        self.refresh_playlist_ui()  # Update the UI to reflect the current song
-
-    def save_playlist(self):
-        with open(self.playlist_file, 'w') as f:
-            json.dump(self.playlist, f)
-
-    def load_playlist(self):
-        if os.path.exists(self.playlist_file):
-            with open(self.playlist_file, 'r') as f:
-                self.playlist = json.load(f)
+        Clock.unschedule(self.update_progress)
+        self.engine.play_index(index)  # track_started moves the highlight between the two affected rows
+
+    # Remote control; commands arrive on the UI thread through Clock, like the engine's callbacks
+
+    def remote_commands(self):
+        return {
+            'play_pause': lambda: self.play_pause_song(None),
+            'next': lambda: self.play_next_song(None),
+            'previous': lambda: self.play_previous_song(None),
+            'set_volume': self.remote_set_volume,
+            'seek': lambda position: self.seek(float(position)),
+            'play_index': self.remote_play_index,
+            'set_equalizer': lambda preset=None: self.select_equalizer(preset),
+        }
+
+    def remote_set_volume(self, volume):
+        self.volume_slider.value = min(max(float(volume), 0.0), 1.0)  # Its binding updates the engine and label
+
+    def remote_play_index(self, index):
+        index = int(index)
+        if not 0 <= index < len(self.engine.playlist):
+            raise ValueError(f"No track at index {index}")
+        self.play_song_by_index(index)
+
+    def publish_state(self):
+        if self.remote:
+            self.remote.publish(self.engine.status())
+
+    def flush_library(self, *args):
+        self.engine.flush()
+
+    def toggle_perf_overlay(self, *args):
+        instruments.enabled = not instruments.enabled
+        if instruments.enabled:
+            instruments.reset()
+            self.perf_overlay.opacity = 1
+            Clock.schedule_interval(self.record_frame, 0)
+            Clock.schedule_interval(self.update_perf_overlay, 1)
+        else:
+            self.perf_overlay.opacity = 0
+            Clock.unschedule(self.record_frame)
+            Clock.unschedule(self.update_perf_overlay)
+            self.export_perf()
+
+    def record_frame(self, dt):
+        instruments.record('frame', dt)
+
+    def update_perf_overlay(self, dt):
+        lines = []
+        for name, stats in instruments.summary().items():
+            lines.append(f"{name}: n={stats['count']} p50={stats['p50_ms']} p95={stats['p95_ms']} "
+                         f"max={stats['max_ms']:.0f}")
+        self.perf_overlay.text = '\n'.join(lines)
+
+    def export_perf(self):
+        # Summary as JSON, spans in Chrome trace-event format (chrome://tracing, Perfetto)
+        library_dir = os.path.dirname(self.engine.library_db)
+        try:
+            instruments.export(os.path.join(library_dir, 'perf_summary.json'),
+                               os.path.join(library_dir, 'perf_trace.json'))
+            logger.info("Exported timings to %s", library_dir)
+        except OSError as e:
+            logger.error("Error exporting timings: %s", e)
 
 if __name__ == '__main__':
     MusicPlayer().run()
@@ -0,0 +1,159 @@
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from formats import read_tags
+from instrumentation import instruments
+from streaming import is_url
+
+logger = logging.getLogger(__name__)
+
+TAG_FIELDS = ('title', 'artist', 'album', 'duration', 'bitrate')
+SORTED_FIELDS = ('title', 'artist', 'album', 'duration')
+
+
+def file_signature(path):
+    if is_url(path):
+        return 0, 0  # Remote tags are read once and kept
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def sort_expression(field):
+    # Missing tags sort (and compare) as '' or 0 rather than NULL. Play counts come from the
+    # track_stats rollup kept by history.PlayHistory.
+    if field == 'plays':
+        return 'COALESCE((SELECT plays FROM track_stats WHERE track_stats.path = tracks.path), 0)'
+    return f"COALESCE({field}, {0 if field in ('duration', 'bitrate') else repr('')})"
+
+
+class MetadataStore:
+    # Tags cached in SQLite next to playlist.json, keyed by path and invalidated by mtime + size
+    def __init__(self, db_file):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS tracks ('
+            'path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+            'title TEXT, artist TEXT, album TEXT, duration REAL, bitrate INTEGER)'
+        )
+        # Smart playlists page through tracks in these orders (see smartlists.py)
+        for field in SORTED_FIELDS:
+            self.conn.execute(
+                f'CREATE INDEX IF NOT EXISTS tracks_by_{field} ON tracks({sort_expression(field)}, path)'
+            )
+        self.conn.commit()
+        self.memory = {}
+
+    def cached(self, path):
+        # No stat() here: used when drawing rows, where a slightly stale title is fine
+        info = self.memory.get(path)
+        if info is None:
+            with self.lock:
+                row = self.conn.execute(
+                    'SELECT mtime, size, title, artist, album, duration, bitrate FROM tracks WHERE path = ?',
+                    (path,)
+                ).fetchone()
+            if row is None:
+                return None
+            info = dict(zip(('mtime', 'size') + TAG_FIELDS, row))
+            self.memory[path] = info
+        return info
+
+    def lookup(self, path):
+        info = self.cached(path)
+        if info is None:
+            return None
+        try:
+            mtime, size = file_signature(path)
+        except OSError:
+            return None
+        if info['mtime'] != mtime or info['size'] != size:
+            return None
+        return info
+
+    def all_tags(self):
+        # path -> (title, artist, album) for every indexed track, in one query
+        with self.lock:
+            rows = self.conn.execute('SELECT path, title, artist, album FROM tracks').fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def page(self, where, params, field, descending, after, size):
+        # One page of (sort key, path) in (key, path) order, starting after the (key, path) pair `after`;
+        # each call is its own indexed query, so tracks added between pages are still picked up
+        if field == 'plays':
+            # Driven by the play count index, so only tracks that have been played at least once are listed
+            key, source = 'track_stats.plays', 'track_stats JOIN tracks ON tracks.path = track_stats.path'
+            where = f'track_stats.plays > 0 AND ({where})' if where else 'track_stats.plays > 0'
+        else:
+            key, source = sort_expression(field), 'tracks'
+        direction, compare = ('DESC', '<') if descending else ('ASC', '>')
+        clauses = [f'({where})'] if where else []
+        if after is not None:
+            clauses.append(f'({key}, tracks.path) {compare} (?, ?)')
+            params = list(params) + list(after)
+        sql = f'SELECT {key}, tracks.path FROM {source}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += f' ORDER BY {key} {direction}, tracks.path {direction} LIMIT ?'
+        with self.lock:
+            return self.conn.execute(sql, list(params) + [size]).fetchall()
+
+    def put_many(self, entries):
+        rows = []
+        for path, mtime, size, tags in entries:
+            info = dict(tags, mtime=mtime, size=size)
+            self.memory[path] = info
+            rows.append((path, mtime, size) + tuple(info[field] for field in TAG_FIELDS))
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class TagIndexer:
+    # Reads tags (formats.read_tags) on a worker pool; on_indexed(paths) is called from the worker thread
+    def __init__(self, store, on_indexed=None, workers=4, batch_size=64):
+        self.store = store
+        self.on_indexed = on_indexed
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tag-indexer')
+
+    def scan(self, paths):
+        paths = list(paths)
+        futures = []
+        for start in range(0, len(paths), self.batch_size):
+            futures.append(self.executor.submit(self.index_batch, paths[start:start + self.batch_size]))
+        return futures
+
+    def index_batch(self, paths):
+        entries = []
+        for path in paths:
+            try:
+                mtime, size = file_signature(path)
+            except OSError:
+                continue
+            info = self.store.cached(path)
+            if info and info['mtime'] == mtime and info['size'] == size:
+                continue
+            try:
+                with instruments.timer('metadata.read'):
+                    tags = read_tags(path)
+            except Exception as e:
+                logger.warning("Error reading metadata: %s", e)
+                tags = dict.fromkeys(TAG_FIELDS)
+                tags['duration'] = tags['bitrate'] = 0
+            entries.append((path, mtime, size, tags))
+        if entries:
+            self.store.put_many(entries)
+            if self.on_indexed:
+                self.on_indexed([entry[0] for entry in entries])
+        return len(entries)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,84 @@
+import time
+
+
+class PlaybackClock:
+    # Tracks the play position of one sound. The backend's get_pos() is used when it reports one;
+    # otherwise the position is derived from a monotonic clock anchored at the last play/seek,
+    # so it never drifts the way summing tick deltas does.
+    def __init__(self, time_source=time.monotonic):
+        self.time_source = time_source
+        self.sound = None
+        self.on_track_end = None
+        self.playing = False
+        self.anchor_position = 0.0
+        self.anchor_time = 0.0
+
+    def start(self, sound, on_track_end=None, position=0.0):
+        self.detach()
+        self.sound = sound
+        self.on_track_end = on_track_end
+        sound.bind(on_stop=self.handle_stop)
+        sound.play()
+        if position:
+            sound.seek(position)
+        self.set_anchor(position)
+        self.playing = True
+
+    def detach(self):
+        # Stop listening before the caller stops/unloads the sound, so no track-end is reported
+        if self.sound:
+            self.sound.unbind(on_stop=self.handle_stop)
+        self.sound = None
+        self.playing = False
+        self.set_anchor(0.0)
+
+    def set_anchor(self, position):
+        self.anchor_position = position
+        self.anchor_time = self.time_source()
+
+    def position(self):
+        if not self.playing:
+            return self.anchor_position
+        backend_position = self.sound.get_pos() if self.sound else 0
+        if backend_position > 0:
+            return backend_position
+        return self.anchor_position + self.time_source() - self.anchor_time
+
+    def length(self):
+        return self.sound.length if self.sound and self.sound.length > 0 else 0
+
+    def pause(self):
+        if not self.playing:
+            return
+        position = self.position()
+        self.playing = False
+        self.anchor_position = position
+        self.sound.stop()  # on_stop is ignored below because playing is already False
+
+    def resume(self):
+        if self.playing or not self.sound:
+            return
+        self.sound.play()
+        if self.anchor_position:
+            self.sound.seek(self.anchor_position)
+        self.set_anchor(self.anchor_position)
+        self.playing = True
+
+    def seek(self, position):
+        length = self.length()
+        position = max(0.0, min(position, length) if length else position)
+        if self.sound and self.playing:
+            self.sound.seek(position)
+        self.set_anchor(position)
+
+    def time_to_next_second(self):
+        # Wake up just after the displayed m:ss changes instead of polling at a fixed rate
+        return 1.0 - self.position() % 1.0 + 0.01
+
+    def handle_stop(self, sound):
+        if not self.playing:
+            return
+        self.playing = False
+        self.anchor_position = self.length()
+        if self.on_track_end:
+            self.on_track_end()
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import random
+import unicodedata
+
+from streaming import is_url
+
+CONTENT_SAMPLE_SIZE = 64 * 1024
+
+
+def normalize_path(path):
+    # playlist.json may hold Windows paths ("C:\\Users\\...") and filenames in either Unicode form
+    if is_url(path):
+        return path
+    path = unicodedata.normalize('NFC', path.replace('\\', '/'))
+    return os.path.normcase(os.path.normpath(path))
+
+
+def content_hash(path):
+    # Size plus the first and last 64 KiB: cheap, and enough to spot the same rip copied elsewhere
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(CONTENT_SAMPLE_SIZE))
+        if size > 2 * CONTENT_SAMPLE_SIZE:
+            f.seek(-CONTENT_SAMPLE_SIZE, os.SEEK_END)
+            digest.update(f.read(CONTENT_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+class Playlist:
+    # Ordered list of song paths with a normalized-path -> index map, so lookups and
+    # duplicate checks are O(1). With content_dedup, a file whose content_hash matches
+    # a song added before it is rejected too. Files are only hashed when another song
+    # has the same size, so most additions cost a stat and nothing is read.
+    def __init__(self, songs=(), content_dedup=False):
+        self.songs = []
+        self.positions = {}
+        self.content_dedup = content_dedup
+        self.sizes = {}  # file size -> normalized paths of that size
+        self.content_keys = {}  # content hash -> normalized path
+        self.hashed = set()  # normalized paths already in content_keys
+        self.duplicates = {}  # normalized path rejected as a copy -> normalized path kept
+        self.extend(songs)
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs)
+
+    def __getitem__(self, index):
+        return self.songs[index]
+
+    def __contains__(self, path):
+        return normalize_path(path) in self.positions
+
+    def __bool__(self):
+        return bool(self.songs)
+
+    def find(self, path):
+        return self.positions.get(normalize_path(path))
+
+    def index(self, path):
+        position = self.find(path)
+        if position is None:
+            raise ValueError(f"{path} is not in the playlist")
+        return position
+
+    def duplicate_of(self, path):
+        # Index of the song a rejected copy matched, or None
+        kept = self.duplicates.get(normalize_path(path))
+        return None if kept is None else self.positions.get(kept)
+
+    def append(self, path, size=None):
+        return bool(self.extend([path], {path: size} if size is not None else None))
+
+    def extend(self, paths, sizes=None):
+        # sizes lets callers stat files off the UI thread; missing sizes are only looked
+        # up here when content_dedup is on
+        added = []
+        for path in paths:
+            key = normalize_path(path)
+            if key in self.positions:
+                continue
+            if self.content_dedup:
+                kept = self.find_copy(path, key, (sizes or {}).get(path))
+                if kept is not None:
+                    self.duplicates[key] = kept
+                    continue
+            self.positions[key] = len(self.songs)
+            self.songs.append(path)
+            added.append(path)
+        return added
+
+    def find_copy(self, path, key, size):
+        # Returns the normalized path of a song with the same content, and otherwise
+        # records this file's size (and hash, if it had to be read) for later additions
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return None  # Streams and missing files aren't deduplicated
+        same_size = self.sizes.setdefault(size, [])
+        if same_size:
+            try:
+                for other in same_size:
+                    if other not in self.hashed:
+                        self.add_content_key(content_hash(self.songs[self.positions[other]]), other)
+                content_key = content_hash(path)
+            except OSError:
+                content_key = None
+            if content_key in self.content_keys:
+                return self.content_keys[content_key]
+            if content_key is not None:
+                self.add_content_key(content_key, key)
+        same_size.append(key)
+        return None
+
+    def add_content_key(self, content_key, key):
+        self.content_keys.setdefault(content_key, key)
+        self.hashed.add(key)
+
+    def remove_many(self, paths):
+        gone = {normalize_path(path) for path in paths} & self.positions.keys()
+        if not gone:
+            return []
+        removed = [self.songs[self.positions[key]] for key in gone]
+        self.songs = [song for song in self.songs if normalize_path(song) not in gone]
+        self.sizes = {size: kept for size, keys in self.sizes.items()
+                      if (kept := [key for key in keys if key not in gone])}
+        self.content_keys = {h: key for h, key in self.content_keys.items() if key not in gone}
+        self.hashed -= gone
+        self.duplicates = {copy: key for copy, key in self.duplicates.items() if key not in gone}
+        self.reindex()
+        return removed
+
+    def reindex(self):
+        self.positions = {normalize_path(song): index for index, song in enumerate(self.songs)}
+
+
+class PlayOrder:
+    # Decides which playlist index plays next without touching the playlist itself.
+    # Shuffle is a Fisher-Yates permutation drawn one step at a time; only the swapped
+    # positions are stored, so toggling it is O(1) whatever the playlist length.
+    def __init__(self, playlist, artist_of=None, history_size=500):
+        self.playlist = playlist
+        self.artist_of = artist_of
+        self.history_size = history_size
+        self.shuffle = False
+        self.smart = artist_of is not None
+        self.history = []
+        self.forward = []
+        self.upcoming = None
+        self.seed = None
+        self.rng = random.Random()
+        self.reset()
+
+    def reset(self):
+        # Start a new shuffle cycle; call after removals since indices shift
+        self.swaps = {}  # position -> index
+        self.where = {}  # index -> position
+        self.drawn = 0
+        self.upcoming = None
+
+    def clear_history(self):
+        self.history = []
+        self.forward = []
+
+    def set_shuffle(self, shuffle, current=None, seed=None):
+        self.shuffle = shuffle
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+        self.reset()
+        self.forward = []
+        if shuffle and current is not None and 0 <= current < len(self.playlist):
+            self.mark_drawn(current)
+
+    def index_at(self, position):
+        return self.swaps.get(position, position)
+
+    def position_of(self, index):
+        return self.where.get(index, index)
+
+    def swap(self, p, q):
+        a, b = self.index_at(p), self.index_at(q)
+        self.swaps[p], self.swaps[q] = b, a
+        self.where[b], self.where[a] = p, q
+
+    def mark_drawn(self, index):
+        if self.drawn >= len(self.playlist):
+            self.reset()
+        position = self.position_of(index)
+        if position >= self.drawn:
+            self.swap(position, self.drawn)
+            self.drawn += 1
+
+    def draw(self, current):
+        count = len(self.playlist)
+        if self.drawn >= count:
+            self.reset()
+        candidate = self.rng.randrange(self.drawn, count)
+        if self.smart and count - self.drawn > 1:
+            # Smart shuffle: a few extra draws to avoid the same artist twice in a row
+            last_artist = self.artist_of(current) if 0 <= current < count else None
+            for _ in range(8):
+                if not last_artist or self.artist_of(self.index_at(candidate)) != last_artist:
+                    break
+                candidate = self.rng.randrange(self.drawn, count)
+        self.swap(self.drawn, candidate)
+        self.drawn += 1
+        return self.index_at(self.drawn - 1)
+
+    def peek_next(self, current):
+        if not self.playlist:
+            return None
+        if self.forward:
+            return self.forward[-1]
+        if not self.shuffle:
+            return (current + 1) % len(self.playlist)  # Not cached: the playlist may have grown since
+        if self.upcoming is None:
+            self.upcoming = self.draw(current)
+        return self.upcoming
+
+    def remember(self, index):
+        if index < 0:
+            return  # The track was playing from another playlist
+        self.history.append(index)
+        if len(self.history) > self.history_size:
+            del self.history[0]
+
+    def next(self, current):
+        index = self.peek_next(current)
+        if index is None:
+            return None
+        if self.forward:
+            self.forward.pop()
+        self.upcoming = None
+        self.remember(current)
+        return index
+
+    def previous(self, current):
+        # Goes back to the track that actually played before this one
+        if not self.playlist:
+            return None
+        self.upcoming = None
+        if self.history:
+            if current >= 0:  # Not when the track was playing from another playlist
+                self.forward.append(current)
+            return self.history.pop()
+        return (current - 1) % len(self.playlist)
+
+    def jump(self, current, index):
+        # The user picked a track directly
+        self.remember(current)
+        self.forward = []
+        self.upcoming = None
+        if self.shuffle:
+            self.mark_drawn(index)
@@ -0,0 +1,139 @@
+import logging
+import sqlite3
+import sys
+import threading
+from array import array
+
+from instrumentation import instruments
+
+logger = logging.getLogger(__name__)
+
+
+def pack_ids(ids):
+    ids = array('I', ids)
+    if sys.byteorder == 'big':
+        ids.byteswap()  # Stored little-endian so library.db can move between machines
+    return ids.tobytes()
+
+
+def unpack_ids(blob):
+    ids = array('I')
+    ids.frombytes(blob or b'')
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+class PlaylistCatalog:
+    # Named playlists in library.db. Paths are stored once in track_ids and every playlist is a
+    # single row holding its track ids packed 4 bytes apiece, so opening one is one query and one
+    # dict lookup per track. Nothing is read until a playlist is opened; path strings are shared
+    # by all the playlists that contain them.
+    def __init__(self, db_file):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS track_ids (id INTEGER PRIMARY KEY, path TEXT UNIQUE)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS playlists (name TEXT PRIMARY KEY, tracks BLOB)')
+        self.conn.commit()
+        self.paths = None  # id -> path, read when the first playlist is opened
+        self.ids = None  # path -> id
+        self.loaded = {}  # name -> track ids, for playlists opened this session
+
+    def names(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT name FROM playlists ORDER BY name COLLATE NOCASE').fetchall()
+        return [row[0] for row in rows]
+
+    def __contains__(self, name):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM playlists WHERE name = ?', (name,)).fetchone() is not None
+
+    def create(self, name, songs=()):
+        if not name or name in self:
+            raise ValueError(f"Playlist already exists: {name}")
+        self.save(name, songs)
+
+    def delete(self, name):
+        self.loaded.pop(name, None)
+        with self.lock:
+            self.conn.execute('DELETE FROM playlists WHERE name = ?', (name,))
+            self.conn.commit()
+
+    def load_paths(self):
+        if self.paths is None:
+            with self.lock:
+                rows = self.conn.execute('SELECT id, path FROM track_ids').fetchall()
+            self.paths = dict(rows)
+            self.ids = {path: track_id for track_id, path in rows}
+
+    def track_ids(self, name):
+        ids = self.loaded.get(name)
+        if ids is None:
+            with self.lock:
+                row = self.conn.execute('SELECT tracks FROM playlists WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                raise KeyError(name)
+            ids = self.loaded[name] = unpack_ids(row[0])
+        return ids
+
+    def songs(self, name):
+        self.load_paths()
+        paths = self.paths
+        return [paths[track_id] for track_id in self.track_ids(name) if track_id in paths]
+
+    def save(self, name, songs):
+        self.load_paths()
+        new_paths = [path for path in dict.fromkeys(songs) if path not in self.ids]
+        with self.lock:
+            for path in new_paths:
+                track_id = self.conn.execute('INSERT INTO track_ids (path) VALUES (?)', (path,)).lastrowid
+                self.paths[track_id] = path
+                self.ids[path] = track_id
+            ids = array('I', (self.ids[path] for path in songs))
+            self.conn.execute('INSERT OR REPLACE INTO playlists VALUES (?, ?)', (name, pack_ids(ids)))
+            self.conn.commit()
+        self.loaded[name] = ids
+
+    def append(self, name, songs):
+        # Adds songs to a playlist that isn't open; returns how many were new to it
+        current = self.songs(name)
+        known = set(current)
+        added = [song for song in dict.fromkeys(songs) if song not in known]
+        if added:
+            self.save(name, current + added)
+        return len(added)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CatalogStore:
+    # The PlaylistStore interface for a playlist kept in the catalog. A packed playlist is small
+    # enough (20 KB for 5k tracks) that every flush just rewrites its row, so there's no edit log.
+    def __init__(self, catalog, name):
+        self.catalog = catalog
+        self.name = name
+        self.dirty = False
+
+    def load(self):
+        with instruments.timer('playlist.load'):
+            return self.catalog.songs(self.name)
+
+    def record_add(self, paths):
+        self.dirty = self.dirty or bool(paths)
+
+    def record_remove(self, paths):
+        self.dirty = self.dirty or bool(paths)
+
+    def flush(self, playlist):
+        if self.dirty:
+            with instruments.timer('playlist.save'):
+                self.compact(playlist)
+
+    def compact(self, playlist):
+        try:
+            self.catalog.save(self.name, playlist)
+        except sqlite3.Error as e:
+            raise OSError(f"Error saving playlist {self.name}: {e}") from e
+        self.dirty = False
@@ -0,0 +1,306 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from instrumentation import instruments
+
+logger = logging.getLogger(__name__)
+
+MAX_LINE = 64 * 1024  # Longest request line accepted
+WRITE_HIGH_WATER = 64 * 1024  # Bytes buffered for a client before its events start to coalesce
+MAX_QUEUED_REPLIES = 64  # Unsent replies before a client's requests stop being read
+STUCK_TIMEOUT = 10.0  # Seconds a client may keep its replies unread before it is dropped
+COMMAND_TIMEOUT = 5.0  # Seconds to wait for the owner thread to run a command
+POSITION_INTERVAL = 1.0  # Seconds between position events while playing
+COALESCED_COMMANDS = ('set_volume', 'seek')  # Setters where only the latest value matters
+
+
+class RemoteError(Exception):
+    pass
+
+
+class Client:
+    # One connection. Replies are queued in order; events keep only the latest one of each kind,
+    # so a client that reads slowly gets fewer, newer events instead of a growing backlog. Replies
+    # can't be dropped, so once MAX_QUEUED_REPLIES are waiting (which happens while the write loop
+    # is held up in drain() by a full transport buffer) no more requests are read until they go out.
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.replies = []
+        self.writable = asyncio.Event()  # Clear while the reply queue is full
+        self.writable.set()
+        self.events = {}  # kind -> latest unsent event
+        self.subscribed = False
+        self.wakeup = asyncio.Event()
+        self.closed = False
+
+    def reply(self, message):
+        self.replies.append(message)
+        if len(self.replies) >= MAX_QUEUED_REPLIES:
+            self.writable.clear()
+        self.wakeup.set()
+
+    def push(self, kind, event):
+        if self.subscribed:
+            if kind == 'state':
+                self.events.pop('position', None)  # A state event carries the position as well
+            self.events[kind] = event
+            self.wakeup.set()
+
+    async def write_loop(self):
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                messages, self.replies = self.replies, []
+                self.writable.set()
+                messages.extend(self.events.values())
+                self.events = {}
+                if messages:
+                    self.writer.write(b''.join(json.dumps(message).encode() + b'\n' for message in messages))
+                    await self.writer.drain()  # Waits while the client is behind; events pile up meanwhile
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+            self.writer.close()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.writable.set()
+
+    def abort(self):
+        # For a client that stopped reading: its buffered data is thrown away and a write loop
+        # waiting in drain() gets a ConnectionError instead of waiting forever
+        self.close()
+        self.writer.transport.abort()
+
+
+class RemoteControl:
+    # Line-delimited JSON control server on its own asyncio thread, for kiosk controllers and
+    # scripts. Requests look like {"id": 1, "cmd": "set_volume", "volume": 0.5}; every request gets
+    # {"id": 1, "ok": true, "result": ...} or {"id": 1, "ok": false, "error": "..."} back.
+    #
+    # Commands run on the owner thread through schedule(callback), as the engine's worker results
+    # do. Everything that arrives before the owner gets to them runs in one callback, setters in
+    # COALESCED_COMMANDS collapse to their latest value, and each client has at most one command
+    # in flight, so the owner thread sees one wakeup per frame however many clients there are.
+    #
+    # The owner publishes a state snapshot whenever something changes. "state" requests are
+    # answered from it, and subscribers get it pushed together with position events extrapolated
+    # from it, all without touching the owner thread.
+    def __init__(self, commands, schedule, host='127.0.0.1', port=None, unix_path=None, time_source=time.monotonic,
+                 stuck_timeout=STUCK_TIMEOUT):
+        if port is None and unix_path is None:
+            raise ValueError("RemoteControl needs a port or a socket path")
+        self.commands = commands  # name -> callable(**arguments), run on the owner thread
+        self.schedule = schedule
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.time_source = time_source
+        self.stuck_timeout = stuck_timeout
+        self.clients = set()
+        self.snapshot = {}
+        self.snapshot_time = time_source()
+        self.lock = threading.Lock()
+        self.batch = {}  # key -> [name, arguments, futures], waiting for the owner thread
+        self.latest = None  # Snapshot published by the owner, not yet picked up by the loop
+        self.loop = asyncio.new_event_loop()
+        self.stopping = asyncio.Event()
+        self.servers = []
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True, name='remote-control')
+        self.thread.start()
+        self.started.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+
+    async def serve(self):
+        try:
+            await self.start_servers()
+        except OSError as e:
+            logger.error("Error starting remote control: %s", e)
+            return
+        finally:
+            self.started.set()
+        position_task = asyncio.create_task(self.send_positions())
+        await self.stopping.wait()
+        position_task.cancel()
+        for server in self.servers:
+            server.close()
+        for client in list(self.clients):
+            if client.writer.transport.get_write_buffer_size():
+                client.abort()  # Not keeping up; closing would wait for it to read everything
+            else:
+                client.close()
+                client.writer.close()  # The handler's next read sees end of file and cleans up
+        handlers = [task for task in asyncio.all_tasks() if task not in (asyncio.current_task(), position_task)]
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    async def start_servers(self):
+        if self.port is not None:
+            server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=MAX_LINE)
+            self.port = server.sockets[0].getsockname()[1]  # The real port when 0 was asked for
+            self.servers.append(server)
+            logger.info("Remote control listening on %s:%d", self.host, self.port)
+        if self.unix_path is not None:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)  # Left over from a previous run
+            self.servers.append(await asyncio.start_unix_server(self.handle_client, self.unix_path, limit=MAX_LINE))
+            logger.info("Remote control listening on %s", self.unix_path)
+
+    # Owner thread
+
+    def publish(self, state):
+        # Called by the owner whenever the player state changes; cheap enough to call freely
+        with self.lock:
+            pending = self.latest is not None
+            self.latest = (state, self.time_source())
+        if not pending:
+            self.call_soon(self.apply_snapshot)
+
+    def run_batch(self):
+        with self.lock:
+            batch, self.batch = self.batch, {}
+        with instruments.timer('remote.commands'):
+            for name, arguments, futures in batch.values():
+                try:
+                    result, error = self.commands[name](**arguments), None
+                except Exception as e:
+                    # Bad arguments from a client shouldn't take the owner thread down
+                    logger.warning("Remote command %s failed: %s", name, e)
+                    result, error = None, e
+                self.call_soon(self.resolve, futures, result, error)
+
+    def call_soon(self, callback, *args):
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass  # The loop has shut down
+
+    def close(self):
+        self.call_soon(self.stopping.set)
+        self.thread.join()
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    # Event loop thread
+
+    def apply_snapshot(self):
+        with self.lock:
+            (self.snapshot, self.snapshot_time), self.latest = self.latest, None
+        event = dict(self.current_state(), event='state')
+        for client in self.clients:
+            client.push('state', event)
+
+    def current_state(self):
+        state = dict(self.snapshot)
+        if 'position' in state:
+            state['position'] = self.current_position()
+        return state
+
+    def current_position(self):
+        position = self.snapshot.get('position', 0.0)
+        if self.snapshot.get('playing'):
+            position += self.time_source() - self.snapshot_time
+            length = self.snapshot.get('length')
+            if length:
+                position = min(position, length)
+        return position
+
+    async def send_positions(self):
+        while True:
+            await asyncio.sleep(POSITION_INTERVAL)
+            if self.snapshot.get('playing'):
+                event = {'event': 'position', 'position': self.current_position()}
+                for client in self.clients:
+                    client.push('position', event)
+
+    async def handle_client(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+        client = Client(reader, writer)
+        self.clients.add(client)
+        write_task = asyncio.create_task(client.write_loop())
+        try:
+            while not client.closed:
+                if not client.writable.is_set():
+                    try:
+                        await asyncio.wait_for(client.writable.wait(), self.stuck_timeout)
+                    except asyncio.TimeoutError:
+                        logger.warning("Dropping remote client that stopped reading its replies")
+                        client.abort()
+                        break
+                    continue
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    break  # Longer than MAX_LINE; not a client worth talking to
+                if not line:
+                    break
+                if line.strip():
+                    client.reply(await self.handle_request(client, line))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.clients.discard(client)
+            client.close()
+            await write_task
+
+    async def handle_request(self, client, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RemoteError("Request must be a JSON object")
+            request_id = request.pop('id', None)
+            name = request.pop('cmd', None)
+            result = await self.run_command(client, name, request)
+        except (ValueError, TypeError, RemoteError) as e:
+            return {'id': request_id, 'ok': False, 'error': str(e)}
+        except asyncio.TimeoutError:
+            return {'id': request_id, 'ok': False, 'error': "Timed out waiting for the player"}
+        return {'id': request_id, 'ok': True, 'result': result}
+
+    async def run_command(self, client, name, arguments):
+        if name == 'state':
+            return self.current_state()
+        if name in ('subscribe', 'unsubscribe'):
+            client.subscribed = name == 'subscribe'
+            if client.subscribed:
+                client.push('state', dict(self.current_state(), event='state'))
+            return None
+        if name not in self.commands:
+            raise RemoteError(f"Unknown command: {name}")
+        future = self.loop.create_future()
+        with self.lock:
+            first = not self.batch
+            entry = self.batch.get(name) if name in COALESCED_COMMANDS else None
+            if entry is None:
+                key = name if name in COALESCED_COMMANDS else future
+                self.batch[key] = [name, arguments, [future]]
+            else:
+                entry[1] = arguments
+                entry[2].append(future)
+        if first:
+            self.schedule(self.run_batch)
+        return await asyncio.wait_for(future, COMMAND_TIMEOUT)
+
+    def resolve(self, futures, result, error):
+        for future in futures:
+            if future.done():
+                continue  # Timed out already
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RemoteError(str(error) or type(error).__name__))
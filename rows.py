@@ -0,0 +1,99 @@
+import os
+from collections import OrderedDict
+
+from instrumentation import instruments
+
+HIGHLIGHT_COLOR = [0.1, 0.6, 0.1, 1]
+TEXT_COLOR = [1, 1, 1, 1]
+SAVED_LISTS = 4  # Playlists whose sidebar rows are kept for switching back
+
+
+class PlaylistRows:
+    # Row data for the playlist sidebar, kept apart from the RecycleView that shows it so it can be
+    # built and measured without a window. self.data is the view's data list: a row is replaced by
+    # item assignment, which makes the view refresh only that row.
+    def __init__(self, row_text=os.path.basename):
+        self.data = []
+        self.row_text = row_text
+        self.highlighted = None
+        self.populated = False  # Rows are filled the first time the sidebar is opened
+        self.positions = None  # Playlist index -> row, while showing search results
+        self.list_key = None  # Which playlist the rows are for (None: the library)
+        self.saved_lists = OrderedDict()  # list key -> (rows, highlighted) of lists shown before
+
+    def make_row(self, index, song, is_current=False):
+        return {
+            'index': index,
+            'text': self.row_text(song),
+            'theme_text_color': 'Custom',
+            'text_color': HIGHLIGHT_COLOR if is_current else TEXT_COLOR,
+        }
+
+    def set_songs(self, songs, current_index):
+        self.populated = True
+        self.positions = None
+        self.highlighted = current_index if 0 <= current_index < len(songs) else None
+        with instruments.timer('ui.rebuild'):
+            self.data = [self.make_row(i, song, i == self.highlighted) for i, song in enumerate(songs)]
+
+    def set_results(self, songs, indices, current_index):
+        # Show only the given playlist indices; rows still carry their playlist index for playback
+        self.populated = True
+        self.positions = {index: position for position, index in enumerate(indices)}
+        self.highlighted = current_index
+        with instruments.timer('ui.rebuild'):
+            self.data = [self.make_row(i, songs[i], i == current_index) for i in indices]
+
+    def show_list(self, key, songs, current_index):
+        # Switch to another playlist. Rows of a list shown before are put back as they were
+        # instead of being rebuilt; only the highlight is moved.
+        if self.populated and self.positions is None:
+            self.saved_lists[self.list_key] = (self.data, self.highlighted)
+            self.saved_lists.move_to_end(self.list_key)
+            while len(self.saved_lists) > SAVED_LISTS:
+                self.saved_lists.popitem(last=False)
+        self.list_key = key
+        saved = self.saved_lists.pop(key, None)
+        if not self.populated:
+            return
+        if saved is None or len(saved[0]) != len(songs):
+            self.set_songs(songs, current_index)
+            return
+        self.positions = None
+        self.data, self.highlighted = saved
+        self.highlight(current_index if 0 <= current_index < len(songs) else None)
+
+    def forget_saved_lists(self):
+        self.saved_lists.clear()
+
+    def extend_songs(self, songs):
+        if not self.populated or self.positions is not None:
+            return
+        start = len(self.data)
+        self.data.extend([self.make_row(start + i, song) for i, song in enumerate(songs)])
+
+    def position_of(self, index):
+        if index is None:
+            return None
+        return index if self.positions is None else self.positions.get(index)
+
+    def update_row(self, index, **changes):
+        position = self.position_of(index)
+        if position is not None and 0 <= position < len(self.data):
+            row = dict(self.data[position])
+            row.update(changes)
+            self.data[position] = row  # Item assignment only refreshes this row's view
+
+    def set_row_color(self, index, color):
+        self.update_row(index, text_color=color)
+
+    def refresh_rows(self, rows):
+        for index, song in rows:
+            self.update_row(index, text=self.row_text(song))
+
+    def highlight(self, index):
+        if not self.populated or index == self.highlighted:
+            return
+        self.set_row_color(self.highlighted, TEXT_COLOR)
+        self.set_row_color(index, HIGHLIGHT_COLOR)
+        self.highlighted = index
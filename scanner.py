@@ -0,0 +1,123 @@
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from formats import audio_extensions
+
+logger = logging.getLogger(__name__)
+
+
+def scan_directory(path, extensions):
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(extensions) and entry.is_file():
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_mtime, stat.st_size))
+                except OSError:
+                    continue
+    except OSError as e:
+        logger.warning("Error scanning %s: %s", path, e)
+    return files, subdirs
+
+
+def walk_audio_files(root, extensions=None, workers=4, batch_size=500):
+    # Directories are listed in parallel; files come out in batches as soon as they are found,
+    # so only the directories still waiting to be listed are held in memory
+    extensions = tuple(ext.lower() for ext in extensions or audio_extensions())
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library-scan') as pool:
+        pending = {pool.submit(scan_directory, root, extensions)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for subdir in subdirs:
+                    pending.add(pool.submit(scan_directory, subdir, extensions))
+                batch.extend(files)
+                while len(batch) >= batch_size:
+                    yield batch[:batch_size]
+                    batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+
+class LibraryScanner:
+    # Keeps a (path, mtime, size) snapshot per scanned root so a rescan only reports what changed.
+    # scan() blocks; run it on a worker thread.
+    def __init__(self, db_file, extensions=None):
+        self.db_file = db_file
+        self.extensions = extensions
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS scan_snapshot ('
+            'path TEXT PRIMARY KEY, root TEXT, mtime REAL, size INTEGER, generation INTEGER)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS scan_snapshot_root ON scan_snapshot (root, generation)')
+        conn.execute('CREATE TEMP TABLE seen (path TEXT PRIMARY KEY)')
+        return conn
+
+    def scan(self, root, on_changes, batch_size=500):
+        # on_changes(added, modified, removed) is called once per batch that has anything in it
+        root = os.path.abspath(root)
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT MAX(generation) FROM scan_snapshot WHERE root = ?', (root,)).fetchone()
+            generation = (row[0] or 0) + 1
+            counts = {'added': 0, 'modified': 0, 'removed': 0, 'unchanged': 0}
+
+            for batch in walk_audio_files(root, self.extensions, batch_size=batch_size):
+                placeholders = ','.join('?' * len(batch))
+                known = {
+                    path: (mtime, size) for path, mtime, size in conn.execute(
+                        f'SELECT path, mtime, size FROM scan_snapshot WHERE path IN ({placeholders})',
+                        [entry[0] for entry in batch]
+                    )
+                }
+                added, modified = [], []
+                for path, mtime, size in batch:
+                    previous = known.get(path)
+                    if previous is None:
+                        added.append(path)
+                    elif previous != (mtime, size):
+                        modified.append(path)
+                # Unchanged files are only noted in the in-memory seen table, so a rescan of a
+                # library that didn't change writes nothing to disk
+                conn.executemany('INSERT OR IGNORE INTO seen VALUES (?)', [(entry[0],) for entry in batch])
+                if added or modified:
+                    changed = set(added).union(modified)
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO scan_snapshot VALUES (?, ?, ?, ?, ?)',
+                        [(path, root, mtime, size, generation) for path, mtime, size in batch if path in changed]
+                    )
+                    conn.commit()
+                counts['added'] += len(added)
+                counts['modified'] += len(modified)
+                counts['unchanged'] += len(batch) - len(added) - len(modified)
+                if added or modified:
+                    on_changes(added, modified, [])
+
+            # Anything not seen in this scan is gone from disk
+            cursor = conn.execute(
+                'SELECT path FROM scan_snapshot WHERE root = ? AND path NOT IN (SELECT path FROM seen)', (root,)
+            )
+            while True:
+                removed = [row[0] for row in cursor.fetchmany(batch_size)]
+                if not removed:
+                    break
+                counts['removed'] += len(removed)
+                on_changes([], [], removed)
+            conn.execute(
+                'DELETE FROM scan_snapshot WHERE root = ? AND path NOT IN (SELECT path FROM seen)', (root,)
+            )
+            conn.commit()
+            return counts
+        finally:
+            conn.close()
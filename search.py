@@ -0,0 +1,114 @@
+import bisect
+import heapq
+import itertools
+import os
+import re
+import unicodedata
+
+WORD_RE = re.compile(r'\w+')
+SHORT_PREFIX = 2  # Prefixes up to this length get their own posting sets; they would match too many words
+
+
+def fold(text):
+    # "Él Está Ahí" -> "el esta ahi"
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return WORD_RE.findall(fold(text)) if text else []
+
+
+class SearchIndex:
+    # Inverted index from folded words to song paths. Every query term is matched as a prefix,
+    # so results update as the user types. Paths keep the order they were first added in, which
+    # is playlist order when the index is built from the playlist and kept up to date with it.
+    def __init__(self):
+        self.postings = {}  # word -> set of paths
+        self.short = {}  # one/two-letter prefix -> set of paths
+        self.words = []  # sorted vocabulary, for prefix ranges
+        self.doc_words = {}  # path -> words, so a song can be re-indexed when its tags change
+        self.order = {}  # path -> when it was added
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.doc_words)
+
+    def add_many(self, entries):
+        # Bulk load of (path, title, artist, album): the vocabulary is sorted once at the end
+        words = self.words
+        self.words = []
+        try:
+            for entry in entries:
+                self.add(*entry, sort=False)
+        finally:
+            words.extend(self.words)
+            words.sort()
+            self.words = words
+
+    def add(self, path, title=None, artist=None, album=None, sort=True):
+        order = self.order.get(path)
+        if path in self.doc_words:
+            self.remove(path)
+        self.order[path] = next(self.counter) if order is None else order  # Re-indexing keeps the place
+        name = os.path.splitext(os.path.basename(path.replace('\\', '/')))[0]
+        words = set()
+        for text in (title, artist, album, name):
+            words.update(tokenize(text))
+        self.doc_words[path] = words
+        for word in words:
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = set()
+                if sort:
+                    bisect.insort(self.words, word)
+                else:
+                    self.words.append(word)
+            postings.add(path)
+            for length in range(1, min(SHORT_PREFIX, len(word)) + 1):
+                self.short.setdefault(word[:length], set()).add(path)
+
+    def remove(self, path):
+        words = self.doc_words.pop(path, ())
+        self.order.pop(path, None)
+        for word in words:
+            postings = self.postings[word]
+            postings.discard(path)
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+        # Short prefixes are shared by many words; only drop the path if no remaining word needs it
+        remaining = {word[:length] for word in words for length in range(1, min(SHORT_PREFIX, len(word)) + 1)}
+        for prefix in remaining:
+            self.short[prefix].discard(path)
+
+    def matching(self, term):
+        if len(term) <= SHORT_PREFIX:
+            return self.short.get(term, set())
+        start = bisect.bisect_left(self.words, term)
+        end = bisect.bisect_left(self.words, term + '￿')
+        if end - start == 1:
+            return self.postings[self.words[start]]
+        matches = set()
+        for word in self.words[start:end]:
+            matches |= self.postings[word]
+        return matches
+
+    def search(self, query):
+        terms = tokenize(query)
+        if not terms:
+            return set()
+        # Narrowest term first so the intersections stay small
+        sets = sorted((self.matching(term) for term in terms), key=len)
+        results = set(sets[0])
+        for matches in sets[1:]:
+            results &= matches
+            if not results:
+                break
+        return results
+
+    def first(self, query, limit):
+        # The first limit matches in the order the paths were added
+        return heapq.nsmallest(limit, self.search(query), key=self.order.__getitem__)
@@ -0,0 +1,199 @@
+import bisect
+import logging
+import operator
+
+from metadata import SORTED_FIELDS, TAG_FIELDS, sort_expression
+from storage import atomic_write_json, read_json
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 256
+OPERATORS = {
+    '=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    'contains': lambda actual, value: str(value).lower() in str(actual).lower(),
+}
+RULE_FIELDS = TAG_FIELDS + ('plays',)
+ORDER_FIELDS = SORTED_FIELDS + ('plays', 'added')
+NUMERIC_FIELDS = ('duration', 'bitrate', 'plays')
+
+# Written to smart_playlists.json the first time, as a starting point to edit
+DEFAULT_SMART_PLAYLISTS = [
+    {'name': 'Recently added', 'order': '-added', 'limit': 200},
+    {'name': 'Most played', 'order': '-plays', 'limit': 100},
+    {'name': 'Short tracks', 'rules': [{'field': 'duration', 'op': '<', 'value': 300}], 'order': 'title'},
+]
+
+
+class Rule:
+    def __init__(self, field, op, value):
+        if field not in RULE_FIELDS:
+            raise ValueError(f"Unknown rule field: {field}")
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown rule operator: {op}")
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def sql(self):
+        expression = sort_expression(self.field)
+        if self.op == 'contains':
+            return f'{expression} LIKE ?', [f'%{self.value}%']
+        return f'{expression} {self.op} ?', [self.value]
+
+    def matches(self, info, plays):
+        actual = plays if self.field == 'plays' else info.get(self.field)
+        if actual is None:
+            actual = 0 if self.field in NUMERIC_FIELDS else ''
+        try:
+            return OPERATORS[self.op](actual, self.value)
+        except TypeError:
+            return False
+
+
+class SmartPlaylist:
+    # A named set of rules (all must match) with an order such as "-plays" and an optional limit
+    def __init__(self, name, rules=(), order='added', limit=None):
+        self.name = name
+        self.rules = [Rule(**rule) for rule in rules]
+        self.descending = order.startswith('-')
+        self.field = order.lstrip('-')
+        if self.field not in ORDER_FIELDS:
+            raise ValueError(f"Unknown order field: {self.field}")
+        self.limit = limit
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data.get('rules', ()), data.get('order', 'added'), data.get('limit'))
+
+    def where(self):
+        clauses, params = [], []
+        for rule in self.rules:
+            clause, rule_params = rule.sql()
+            clauses.append(clause)
+            params.extend(rule_params)
+        return ' AND '.join(clauses), params
+
+    def matches(self, store, history, path):
+        info = store.cached(path)
+        plays = history.play_count(path)
+        if self.field == 'plays' and not plays:
+            return False
+        if info is None:
+            return not self.rules
+        return all(rule.matches(info, plays) for rule in self.rules)
+
+    def sort_key(self, store, history, playlist, path):
+        # The Python twin of the SQL sort expression
+        if self.field == 'added':
+            return playlist.find(path)
+        if self.field == 'plays':
+            return history.play_count(path)
+        value = (store.cached(path) or {}).get(self.field)
+        return value if value is not None else (0 if self.field in NUMERIC_FIELDS else '')
+
+
+def load_smart_playlists(path):
+    data = read_json(path, None)
+    if data is None:
+        data = DEFAULT_SMART_PLAYLISTS
+        try:
+            atomic_write_json(path, data)
+        except OSError as e:
+            logger.error("Error writing smart playlists: %s", e)
+    playlists = {}
+    for entry in data:
+        try:
+            smart = SmartPlaylist.from_dict(entry)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Skipping smart playlist %r: %s", entry, e)
+            continue
+        playlists[smart.name] = smart
+    return playlists
+
+
+class Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class SmartResults:
+    # A smart playlist evaluated lazily: rows are read a page at a time, in list order, only as far
+    # as take() asks. Rows already read stay sorted, so tracks indexed or played later are slotted
+    # in with a bisect instead of re-running the query; ones past the read cursor turn up in later pages.
+    def __init__(self, smart, store, history, playlist):
+        self.smart = smart
+        self.store = store
+        self.history = history
+        self.playlist = playlist
+        self.where, self.params = smart.where()
+        self.rows = []  # (sort key, path)
+        self.paths = {}  # path -> row, for rows already read
+        self.after = None  # (sort key, path) of the last row read from the source
+        self.exhausted = False
+        self.row_key = Descending if smart.descending else None
+
+    def take(self, count):
+        if self.smart.limit is not None:
+            count = min(count, self.smart.limit)
+        while len(self.rows) < count and not self.exhausted:
+            self.read_page()
+        return [path for _, path in self.rows[:count]]
+
+    def read_page(self):
+        if self.smart.field == 'added':
+            page = self.playlist_page()
+        else:
+            page = self.store.page(self.where, self.params, self.smart.field, self.smart.descending, self.after,
+                                   PAGE_SIZE)
+            if len(page) < PAGE_SIZE:
+                self.exhausted = True
+            if page:
+                self.after = tuple(page[-1])
+            page = [(key, path) for key, path in page if path in self.playlist]
+        for row in page:
+            if row[1] not in self.paths:
+                self.paths[row[1]] = row
+                self.rows.append(row)
+
+    def playlist_page(self):
+        # "added" order is playlist order, so walk the playlist itself instead of the tag store
+        step = -1 if self.smart.descending else 1
+        if self.after is not None:
+            start = self.after[0] + step
+        else:
+            start = len(self.playlist) - 1 if self.smart.descending else 0
+        stop = max(start - PAGE_SIZE, -1) if self.smart.descending else min(start + PAGE_SIZE, len(self.playlist))
+        page = []
+        for index in range(start, stop, step):
+            path = self.playlist[index]
+            if self.smart.matches(self.store, self.history, path):
+                page.append((index, path))
+        if stop in (-1, len(self.playlist)):
+            self.exhausted = True
+        if stop != start:
+            self.after = (stop - step, self.playlist[stop - step])
+        return page
+
+    def update(self, paths):
+        # Re-checks paths whose tags, play count or membership changed; returns whether any row moved
+        changed = False
+        for path in paths:
+            row = self.paths.pop(path, None)
+            if row is not None:
+                self.rows.remove(row)
+                changed = True
+            if path not in self.playlist or not self.smart.matches(self.store, self.history, path):
+                continue
+            row = (self.smart.sort_key(self.store, self.history, self.playlist, path), path)
+            key = self.row_key or (lambda value: value)
+            if self.exhausted or (self.after is not None and not key(self.after) < key(row)):
+                # Inside the part already read; later rows are picked up by the next page
+                bisect.insort(self.rows, row, key=self.row_key)
+                self.paths[path] = row
+                changed = True
+        return changed
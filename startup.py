@@ -0,0 +1,28 @@
+import json
+import time
+
+
+class StartupTimer:
+    # Timestamps of startup milestones, measured from when this module was first imported
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks = []
+
+    def mark(self, name):
+        if name not in dict(self.marks):
+            self.marks.append((name, time.perf_counter() - self.started))
+
+    def report(self):
+        # For each milestone: time since start, and time spent since the previous milestone
+        report, previous = {}, 0.0
+        for name, elapsed in self.marks:
+            report[name] = {'at_ms': round(elapsed * 1000, 2), 'took_ms': round((elapsed - previous) * 1000, 2)}
+            previous = elapsed
+        return report
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+startup_timer = StartupTimer()
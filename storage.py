@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+
+from instrumentation import instruments
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_json(path, data):
+    # Write next to the target and rename over it, so a crash leaves either the old or the new file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except ValueError as e:
+        logger.error("Error reading %s: %s", path, e)
+        return default
+
+
+class PlaylistStore:
+    # playlist.json holds a snapshot; edits since then are appended to playlist.log as JSON lines
+    # and folded back into the snapshot once the log grows past compact_every entries.
+    def __init__(self, playlist_file, compact_every=500):
+        self.playlist_file = playlist_file
+        self.log_file = os.path.splitext(playlist_file)[0] + '.log'
+        self.state_file = os.path.splitext(playlist_file)[0] + '_state.json'
+        self.compact_every = compact_every
+        self.pending = []
+        self.log_entries = 0
+        self.needs_snapshot = False
+
+    def load(self):
+        # The snapshot is read with one json.load rather than streamed: it only changes on
+        # compaction, and a chunked decoder measured several times slower on 100k tracks
+        self.log_entries = 0  # Counted again from the log below, however often load() is called
+        self.needs_snapshot = False
+        with instruments.timer('playlist.load'):
+            return self.read_playlist()
+
+    def read_playlist(self):
+        songs = read_json(self.playlist_file, [])
+        if not os.path.exists(self.log_file):
+            return songs
+        known = set(songs)
+        with open(self.log_file, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash; everything before it is intact. Rewrite the
+                    # snapshot on the next flush so new entries aren't appended after it.
+                    self.needs_snapshot = True
+                    continue
+                self.log_entries += 1
+                if entry['op'] == 'add':
+                    # Replays are idempotent, so a crash between snapshot and log truncation is harmless
+                    for path in entry['paths']:
+                        if path not in known:
+                            known.add(path)
+                            songs.append(path)
+                elif entry['op'] == 'remove':
+                    gone = set(entry['paths']) & known
+                    if gone:
+                        known -= gone
+                        songs = [song for song in songs if song not in gone]
+        return songs
+
+    def record_add(self, paths):
+        if paths:
+            self.pending.append({'op': 'add', 'paths': list(paths)})
+
+    def record_remove(self, paths):
+        if paths:
+            self.pending.append({'op': 'remove', 'paths': list(paths)})
+
+    def flush(self, playlist):
+        with instruments.timer('playlist.save'):
+            self.write_pending(playlist)
+
+    def write_pending(self, playlist):
+        if self.needs_snapshot or self.log_entries + len(self.pending) > self.compact_every:
+            self.compact(playlist)
+        elif self.pending:
+            with open(self.log_file, 'a') as f:
+                f.write(''.join(json.dumps(entry) + '\n' for entry in self.pending))
+                f.flush()
+                os.fsync(f.fileno())
+            self.log_entries += len(self.pending)
+        self.pending = []
+
+    def compact(self, playlist):
+        atomic_write_json(self.playlist_file, playlist)
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.log_entries = 0
+        self.pending = []
+        self.needs_snapshot = False
+
+    def load_state(self):
+        return read_json(self.state_file, {})
+
+    def save_state(self, state):
+        atomic_write_json(self.state_file, state)
@@ -0,0 +1,317 @@
+import io
+import logging
+import mmap
+import os
+import re
+import secrets
+import threading
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+BUFFER_SIZE = 4 * 1024 * 1024
+RELEASE_SPAN = 8 * 1024 * 1024
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def is_url(location):
+    return location.startswith(('http://', 'https://'))
+
+
+def open_source(location):
+    return HttpSource(location) if is_url(location) else MappedSource(location)
+
+
+class MappedSource(io.RawIOBase):
+    # Local file read through mmap. Pages are faulted in as they are read and handed back to the
+    # OS once playback has moved RELEASE_SPAN past them, so resident memory doesn't grow with the file.
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        if self.map and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+        self.offset = 0
+        self.released = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), self.size - self.offset))
+        if count:
+            buffer[:count] = self.map[self.offset:self.offset + count]
+            self.offset += count
+            self.release_behind()
+        return count
+
+    def release_behind(self):
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        end = (self.offset - RELEASE_SPAN) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end - self.released >= RELEASE_SPAN:
+            self.map.madvise(mmap.MADV_DONTNEED, self.released, end - self.released)
+            self.released = end
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.offset, io.SEEK_END: self.size}[whence]
+        self.offset = max(0, base + offset)
+        if self.offset < self.released:
+            self.released = self.offset // mmap.PAGESIZE * mmap.PAGESIZE
+        return self.offset
+
+    def tell(self):
+        return self.offset
+
+    def close(self):
+        if not self.closed:
+            if self.map:
+                self.map.close()
+            self.file.close()
+        super().close()
+
+
+class RingBuffer:
+    # Fixed-size byte FIFO; the writer checks free() first, it never grows
+    def __init__(self, capacity):
+        self.data = bytearray(capacity)
+        self.capacity = capacity
+        self.start = 0
+        self.length = 0
+
+    def free(self):
+        return self.capacity - self.length
+
+    def write(self, chunk):
+        if len(chunk) > self.free():
+            raise ValueError("Ring buffer overflow")
+        end = (self.start + self.length) % self.capacity
+        first = min(len(chunk), self.capacity - end)
+        self.data[end:end + first] = chunk[:first]
+        self.data[:len(chunk) - first] = chunk[first:]
+        self.length += len(chunk)
+
+    def read(self, size):
+        count = min(size, self.length)
+        first = min(count, self.capacity - self.start)
+        out = bytes(self.data[self.start:self.start + first]) + bytes(self.data[:count - first])
+        self.skip(count)
+        return out
+
+    def skip(self, count):
+        self.start = (self.start + count) % self.capacity
+        self.length -= count
+
+    def clear(self):
+        self.start = self.length = 0
+
+
+class HttpSource(io.RawIOBase):
+    # Reads a URL through a bounded ring buffer filled by a read-ahead thread. A seek inside the
+    # buffered window just skips ahead; anything else restarts the download with a Range request.
+    def __init__(self, url, buffer_size=BUFFER_SIZE, chunk_size=CHUNK_SIZE, timeout=10):
+        self.url = url
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.ring = RingBuffer(buffer_size)
+        self.cond = threading.Condition()
+        self.position = 0
+        self.generation = 0  # Bumped on every seek that drops the buffer
+        self.eof = False
+        self.error = None
+        response = self.open_range(0)
+        self.size = self.content_size(response)
+        self.fetcher = threading.Thread(target=self.fetch, args=(response,), daemon=True, name='http-source')
+        self.fetcher.start()
+
+    def open_range(self, offset):
+        request = urllib.request.Request(self.url, headers={'Range': f'bytes={offset}-'})
+        response = urllib.request.urlopen(request, timeout=self.timeout)
+        if offset and response.status != 206:
+            response.close()
+            raise OSError(f"Server does not support range requests: {self.url}")
+        return response
+
+    @staticmethod
+    def content_size(response):
+        content_range = response.headers.get('Content-Range')
+        if content_range and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            return int(total) if total.isdigit() else None
+        length = response.headers.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+
+    def fetch(self, response):
+        generation = 0
+        try:
+            while True:
+                with self.cond:
+                    while not self.closed and (self.eof or (
+                            generation == self.generation and self.ring.free() < self.chunk_size)):
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    restart = generation != self.generation
+                    generation, offset = self.generation, self.position
+                chunk, error = None, None
+                try:
+                    if restart:
+                        response.close()
+                        response = self.open_range(offset)
+                    chunk = response.read(self.chunk_size)
+                except OSError as e:
+                    error = e
+                with self.cond:
+                    if generation != self.generation:
+                        continue  # Seeked away while this chunk was in flight
+                    if error:
+                        self.error, self.eof = error, True
+                    elif not chunk:
+                        self.eof = True
+                    else:
+                        self.ring.write(chunk)
+                    self.cond.notify_all()
+        finally:
+            response.close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        with self.cond:
+            while not self.ring.length and not self.eof and not self.closed:
+                self.cond.wait()
+            if not self.ring.length:
+                if self.error:
+                    raise self.error
+                return 0
+            data = self.ring.read(len(buffer))
+            self.position += len(data)
+            self.cond.notify_all()
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        with self.cond:
+            if whence == io.SEEK_END:
+                if self.size is None:
+                    raise OSError(f"Stream length is unknown: {self.url}")
+                target = self.size + offset
+            else:
+                target = offset + (self.position if whence == io.SEEK_CUR else 0)
+            target = max(0, target)
+            ahead = target - self.position
+            if 0 <= ahead <= self.ring.length:
+                self.ring.skip(ahead)
+            else:
+                self.ring.clear()
+                self.generation += 1
+                self.error = None
+                self.eof = self.size is not None and target >= self.size
+            self.position = target
+            self.cond.notify_all()
+        return target
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        with self.cond:
+            super().close()
+            self.cond.notify_all()
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def serve(self, send_body):
+        entry = self.server.locations.get(self.path.lstrip('/').split('.', 1)[0])
+        if entry is None:
+            self.send_error(404)
+            return
+        location, opener = entry
+        try:
+            source = opener(location)
+        except (OSError, ValueError) as e:
+            logger.warning("Error opening stream: %s", e)
+            self.send_error(502 if is_url(location) else 404)
+            return
+        with source:
+            start, end = 0, None if source.size is None else source.size - 1
+            match = RANGE_PATTERN.match(self.headers.get('Range', ''))
+            if match and source.size is not None:
+                first, last = match.groups()
+                if first:
+                    start, end = int(first), min(int(last), end) if last else end
+                elif last:
+                    start = max(0, source.size - int(last))
+                if start > end:
+                    self.send_error(416)
+                    return
+            self.send_response(206 if match and source.size is not None else 200)
+            self.send_header('Accept-Ranges', 'bytes')
+            if end is not None:
+                self.send_header('Content-Length', str(end - start + 1))
+            if match and source.size is not None:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{source.size}')
+            self.end_headers()
+            if not send_body:
+                return
+            source.seek(start)
+            remaining = None if end is None else end - start + 1
+            try:
+                while remaining is None or remaining > 0:
+                    chunk = source.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    if remaining is not None:
+                        remaining -= len(chunk)
+            except (ConnectionError, OSError):
+                pass  # The player closed the connection, usually to seek
+
+    def log_message(self, format, *args):
+        logger.debug("Stream %s: " + format, self.address_string(), *args)
+
+
+class StreamServer:
+    # Serves playlist entries to the sound backend over loopback HTTP with Range support, so
+    # URI-capable providers (gstreamer, ffpyplayer) pull audio a chunk at a time through
+    # MappedSource/HttpSource rather than opening or downloading the whole file
+    def __init__(self, host='127.0.0.1'):
+        self.server = ThreadingHTTPServer((host, 0), StreamHandler)
+        self.server.daemon_threads = True
+        self.server.locations = {}  # token -> (file path or URL, opener)
+        self.tokens = {}
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='stream-server')
+        self.thread.start()
+
+    def url_for(self, location, opener=open_source, extension=None):
+        # opener(location) gives the source served; one that converts the audio (dsp.EqualizedSource)
+        # passes the extension of what it produces
+        token = self.tokens.get((location, opener))
+        if token is None:
+            token = self.tokens[location, opener] = secrets.token_urlsafe(12)
+            self.server.locations[token] = (location, opener)
+        # Keep the extension; providers pick a decoder from it
+        if extension is None:
+            extension = os.path.splitext(urllib.parse.urlsplit(location).path if is_url(location) else location)[1]
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/{token}{extension}'
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
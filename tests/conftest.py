@@ -0,0 +1,31 @@
+import pytest
+
+from engine import PlayerEngine
+from fakes import FakeBackend, FakeClock, FakeLoop, Harness, library
+from storage import atomic_write_json
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    # make_engine(tracks=0, songs=None, **engine options) -> Harness around a PlayerEngine whose
+    # playlist.json holds `songs`, or `tracks` generated paths. Engines are closed afterwards.
+    harnesses = []
+
+    def make(tracks=0, songs=None, lengths=None, load_delay=0.0, **options):
+        playlist_file = tmp_path / 'playlist.json'
+        if songs is None:
+            songs = library(tracks)
+        if songs and not playlist_file.exists():
+            atomic_write_json(str(playlist_file), songs)
+        clock = FakeClock()
+        loop = FakeLoop(clock)
+        backend = FakeBackend(clock, lengths=lengths, load_delay=load_delay)
+        engine = PlayerEngine(str(playlist_file), backend.load, schedule=loop.schedule,
+                              schedule_later=loop.schedule_later, time_source=clock, **options)
+        harness = Harness(engine, clock, loop, backend)
+        harnesses.append(harness)
+        return harness
+
+    yield make
+    for harness in harnesses:
+        harness.close()
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+SIZES = (1_000, 10_000, 100_000)  # Library sizes the benchmarks run at
+
+
+class FakeClock:
+    # Monotonic time that only moves when a test says so
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeEvent:
+    def __init__(self, callback):
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeLoop:
+    # The UI main loop in miniature. schedule() queues a callback from any thread, as
+    # Clock.schedule_once does; schedule_later() arms a timer on the fake clock. Nothing runs
+    # until the test calls run_pending(), advance() or wait_until() on its own thread.
+    def __init__(self, clock):
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.ready = deque()
+        self.timers = []  # Heap of (due, sequence, event)
+        self.sequence = itertools.count()
+        self.wakeups = 0  # Callbacks and timers run so far
+
+    def schedule(self, callback):
+        with self.cond:
+            self.ready.append(callback)
+            self.cond.notify_all()
+
+    def schedule_later(self, delay, callback):
+        event = FakeEvent(callback)
+        with self.cond:
+            heapq.heappush(self.timers, (self.clock() + delay, next(self.sequence), event))
+        return event
+
+    def next_due(self):
+        with self.cond:
+            while self.timers and self.timers[0][2].cancelled:
+                heapq.heappop(self.timers)
+            return self.timers[0][0] if self.timers else None
+
+    def run_pending(self):
+        # Runs queued callbacks and timers that are due, including ones they schedule in turn
+        while True:
+            with self.cond:
+                if self.ready:
+                    callback = self.ready.popleft()
+                elif self.timers and self.timers[0][0] <= self.clock():
+                    callback = heapq.heappop(self.timers)[2]
+                    if callback.cancelled:
+                        continue
+                    callback = callback.callback
+                else:
+                    return
+            self.wakeups += 1
+            callback()
+
+    def wait_until(self, predicate, timeout=10.0):
+        # Runs callbacks as worker threads hand them over, in real time, until predicate() holds
+        deadline = time.monotonic() + timeout
+        while True:
+            self.run_pending()
+            if predicate():
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AssertionError("Timed out waiting for the engine")
+            with self.cond:
+                if not self.ready:
+                    self.cond.wait(min(remaining, 0.01))
+
+
+class FakeSound:
+    # The parts of kivy.core.audio.Sound the engine uses. Position follows the fake clock while
+    # playing; stop() and reaching the end both dispatch on_stop, as the real backends do.
+    def __init__(self, source, clock, length):
+        self.source = source
+        self.clock = clock
+        self.length = length
+        self.volume = 1.0
+        self.state = 'stop'
+        self.offset = 0.0
+        self.started = 0.0
+        self.on_stop = []
+        self.plays = 0
+        self.played_at = None  # Real perf_counter() time of the last play(), for time-to-audio
+        self.unloaded = False
+
+    def bind(self, on_stop):
+        self.on_stop.append(on_stop)
+
+    def unbind(self, on_stop):
+        self.on_stop.remove(on_stop)
+
+    def play(self):
+        self.state = 'play'
+        self.offset = 0.0
+        self.started = self.clock()
+        self.plays += 1
+        self.played_at = time.perf_counter()
+
+    def stop(self):
+        if self.state == 'play':
+            self.state = 'stop'
+            self.dispatch_stop()
+
+    def seek(self, position):
+        self.offset = position
+        self.started = self.clock()
+
+    def get_pos(self):
+        if self.state != 'play':
+            return 0
+        return min(self.offset + self.clock() - self.started, self.length)
+
+    def ends_at(self):
+        return self.started + self.length - self.offset if self.state == 'play' else None
+
+    def dispatch_stop(self):
+        for handler in list(self.on_stop):
+            handler(self)
+
+    def unload(self):
+        self.state = 'stop'
+        self.unloaded = True
+
+
+class FakeBackend:
+    # Stands in for SoundLoader.load. Every location gets a FakeSound of lengths.get(location,
+    # default_length) seconds; load_delay makes each load take that long in real time, as a cold
+    # read from an SD card would. Clearing `released` holds every load until it is set again.
+    def __init__(self, clock, default_length=180.0, lengths=None, load_delay=0.0):
+        self.clock = clock
+        self.default_length = default_length
+        self.lengths = lengths or {}
+        self.load_delay = load_delay
+        self.released = threading.Event()
+        self.released.set()
+        self.lock = threading.Lock()
+        self.sounds = []
+
+    def load(self, location):
+        self.released.wait()
+        if self.load_delay:
+            time.sleep(self.load_delay)
+        sound = FakeSound(location, self.clock, self.lengths.get(location, self.default_length))
+        with self.lock:
+            self.sounds.append(sound)
+        return sound
+
+    def playing(self):
+        with self.lock:
+            return [sound for sound in self.sounds if sound.state == 'play']
+
+    def next_end(self):
+        ends = [sound.ends_at() for sound in self.playing()]
+        return min(ends) if ends else None
+
+    def update(self):
+        # Sounds that reached their end stop by themselves
+        for sound in self.playing():
+            if sound.ends_at() <= self.clock():
+                sound.state = 'stop'
+                sound.dispatch_stop()
+
+
+class Harness:
+    # A PlayerEngine wired to a fake clock, main loop and audio backend
+    def __init__(self, engine, clock, loop, backend):
+        self.engine = engine
+        self.clock = clock
+        self.loop = loop
+        self.backend = backend
+        self.closed = False
+
+    def start(self, index=0):
+        # Plays index and waits until the track after it is preloaded as well
+        self.engine.play_index(index)
+        self.wait_for_sound()
+        self.wait_preloaded()
+
+    def wait_for_sound(self):
+        self.loop.wait_until(lambda: self.engine.sound is not None)
+
+    def wait_preloaded(self):
+        engine = self.engine
+        self.loop.wait_until(lambda: engine.track_loader.is_ready(engine.playlist[engine.next_index()]))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.engine.close()
+
+    def advance(self, seconds):
+        # Moves the fake clock forward, firing timers and track ends in the order they fall due
+        target = self.clock() + seconds
+        while True:
+            self.loop.run_pending()
+            due = [when for when in (self.loop.next_due(), self.backend.next_end()) if when is not None]
+            if not due or min(due) > target:
+                break
+            self.clock.now = max(self.clock.now, min(due))
+            self.backend.update()
+            self.loop.run_pending()
+        self.clock.now = target
+        self.backend.update()
+        self.loop.run_pending()
+
+
+def library(count, per_album=10):
+    # count made-up paths, per_album to a folder; the files don't exist
+    return [f'/music/Artist {i // per_album:05d}/Album/{i % per_album + 1:02d} Track {i:06d}.mp3'
+            for i in range(count)]
@@ -0,0 +1,101 @@
+import struct
+import wave
+
+import numpy as np
+
+MP3_FRAME = b'\xff\xfb\x90\x40' + bytes(413)  # MPEG-1 layer III, 128 kbit/s, 44.1 kHz, joint stereo: silence
+MP3_FRAME_SECONDS = 1152 / 44100
+
+
+def write_mp3(path, seconds=1.0, **tags):
+    # Constant-bitrate silence with an ID3v2 tag written by mutagen; tags are EasyID3 keys
+    with open(path, 'wb') as f:
+        f.write(MP3_FRAME * max(1, round(seconds / MP3_FRAME_SECONDS)))
+    if tags:
+        from mutagen.easyid3 import EasyID3
+        id3 = EasyID3()
+        for key, value in tags.items():
+            id3[key] = value
+        id3.save(path)
+
+
+def write_wav(path, samples, rate=44100, **tags):
+    # samples: float frames x channels in [-1, 1], written as 16-bit PCM, with an INFO chunk for
+    # title/artist/album when given
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(samples.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes((np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes())
+    body = b''
+    for key, field in ((b'INAM', 'title'), (b'IART', 'artist'), (b'IPRD', 'album')):
+        if tags.get(field):
+            value = tags[field].encode()
+            # NUL-terminated, padded to an even length
+            body += key + struct.pack('<I', len(value) + 1) + value + b'\0' * (2 - len(value) % 2)
+    if body:
+        with open(path, 'r+b') as f:
+            f.seek(0, 2)
+            f.write(b'LIST' + struct.pack('<I', 4 + len(body)) + b'INFO' + body)
+            size = f.tell()
+            f.seek(4)
+            f.write(struct.pack('<I', size - 8))
+
+
+def music(seconds, rate=44100, seed=0, channels=2):
+    # Something with the structure of music for fingerprinting and loudness: a sequence of notes
+    # (harmonic tones with decaying envelopes) over a little noise, different for every seed
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * rate)
+    t = np.arange(frames) / rate
+    out = 0.02 * rng.standard_normal(frames)
+    note = 0.25
+    for start in np.arange(0, seconds, note):
+        first, last = int(start * rate), min(int((start + note) * rate), frames)
+        span = t[first:last] - start
+        pitch = 110 * 2 ** (rng.integers(0, 36) / 12)
+        envelope = np.exp(-6 * span)
+        for harmonic in (1, 2, 3):
+            out[first:last] += 0.3 / harmonic * envelope * np.sin(2 * np.pi * pitch * harmonic * span)
+    out *= 0.5 / max(np.abs(out).max(), 1e-9)
+    return np.repeat(out[:, None], channels, axis=1).astype(np.float32)
+
+
+MP4_TAGS = {'title': '\xa9nam', 'artist': '\xa9ART', 'album': '\xa9alb'}
+
+
+def write_soundfile(path, samples, rate=44100, format='FLAC', subtype=None, **tags):
+    # FLAC or Ogg (Vorbis, Opus) through libsndfile, tagged with Vorbis comments by mutagen
+    import soundfile
+    from mutagen import File as MutagenFile
+    soundfile.write(str(path), samples, rate, format=format, subtype=subtype)
+    if tags:
+        audio = MutagenFile(str(path))
+        for key, value in tags.items():
+            audio[key] = value
+        audio.save()
+
+
+def write_m4a(path, samples, rate=44100, **tags):
+    # AAC in an MP4 container through PyAV, with iTunes-style tags written by mutagen
+    import av
+    from mutagen.mp4 import MP4
+    with av.open(str(path), 'w', format='mp4') as container:
+        stream = container.add_stream('aac', rate=rate)
+        stream.layout = 'stereo'
+        block = 1024
+        for start in range(0, len(samples), block):
+            planar = np.ascontiguousarray(samples[start:start + block].T, dtype=np.float32)
+            frame = av.AudioFrame.from_ndarray(planar, format='fltp', layout='stereo')
+            frame.sample_rate = rate
+            frame.pts = start
+            container.mux(stream.encode(frame))
+        container.mux(stream.encode(None))
+    if tags:
+        audio = MP4(str(path))
+        for key, value in tags.items():
+            audio[MP4_TAGS[key]] = value
+        audio.save()
@@ -0,0 +1,155 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from artwork import ArtworkLoader, Thumbnail, ThumbnailCache
+from media import write_mp3
+
+PIL = pytest.importorskip('PIL.Image')
+
+
+def cover_jpeg(seed, side=1600):
+    # A large cover, like the 1500-3000 px scans embedded by most shops
+    image = PIL.radial_gradient('L').resize((side, side)).convert('RGB')
+    image = PIL.merge('RGB', [band.point(lambda v, k=k: (v + seed * 37 * k) % 256)
+                              for k, band in enumerate(image.split(), 1)])
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+def write_with_cover(path, seed):
+    from mutagen.id3 import APIC, ID3
+    write_mp3(path, 0.2, title=f'Song {seed}')
+    tags = ID3(path)
+    tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=cover_jpeg(seed)))
+    tags.save(path)
+    return path
+
+
+class Loaded:
+    def __init__(self):
+        self.thumbs = {}
+        self.event = threading.Event()
+
+    def __call__(self, path, thumb):
+        self.thumbs[path] = thumb
+        self.event.set()
+
+
+def wait_idle(loader):
+    loader.executor.submit(lambda: None).result(timeout=60)
+
+
+def cache_usage(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+
+@pytest.fixture(scope='module')
+def covered(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('covers')
+    return [write_with_cover(str(folder / f'{i:02d}.mp3'), i) for i in range(30)]
+
+
+def test_memory_cache_stays_under_its_ceiling():
+    cache = ThumbnailCache(max_bytes=1024 * 1024)
+    for i in range(200):
+        cache.put(i, Thumbnail(128, 128, bytes(128 * 128 * 4)))
+        cache.get(0)  # Kept because it's used all the time
+    assert cache.total_bytes <= cache.max_bytes
+    assert len(cache.entries) == 16 and 0 in cache.entries
+    cache.put('huge', Thumbnail(1024, 1024, bytes(1024 * 1024 * 4)))
+    assert 'huge' not in cache.entries
+
+
+def test_loader_memory_and_disk_stay_bounded(tmp_path, covered):
+    loaded = Loaded()
+    cache_dir = str(tmp_path / 'art_cache')
+    loader = ArtworkLoader(cache_dir, loaded, max_bytes=1024 * 1024, max_disk_bytes=256 * 1024)
+    for path in covered:
+        assert loader.request(path, (250, 250)) is None
+    wait_idle(loader)
+    assert all(loaded.thumbs[path].width == 256 for path in covered)  # Rounded up to SIZE_STEP
+    assert loader.memory.total_bytes <= 1024 * 1024
+    assert len(loader.memory.entries) == 4  # 256 KiB of pixels each
+    assert cache_usage(cache_dir) <= 256 * 1024
+    assert loader.request(covered[-1], (256, 256)) is not None
+    loader.shutdown()
+
+
+def test_disk_hits_survive_pruning(tmp_path, covered):
+    loaded = Loaded()
+    cache_dir = str(tmp_path / 'art_cache')
+    loader = ArtworkLoader(cache_dir, loaded, max_bytes=0, max_disk_bytes=256 * 1024)
+    loader.request(covered[0], (128, 128))
+    for path in covered[1:]:
+        loader.request(covered[0], (128, 128))  # Read back from disk, nothing is kept in memory
+        loader.request(path, (128, 128))
+    wait_idle(loader)
+    first_key, _ = loader.cache_key(covered[0], (128, 128))
+    assert os.path.exists(os.path.join(cache_dir, first_key + '.png'))
+    loader.shutdown()
+
+
+def test_missing_art_is_retried_later(tmp_path):
+    folder = tmp_path / 'album'
+    folder.mkdir()
+    path = str(folder / 'song.mp3')
+    write_mp3(path, 0.2)
+    loaded = Loaded()
+    loader = ArtworkLoader(str(tmp_path / 'art_cache'), loaded)
+    loader.request(path, (128, 128))
+    wait_idle(loader)
+    assert loaded.thumbs[path] is None
+
+    (folder / 'cover.jpg').write_bytes(cover_jpeg(1, side=300))
+    loader.request(path, (128, 128))
+    wait_idle(loader)
+    assert loaded.thumbs[path] is None  # The "no art" marker is still fresh
+
+    key, _ = loader.cache_key(path, (128, 128))
+    marker = os.path.join(loader.cache_dir, key + '.none')
+    old = time.time() - loader.missing_retry - 60
+    os.utime(marker, (old, old))
+    loader.request(path, (128, 128))
+    wait_idle(loader)
+    assert loaded.thumbs[path].width == 128
+    assert not os.path.exists(marker)
+    loader.shutdown()
+
+
+def test_expired_markers_are_pruned_at_startup(tmp_path):
+    cache_dir = tmp_path / 'art_cache'
+    cache_dir.mkdir()
+    old = time.time() - 30 * 24 * 3600
+    for i in range(100):
+        marker = cache_dir / f'{i:040d}.none'
+        marker.touch()
+        if i % 2:
+            os.utime(marker, (old, old))
+    loader = ArtworkLoader(str(cache_dir), Loaded())
+    wait_idle(loader)
+    assert len(os.listdir(cache_dir)) == 50
+    loader.shutdown()
+
+
+# Benchmark: a cold thumbnail from a 1600 px embedded cover, and the same one read back from disk
+
+@pytest.mark.parametrize('source', ('cover', 'disk'))
+def test_load_thumbnail(benchmark, tmp_path, covered, source):
+    loaded = Loaded()
+    loader = ArtworkLoader(str(tmp_path / 'art_cache'), loaded, max_bytes=0)
+    key, size = loader.cache_key(covered[0], (256, 256))
+    loader.load(covered[0], key, size)
+
+    def run():
+        if source == 'cover':
+            os.remove(os.path.join(loader.cache_dir, key + '.png'))
+        loader.load(covered[0], key, size)
+        return loaded.thumbs[covered[0]]
+
+    assert benchmark(run).width == 256
+    loader.shutdown()
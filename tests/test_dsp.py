@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from dsp import BLOCK_FRAMES, LIMITER_CEILING, Biquad, EqualizerChain, Limiter
+from equalizer import DEFAULT_EQ_PRESETS, Band, EqPreset
+from media import music
+
+RATE = 44100
+SECONDS = 10  # Audio run through the chain in each benchmark round
+PRESETS = {preset['name']: EqPreset.from_dict(preset) for preset in DEFAULT_EQ_PRESETS}
+
+
+def direct_form(coefficients, x):
+    # The biquad one sample at a time, as the reference for the block solve
+    b0, b1, b2, a1, a2 = coefficients
+    y = np.zeros_like(x)
+    x1 = x2 = y1 = y2 = 0.0
+    for n, sample in enumerate(x):
+        y[n] = b0 * sample + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+        x1, x2, y1, y2 = sample, x1, y[n], y1
+    return y
+
+
+def run_blocks(process, signal, sizes):
+    # Feeds (channels, frames) signal through process(x, out, frames) in blocks of the given sizes
+    channels = signal.shape[0]
+    x, out = np.zeros((channels, BLOCK_FRAMES)), np.zeros((channels, BLOCK_FRAMES))
+    result, start = [], 0
+    for frames in sizes:
+        x[:, :frames] = signal[:, start:start + frames]
+        x[:, frames:] = 0.0
+        process(x, out, frames)
+        result.append(out[:, :frames].copy())
+        start += frames
+    return np.concatenate(result, axis=1)
+
+
+@pytest.mark.parametrize('band', [Band('peaking', 1000, 6, 1.4), Band('low_shelf', 31, 6, 0.7),
+                                  Band('high_shelf', 16000, -8, 0.7)], ids=lambda band: band.type)
+def test_biquad_matches_direct_form(band):
+    coefficients = band.coefficients(RATE)
+    signal = music(0.5, RATE, channels=2).T.astype(np.float64)
+    signal[1] *= -0.5
+    sizes = [BLOCK_FRAMES] * 3 + [100, 1, 2, BLOCK_FRAMES, 77]  # Short blocks at the end of a track
+    biquad = Biquad(coefficients, channels=2)
+    ours = run_blocks(biquad.process, signal, sizes)
+    for channel in range(2):
+        reference = direct_form(coefficients, signal[channel, :ours.shape[1]])
+        assert np.allclose(ours[channel], reference, atol=1e-9)
+
+
+def test_limiter_holds_ceiling():
+    loud = 3.0 * music(2.0, RATE, channels=2).T.astype(np.float64)
+    limiter = Limiter(RATE, channels=2)
+    out = run_blocks(lambda x, out, frames: (limiter.process(x, frames), np.copyto(out, x)), loud,
+                     [BLOCK_FRAMES] * (loud.shape[1] // BLOCK_FRAMES))
+    assert np.abs(out).max() <= LIMITER_CEILING + 1e-9
+    assert np.abs(out).max() > 0.9 * LIMITER_CEILING  # Limited, not just turned down
+
+
+def test_limiter_leaves_quiet_audio_alone():
+    quiet = 0.5 * music(1.0, RATE, channels=2).T.astype(np.float64)
+    limiter = Limiter(RATE, channels=2)
+    out = run_blocks(lambda x, out, frames: (limiter.process(x, frames), np.copyto(out, x)), quiet,
+                     [BLOCK_FRAMES] * (quiet.shape[1] // BLOCK_FRAMES))
+    assert np.array_equal(out, quiet[:, :out.shape[1]])
+
+
+def test_flat_preset_passes_audio_through():
+    audio = music(1.0, RATE, channels=2)
+    chain = EqualizerChain(RATE, 2, PRESETS['Flat'])
+    pcm = np.concatenate([chain.process(audio[start:start + BLOCK_FRAMES]).copy()
+                          for start in range(0, len(audio), BLOCK_FRAMES)])
+    assert np.abs(pcm.astype(np.int32) - np.round(audio * 32767)).max() <= 1
+
+
+# Benchmarks: CPU cost of SECONDS of stereo audio through the chain; the mean divided by SECONDS
+# is the cost per second of playback
+
+@pytest.fixture(scope='module')
+def blocks():
+    audio = music(SECONDS, RATE, channels=2)
+    return [audio[start:start + BLOCK_FRAMES] for start in range(0, len(audio), BLOCK_FRAMES)]
+
+
+@pytest.mark.parametrize('name', ['Flat', 'Treble boost', 'Vocal', 'Loudness'])
+def test_chain_cost(benchmark, blocks, name):
+    chain = EqualizerChain(RATE, 2, PRESETS[name])  # Flat: conversion and limiter only
+
+    def run():
+        for block in blocks:
+            chain.process(block)
+
+    benchmark(run)
+
+
+def test_biquad_cost(benchmark, blocks):
+    # One band on its own, to tell what each extra band in a preset adds
+    biquad = Biquad(Band('peaking', 1000, 6, 1.4).coefficients(RATE), channels=2)
+    planar = [np.ascontiguousarray(np.pad(block, ((0, BLOCK_FRAMES - len(block)), (0, 0))).T, dtype=np.float64)
+              for block in blocks]
+    out = np.empty((2, BLOCK_FRAMES))
+
+    def run():
+        for x in planar:
+            biquad.process(x, out, BLOCK_FRAMES)
+
+    benchmark(run)
+
+
+def test_limiter_cost(benchmark, blocks):
+    limiter = Limiter(RATE, channels=2)
+    planar = [3.0 * np.ascontiguousarray(np.pad(block, ((0, BLOCK_FRAMES - len(block)), (0, 0))).T, dtype=np.float64)
+              for block in blocks]
+
+    def run():
+        for x in planar:
+            limiter.process(x.copy(), BLOCK_FRAMES)
+
+    benchmark(run)
@@ -0,0 +1,93 @@
+import itertools
+
+import pytest
+
+from fakes import SIZES
+
+
+def test_track_end_plays_next(make_engine):
+    h = make_engine(tracks=5)
+    h.start(0)
+    first = h.engine.sound
+    h.advance(180.5)
+    assert h.engine.current_index == 1
+    assert h.engine.sound is not first and h.engine.sound.state == 'play'
+    assert first.unloaded
+
+
+def test_previous_goes_back_to_what_played(make_engine):
+    h = make_engine(tracks=5)
+    h.start(3)
+    h.engine.play_index(1)
+    h.wait_for_sound()
+    h.engine.previous()
+    h.wait_for_sound()
+    assert h.engine.current_index == 3
+
+
+def test_state_survives_restart(make_engine):
+    h = make_engine(tracks=50)
+    h.start(7)
+    h.advance(42)
+    h.engine.set_volume(0.5)
+    h.close()
+    restarted = make_engine().engine
+    assert (restarted.current_index, restarted.volume) == (7, 0.5)
+    assert restarted.resume_position() == pytest.approx(42)
+
+
+# Benchmarks, at each library size in SIZES
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_load(benchmark, make_engine, tracks):
+    make_engine(tracks=tracks)  # Writes playlist.json
+    h = benchmark.pedantic(make_engine, rounds=3)
+    assert len(h.engine.playlist) == tracks
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_next(benchmark, make_engine, tracks):
+    # From next() to the preloaded sound playing
+    h = make_engine(tracks=tracks)
+    h.start(0)
+    calls = itertools.count(1)
+
+    def next_track():
+        h.engine.next()
+        return next(calls)
+
+    played = benchmark.pedantic(next_track, setup=h.wait_preloaded, rounds=100)
+    assert h.engine.current_index == played  # One round when run with --benchmark-disable
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_toggle_shuffle(benchmark, make_engine, tracks):
+    h = make_engine(tracks=tracks)
+    h.start(0)
+    benchmark(h.engine.toggle_shuffle)
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_add_path(benchmark, make_engine, tracks):
+    h = make_engine(tracks=tracks)
+    counter = itertools.count()
+    benchmark(lambda: h.engine.add_path(f'/music/New/{next(counter):06d}.mp3'))
+    assert len(h.engine.playlist) > tracks
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_save_edit(benchmark, make_engine, tracks):
+    # An edit reaches disk as one appended log line plus the playback state
+    h = make_engine(tracks=tracks)
+    counter = itertools.count()
+
+    def edit():
+        h.engine.add_path(f'/music/New/{next(counter):06d}.mp3')
+
+    benchmark.pedantic(h.engine.flush, setup=edit, rounds=50)
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_save_snapshot(benchmark, make_engine, tracks):
+    h = make_engine(tracks=tracks)
+    benchmark.pedantic(h.engine.playlist_store.compact, args=(h.engine.playlist.songs,), rounds=5)
@@ -0,0 +1,109 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from fingerprint import FingerprintIndex, fingerprint_file
+from media import music, write_wav
+
+SECONDS = 35.0  # A little more than the fingerprinted 30 s
+ORIGINALS = 12
+RATE = 22050
+
+
+def variants(samples, seed):
+    # The same recording as it turns up twice in a library: another rip, level, start or rate
+    rng = np.random.default_rng(seed)
+    return {
+        'quieter': samples * 0.6,
+        'late start': samples[int(0.0375 * RATE):],  # Halfway between two frame starts
+        'half rate': samples[:len(samples) // 2 * 2].reshape(-1, 2, samples.shape[1]).mean(axis=1),
+        'noisy': samples + 0.01 * rng.standard_normal(samples.shape).astype(np.float32),
+    }
+
+
+@pytest.fixture(scope='module')
+def library_wavs(tmp_path_factory):
+    # ORIGINALS distinct recordings; every other one also has one copy of each variant kind
+    folder = tmp_path_factory.mktemp('fingerprints')
+    paths, copies = [], {}
+    for seed in range(ORIGINALS):
+        samples = music(SECONDS, rate=RATE, seed=seed)
+        path = str(folder / f'{seed:02d}.wav')
+        write_wav(path, samples, rate=RATE)
+        paths.append(path)
+        if seed % 2 == 0:
+            kinds = variants(samples, seed)
+            kind = list(kinds)[seed // 2 % len(kinds)]
+            copy = str(folder / f'{seed:02d} {kind}.wav')
+            write_wav(copy, kinds[kind], rate=RATE // 2 if kind == 'half rate' else RATE)
+            copies[path] = copy
+            paths.append(copy)
+    return paths, copies
+
+
+def test_finds_every_copy_and_nothing_else(tmp_path, library_wavs):
+    paths, copies = library_wavs
+    index = FingerprintIndex(str(tmp_path / 'library.db'))
+    groups = index.run(paths)
+    assert sorted(map(tuple, groups)) == sorted(copies.items())
+    assert index.update(paths) == 0  # Cached
+    index.close()
+
+
+def test_engine_reports_duplicates(make_engine, library_wavs):
+    paths, copies = library_wavs
+    found = []
+    h = make_engine(songs=paths)
+    h.engine.listener.duplicates_found = found.append
+    assert h.engine.fingerprints is None  # Not opened until it's needed
+    h.engine.find_duplicates()
+    h.loop.wait_until(lambda: found, timeout=120)
+    assert len(found[0]) == len(copies)
+    removed = h.engine.merge_duplicates()
+    assert len(removed) == len(copies) and len(h.engine.playlist) == len(paths) - len(copies)
+
+
+def test_recall_across_start_offsets(tmp_path):
+    # Rips of one CD rarely start on the same sample; every offset within two hops must be found
+    from fingerprint import HOP_SECONDS, downmix, spectral_hashes
+    index = FingerprintIndex(str(tmp_path / 'library.db'))
+    expected, found = 0, 0
+    with index.conn:
+        for seed in range(10):
+            samples = music(SECONDS, rate=RATE, seed=100 + seed)
+            index.store(f'/music/{seed}.wav', 0, 0, spectral_hashes(*downmix([(RATE, samples)])))
+            for step in range(1, 8):
+                shifted = samples[int(step * HOP_SECONDS / 4 * RATE):]
+                index.store(f'/music/{seed} +{step}.wav', 0, 0, spectral_hashes(*downmix([(RATE, shifted)])))
+    for seed in range(10):
+        matches = index.matches(f'/music/{seed}.wav')
+        expected += 7
+        found += sum(match.startswith(f'/music/{seed} +') for match in matches)
+        assert all(match.startswith(f'/music/{seed} ') for match in matches)
+    assert found == expected
+    index.close()
+
+
+# Benchmarks: fingerprinting a track, and looking up a track's matches by index size
+
+def test_fingerprint_file(benchmark, library_wavs):
+    paths, _ = library_wavs
+    assert len(benchmark(fingerprint_file, paths[0])) > 1000
+
+
+@pytest.mark.parametrize('tracks', (1_000, 10_000))
+def test_lookup(benchmark, tmp_path, library_wavs, tracks):
+    # Unrelated tracks are stood in for by random hashes, which share keys about as rarely
+    paths, copies = library_wavs
+    original, copy = next(iter(copies.items()))
+    index = FingerprintIndex(str(tmp_path / 'library.db'))
+    rng = np.random.default_rng(0)
+    counter = itertools.count()
+    with index.conn:
+        for _ in range(tracks):
+            index.store(f'/music/{next(counter)}.mp3', 0, 0, rng.integers(0, 2 ** 32, 1190, dtype=np.uint32))
+        for path in (original, copy):
+            index.store(path, 0, 0, fingerprint_file(path))
+    assert benchmark(index.matches, original) == [copy]
+    index.close()
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from formats import HEAD_SIZE, format_for, read_tags_mutagen
+from media import music, write_m4a, write_mp3, write_soundfile, write_wav
+
+TAGS = {'title': 'Título 7', 'artist': 'Artist', 'album': 'Album'}
+BATCH = 200  # Files per format in the benchmarks
+
+
+def write_track(folder, kind, i=0, seconds=3.0, **tags):
+    path = str(folder / f'{i:04d}.{kind}')
+    if kind == 'mp3':
+        write_mp3(path, seconds, **tags)
+        return path
+    samples = music(seconds, 48000 if kind == 'opus' else 44100, seed=i)
+    if kind == 'wav':
+        write_wav(path, samples, **tags)
+    elif kind == 'flac':
+        write_soundfile(path, samples, format='FLAC', **tags)
+    elif kind == 'ogg':
+        write_soundfile(path, samples, format='OGG', subtype='VORBIS', **tags)
+    elif kind == 'opus':
+        write_soundfile(path, samples, 48000, format='OGG', subtype='OPUS', **tags)
+    else:
+        write_m4a(path, samples, **tags)
+    return path
+
+
+KINDS = ('mp3', 'wav', 'flac', 'ogg', 'opus', 'm4a')
+
+
+def header_tags(path):
+    # The format's own reader, without the mutagen fallback read_tags() has
+    with open(path, 'rb') as f:
+        audio_format = format_for(path, f.read(HEAD_SIZE))
+        f.seek(0)
+        return audio_format.read_tags(f, os.path.getsize(path))
+
+
+def mutagen_tags(path):
+    with open(path, 'rb') as f:
+        return read_tags_mutagen(path, f)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_same_tags_as_mutagen(tmp_path, kind):
+    path = write_track(tmp_path, kind, **TAGS)
+    ours, theirs = header_tags(path), mutagen_tags(path)
+    for key in ('title', 'artist', 'album'):
+        assert ours[key] == TAGS[key]
+        if kind != 'wav':  # mutagen only reads ID3 chunks in WAV, not the LIST/INFO one
+            assert theirs[key] == TAGS[key]
+    assert ours['duration'] == pytest.approx(theirs['duration'], abs=0.05)
+    assert ours['duration'] == pytest.approx(3.0, abs=0.1)
+    if kind != 'opus':  # mutagen reports no bitrate for Opus
+        assert ours['bitrate'] == pytest.approx(theirs['bitrate'], rel=0.1)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_untagged(tmp_path, kind):
+    path = write_track(tmp_path, kind)
+    ours, theirs = header_tags(path), mutagen_tags(path)
+    assert ours['title'] is theirs['title'] is None
+    assert ours['duration'] == pytest.approx(theirs['duration'], abs=0.05)
+
+
+# Benchmarks: tags of BATCH files of each format, header-only readers against mutagen
+
+@pytest.fixture(scope='module', params=KINDS)
+def batch(request, tmp_path_factory):
+    folder = tmp_path_factory.mktemp(request.param)
+    return [write_track(folder, request.param, i, seconds=1.0, **TAGS) for i in range(BATCH)]
+
+
+@pytest.mark.parametrize('reader', (header_tags, mutagen_tags), ids=('header', 'mutagen'))
+def test_read_tags(benchmark, batch, reader):
+    tags = benchmark(lambda: [reader(path) for path in batch])
+    assert len(tags) == BATCH and tags[0]['duration'] > 0
@@ -0,0 +1,119 @@
+import random
+import sqlite3
+
+import pytest
+
+from fakes import SIZES, library
+from history import PlayHistory
+
+DAY = 24 * 3600
+START = 1_700_000_000.0
+
+
+def listen_events(count, tracks=5000, days=365, seed=0):
+    # (path, started, listened, duration): a year of listening over a library of `tracks`,
+    # roughly a third of the listens skipped early
+    rng = random.Random(seed)
+    paths = library(tracks)
+    for i in range(count):
+        duration = rng.uniform(120, 360)
+        listened = duration * (rng.uniform(0.05, 0.3) if rng.random() < 0.3 else rng.uniform(0.8, 1.0))
+        yield paths[int(rng.paretovariate(1.2)) % tracks], START + DAY * days * i / count, listened, duration
+
+
+def fill(history, events):
+    for event in events:
+        history.record(*event)
+    history.flush()
+
+
+@pytest.fixture(scope='module')
+def histories(tmp_path_factory):
+    made = {}
+
+    def history(count):
+        if count not in made:
+            db_file = str(tmp_path_factory.mktemp(f'history{count}') / 'library.db')
+            writer = PlayHistory(db_file, flush_interval=3600)
+            fill(writer, listen_events(count))
+            writer.close()
+            made[count] = db_file
+        return made[count]
+    yield history
+
+
+def test_rollups_match_events(tmp_path):
+    history = PlayHistory(str(tmp_path / 'library.db'), flush_interval=3600)
+    fill(history, listen_events(3000, tracks=200))
+    conn = history.conn
+    top = conn.execute('SELECT path, COUNT(*) FROM play_events WHERE NOT skipped GROUP BY path '
+                       'ORDER BY COUNT(*) DESC, path DESC LIMIT 10').fetchall()
+    assert history.top_tracks(10) == top
+    plays, skips = conn.execute('SELECT SUM(NOT skipped), SUM(skipped) FROM play_events').fetchone()
+    assert history.skip_rate() == pytest.approx(skips / (plays + skips))
+    assert 0.2 < history.skip_rate() < 0.4
+    path = top[0][0]
+    history.close()
+
+    reopened = PlayHistory(str(tmp_path / 'library.db'))
+    assert reopened.play_count(path) == top[0][1]
+    reopened.close()
+
+
+def test_counts_include_unflushed_listens(tmp_path):
+    history = PlayHistory(str(tmp_path / 'library.db'), flush_interval=3600)
+    assert history.record('/music/a.mp3', START, 200, 240)
+    assert not history.record('/music/a.mp3', START + 300, 10, 240)
+    assert history.record('/music/long.mp3', START, 250, 3600)  # Four minutes of a long mix is a play
+    assert history.play_count('/music/a.mp3') == 1
+    assert history.skip_rate('/music/a.mp3') == 0.5
+    history.close()
+
+
+def test_old_play_counts_are_carried_over(tmp_path):
+    db_file = str(tmp_path / 'library.db')
+    conn = sqlite3.connect(db_file)
+    conn.execute('CREATE TABLE plays (path TEXT PRIMARY KEY, count INTEGER)')
+    conn.execute("INSERT INTO plays VALUES ('/music/a.mp3', 7)")
+    conn.commit()
+    conn.close()
+    history = PlayHistory(db_file)
+    assert history.play_count('/music/a.mp3') == 7
+    history.close()
+
+
+# Benchmarks: recording a listen on the owner thread, writing a batch, and the rollup queries
+# by number of events in the history (against the same query over the raw events)
+
+def test_record(benchmark, tmp_path):
+    history = PlayHistory(str(tmp_path / 'library.db'), flush_interval=3600, batch_size=10 ** 9)
+    events = listen_events(10 ** 6)
+    benchmark(lambda: history.record(*next(events)))
+    history.close()
+
+
+def test_flush_batch(benchmark, tmp_path):
+    history = PlayHistory(str(tmp_path / 'library.db'), flush_interval=3600, batch_size=10 ** 9)
+    events = listen_events(10 ** 6)
+
+    def queue_batch():
+        for _ in range(500):
+            history.record(*next(events))
+
+    benchmark.pedantic(history.flush, setup=queue_batch, rounds=20)
+    history.close()
+
+
+@pytest.mark.parametrize('events', SIZES)
+@pytest.mark.parametrize('query', ('top_tracks', 'skip_rate', 'top_tracks from events'))
+def test_query(benchmark, histories, events, query):
+    history = PlayHistory(histories(events), flush_interval=3600)
+    run = {
+        'top_tracks': lambda: history.top_tracks(50),
+        'skip_rate': lambda: history.skip_rate(since_day='2024-01-01'),
+        'top_tracks from events': lambda: history.conn.execute(
+            'SELECT path, COUNT(*) FROM play_events WHERE NOT skipped GROUP BY path '
+            'ORDER BY COUNT(*) DESC LIMIT 50').fetchall(),
+    }[query]
+    benchmark(run)
+    history.close()
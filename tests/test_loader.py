@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+LOAD_DELAY = 0.05  # Real seconds each fake load takes in the benchmarks, like a cold read from an SD card
+
+
+def test_warm_next_starts_from_preloaded_sound(make_engine):
+    h = make_engine(tracks=100)
+    h.start(0)
+    preloaded = list(h.backend.sounds)
+    h.backend.released.clear()  # No load may finish from here on
+    h.engine.next()
+    h.wait_for_sound()
+    assert h.engine.current_index == 1
+    assert h.engine.sound in preloaded and h.engine.sound.state == 'play'
+    h.backend.released.set()
+
+
+def test_cold_jump_does_not_block(make_engine):
+    h = make_engine(tracks=100)
+    h.start(0)
+    h.backend.released.clear()
+    caller = threading.Thread(target=h.engine.play_index, args=(50,))
+    caller.start()
+    caller.join(5)
+    assert not caller.is_alive()  # Returned while the load is still held
+    assert h.engine.sound is None
+    h.backend.released.set()
+    h.wait_for_sound()
+    assert h.engine.current_index == 50 and h.engine.sound.source.endswith(h.engine.playlist[50])
+
+
+def test_preload_follows_shuffle(make_engine):
+    h = make_engine(tracks=100)
+    h.start(0)
+    h.engine.toggle_shuffle()
+    h.wait_preloaded()
+    upcoming = h.engine.next_index()
+    h.engine.next()
+    assert h.engine.current_index == upcoming
+    assert h.engine.sound is not None  # Started straight from the preloaded sound
+
+
+# Benchmarks: time to audio with loads taking LOAD_DELAY
+
+@pytest.mark.parametrize('case', ('warm', 'cold'))
+def test_time_to_audio(benchmark, make_engine, case):
+    h = make_engine(tracks=1000, load_delay=LOAD_DELAY)
+    h.start(0)
+    jumps = iter(range(10, 1000, 10))
+
+    def switch():
+        if case == 'warm':
+            h.engine.next()
+        else:
+            h.engine.play_index(next(jumps))  # Never the preloaded track
+        h.wait_for_sound()
+
+    benchmark.pedantic(switch, setup=h.wait_preloaded, rounds=20)
@@ -0,0 +1,64 @@
+import math
+import time
+
+import numpy as np
+import pytest
+
+from loudness import TARGET_LOUDNESS, LoudnessAnalyzer, analyze_file, gain_factor, measure_loudness
+from media import music, write_wav
+
+
+def sine(amplitude, seconds=5.0, rate=44100):
+    t = np.arange(int(seconds * rate)) / rate
+    tone = amplitude * np.sin(2 * np.pi * 440 * t)
+    return np.repeat(tone[:, None], 2, axis=1).astype(np.float32)
+
+
+def blocks(samples, rate=44100, size=4096):
+    for start in range(0, len(samples), size):
+        yield rate, samples[start:start + size]
+
+
+def test_measure_sine():
+    # A stereo sine of amplitude A: mean square A^2 / 2 per channel, summed over two
+    loudness, peak = measure_loudness(blocks(sine(0.5)))
+    assert loudness == pytest.approx(-0.691 + 20 * math.log10(0.5), abs=0.05)
+    assert peak == pytest.approx(0.5, abs=1e-3)
+
+
+def test_silence_is_not_measured():
+    assert measure_loudness(blocks(np.zeros((44100, 2), np.float32)))[0] is None
+
+
+def test_gain_factor():
+    assert gain_factor(-6.0, 0.9) == pytest.approx(10 ** (-6 / 20))  # Loud: brought down to the target
+    assert gain_factor(4.0, 0.5) == 1.0  # Quiet: plays as it is, never above full volume
+    assert gain_factor(-1.0, 2.0) == 0.5  # A peak above full scale limits the factor
+    assert gain_factor(0.0, 1.0) == 1.0
+
+
+def test_tracks_play_at_unity_until_analysed(tmp_path):
+    loud = str(tmp_path / 'loud.wav')
+    quiet = str(tmp_path / 'quiet.wav')
+    write_wav(loud, sine(0.9))
+    write_wav(quiet, sine(0.05))
+    analyzed = []
+    analyzer = LoudnessAnalyzer(str(tmp_path / 'library.db'), on_analyzed=analyzed.extend)
+    assert analyzer.gain_for(loud) == analyzer.gain_for(quiet) == 1.0
+    analyzer.analyze([loud, quiet])
+    deadline = time.monotonic() + 30
+    while len(analyzed) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    expected = TARGET_LOUDNESS - (-0.691 + 20 * math.log10(0.9))
+    assert analyzer.gain_for(loud) == pytest.approx(10 ** (expected / 20), rel=0.01)
+    assert analyzer.gain_for(quiet) == 1.0
+    analyzer.close()
+
+
+# Benchmark: analysis throughput on a three-minute 44.1 kHz stereo WAV
+
+def test_analysis_throughput(benchmark, tmp_path):
+    path = str(tmp_path / 'song.wav')
+    write_wav(path, music(180.0))
+    gain, peak, source = benchmark(analyze_file, path)
+    assert source == 'analysis' and peak == pytest.approx(0.5, abs=1e-3)
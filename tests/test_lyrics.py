@@ -0,0 +1,39 @@
+import threading
+
+from lyrics import TrackDetailsLoader
+from media import write_mp3
+
+
+def make_loader():
+    ready = threading.Event()
+    loaded = []
+
+    def on_ready(path, details):
+        loaded.append((path, details))
+        ready.set()
+
+    return TrackDetailsLoader(on_ready), loaded, ready
+
+
+def test_missing_file_gets_empty_details(tmp_path):
+    # Returning None would mean "wait for on_ready", which never comes for a file that's gone
+    loader, loaded, _ = make_loader()
+    details = loader.request(str(tmp_path / 'gone.mp3'))
+    assert details is not None
+    assert details.album is None and details.lyrics is None
+    assert not loaded
+    loader.shutdown()
+
+
+def test_details_load_once(tmp_path):
+    path = str(tmp_path / 'song.mp3')
+    write_mp3(path, 0.5, title='Song', album='Album')
+    (tmp_path / 'song.lrc').write_text('[00:01.00]First\n[00:02.50]Second\n')
+    loader, loaded, ready = make_loader()
+    assert loader.request(path) is None  # Read on the worker
+    assert ready.wait(5)
+    [(loaded_path, details)] = loaded
+    assert loaded_path == path and details.album == 'Album'
+    assert details.lyrics.lines == ('First', 'Second') and details.lyrics.line_at(2.0) == 0
+    assert loader.request(path) is details  # From the cache
+    loader.shutdown()
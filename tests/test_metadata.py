@@ -0,0 +1,95 @@
+import pytest
+
+import metadata
+from formats import read_tags
+from media import write_mp3
+from metadata import MetadataStore, TagIndexer
+
+LIBRARY_SIZE = 3000
+
+
+@pytest.fixture(scope='module')
+def mp3_library(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('mp3')
+    paths = []
+    for i in range(LIBRARY_SIZE):
+        path = str(folder / f'{i:05d}.mp3')
+        write_mp3(path, 0.5, title=f'Title {i}', artist=f'Artist {i % 50}', album=f'Album {i % 300}')
+        paths.append(path)
+    return paths
+
+
+def index(db_file, paths):
+    store = MetadataStore(db_file)
+    indexer = TagIndexer(store)
+    indexed = sum(future.result() for future in indexer.scan(paths))
+    indexer.shutdown()
+    return store, indexed
+
+
+def test_cold_then_warm(tmp_path, mp3_library, monkeypatch):
+    # Counts tag reads instead of timing them; how long each session takes is for the benchmarks
+    reads = []
+    monkeypatch.setattr(metadata, 'read_tags', lambda path: reads.append(path) or read_tags(path))
+    db_file = str(tmp_path / 'library.db')
+    store, indexed = index(db_file, mp3_library)
+    store.close()
+    assert indexed == LIBRARY_SIZE and len(reads) == LIBRARY_SIZE
+
+    # A new session: tags come from SQLite, nothing is read from the files
+    reads.clear()
+    store = MetadataStore(db_file)
+    infos = [store.lookup(path) for path in mp3_library]
+    assert infos[7]['title'] == 'Title 7' and infos[7]['artist'] == 'Artist 7'
+    assert infos[7]['duration'] == pytest.approx(0.5, abs=0.03) and infos[7]['bitrate'] == 128000
+    rescanned = sum(TagIndexer(store).index_batch(mp3_library[start:start + 64])
+                    for start in range(0, LIBRARY_SIZE, 64))
+    assert rescanned == 0 and reads == []
+    store.close()
+
+
+def test_changed_file_is_read_again(tmp_path, mp3_library):
+    path = str(tmp_path / 'changed.mp3')
+    write_mp3(path, 0.5, title='Before')
+    store, _ = index(str(tmp_path / 'library.db'), [path])
+    write_mp3(path, 1.0, title='After')
+    assert store.lookup(path) is None
+    TagIndexer(store).index_batch([path])
+    assert store.lookup(path)['title'] == 'After'
+    store.close()
+
+
+# Benchmarks over LIBRARY_SIZE generated MP3s
+
+def test_cold_index(benchmark, tmp_path, mp3_library):
+    rounds = iter(range(100))
+
+    def fresh_db():
+        return (str(tmp_path / f'cold{next(rounds)}.db'), mp3_library), {}
+
+    def run(db_file, paths):
+        index(db_file, paths)[0].close()
+
+    benchmark.pedantic(run, setup=fresh_db, rounds=3)
+
+
+def test_warm_lookup(benchmark, tmp_path, mp3_library):
+    db_file = str(tmp_path / 'library.db')
+    index(db_file, mp3_library)[0].close()
+
+    def run():
+        store = MetadataStore(db_file)
+        found = sum(store.lookup(path) is not None for path in mp3_library)
+        store.close()
+        return found
+
+    assert benchmark(run) == LIBRARY_SIZE
+
+
+def test_warm_rescan(benchmark, tmp_path, mp3_library):
+    # What the indexer costs at startup when nothing changed: a stat per file
+    store, _ = index(str(tmp_path / 'library.db'), mp3_library)
+    indexer = TagIndexer(store)
+    assert benchmark(lambda: sum(future.result() for future in indexer.scan(mp3_library))) == 0
+    indexer.shutdown()
+    store.close()
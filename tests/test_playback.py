@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+from fakes import FakeClock, FakeSound
+from playback import PlaybackClock
+
+
+class NoPositionSound(FakeSound):
+    # A backend whose get_pos() always reports 0, so the clock has to keep time itself
+    def get_pos(self):
+        return 0
+
+
+@pytest.fixture(params=[FakeSound, NoPositionSound], ids=['backend-position', 'anchored'])
+def player(request):
+    clock = FakeClock()
+    sound = request.param('song.mp3', clock, length=300.0)
+    ended = []
+    playback = PlaybackClock(time_source=clock)
+    playback.start(sound, on_track_end=lambda: ended.append(clock()))
+    return clock, sound, playback, ended
+
+
+def test_progress_has_no_drift(player):
+    # Ten hours of ticks at an uneven rate, as a loaded UI thread would deliver them
+    clock, sound, playback, _ = player
+    sound.length = 36000.0
+    rng = random.Random(1)
+    elapsed = 0.0
+    while elapsed < 35000:
+        dt = rng.uniform(0.3, 0.9)
+        clock.advance(dt)
+        elapsed += dt
+        playback.position()
+    assert playback.position() == pytest.approx(elapsed, abs=1e-6)
+
+
+def test_pause_holds_position(player):
+    clock, sound, playback, ended = player
+    clock.advance(30)
+    playback.pause()
+    clock.advance(600)
+    assert playback.position() == pytest.approx(30)
+    assert not playback.playing and sound.state == 'stop'
+    assert not ended  # Stopping to pause isn't the end of the track
+    playback.resume()
+    clock.advance(5)
+    assert playback.position() == pytest.approx(35)
+
+
+def test_seek(player):
+    clock, sound, playback, _ = player
+    clock.advance(10)
+    playback.seek(200)
+    clock.advance(2)
+    assert playback.position() == pytest.approx(202)
+    playback.seek(-5)
+    assert playback.position() == pytest.approx(0)
+    playback.seek(10_000)
+    assert playback.position() == pytest.approx(300)
+
+
+def test_seek_while_paused_applies_on_resume(player):
+    clock, sound, playback, _ = player
+    playback.pause()
+    playback.seek(120)
+    clock.advance(50)
+    assert playback.position() == pytest.approx(120)
+    playback.resume()
+    clock.advance(1)
+    assert playback.position() == pytest.approx(121)
+
+
+def test_track_end_comes_from_on_stop(player):
+    clock, sound, playback, ended = player
+    clock.advance(300)
+    sound.state = 'stop'
+    sound.dispatch_stop()
+    assert ended == [clock()]
+    assert playback.position() == pytest.approx(300)
+
+
+def test_wakes_when_the_second_changes(player):
+    clock, _, playback, _ = player
+    clock.advance(12.25)
+    assert playback.time_to_next_second() == pytest.approx(0.76)
+
+
+def test_engine_position_follows_seek_and_pause(make_engine):
+    h = make_engine(tracks=3)
+    h.start(0)
+    h.advance(20)
+    h.engine.seek(100)
+    h.advance(5)
+    h.engine.toggle_play()
+    h.advance(60)
+    assert h.engine.status()['position'] == pytest.approx(105)
+    assert not h.engine.status()['playing']
+    h.engine.toggle_play()
+    h.advance(75)  # Past the end of the 180 s track
+    assert h.engine.current_index == 1
@@ -0,0 +1,142 @@
+import itertools
+
+import pytest
+
+import playlist as playlist_module
+from fakes import library
+from playlist import Playlist, PlayOrder
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    # Records every file content_hash() reads
+    read = []
+    original = playlist_module.content_hash
+
+    def counting(path):
+        read.append(path)
+        return original(path)
+
+    monkeypatch.setattr(playlist_module, 'content_hash', counting)
+    return read
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_paths_are_normalized():
+    songs = Playlist(['C:\\Music\\Café.mp3'])
+    assert 'C:/Music/Cafe\u0301.mp3' in songs
+    assert songs.find('C:/Music/./Café.mp3') == 0
+    assert not songs.extend(['C:/Music/Café.mp3'])
+
+
+def test_bulk_remove_keeps_index():
+    songs = Playlist(library(10))
+    removed = songs.remove_many([songs[2], songs[7], '/not/there.mp3'])
+    assert len(removed) == 2 and len(songs) == 8
+    assert all(songs.find(song) == i for i, song in enumerate(songs))
+
+
+def test_copies_are_rejected_when_enabled(tmp_path, hashes):
+    original = write(tmp_path / 'a' / 'song.mp3', b'x' * 1000)
+    copy = write(tmp_path / 'b' / 'song.mp3', b'x' * 1000)
+    same_size = write(tmp_path / 'c' / 'other.mp3', b'y' * 1000)
+    other_size = write(tmp_path / 'd' / 'other.mp3', b'z' * 999)
+
+    assert Playlist([original, copy]).songs == [original, copy]  # Off by default
+    songs = Playlist(content_dedup=True)
+    assert songs.extend([original, copy, same_size, other_size]) == [original, same_size, other_size]
+    assert songs.duplicate_of(copy) == 0
+    assert songs.duplicate_of(same_size) is None
+    assert other_size not in hashes  # Only files whose size collides are read
+    songs.remove_many([original])
+    assert songs.duplicate_of(copy) is None
+    assert songs.extend([copy]) == [copy]
+
+
+def test_unique_sizes_are_never_read(tmp_path, hashes):
+    paths = [write(tmp_path / f'{i}.mp3', b'x' * (1000 + i)) for i in range(50)]
+    songs = Playlist(content_dedup=True)
+    assert songs.extend(paths, {path: 1000 + i for i, path in enumerate(paths)}) == paths
+    assert hashes == []
+
+
+def test_select_copy_plays_the_kept_song(tmp_path, make_engine):
+    h = make_engine(tracks=5, content_dedup=True)
+    original = write(tmp_path / 'a' / 'song.mp3', b'x' * 1000)
+    copy = write(tmp_path / 'b' / 'song.mp3', b'x' * 1000)
+    h.engine.select_path(original)
+    h.engine.select_path(h.engine.playlist[2])
+    h.engine.select_path(copy)
+    assert len(h.engine.playlist) == 6
+    assert h.engine.current_index == 5
+    assert h.engine.current_song == original
+
+
+def test_scan_finds_copies(tmp_path, make_engine):
+    h = make_engine(content_dedup=True)
+    write(tmp_path / 'music' / 'a' / 'song.mp3', b'x' * 1000)
+    write(tmp_path / 'music' / 'b' / 'song.mp3', b'x' * 1000)
+    write(tmp_path / 'music' / 'c' / 'song.mp3', b'y' * 1001)
+    h.engine.run_scan(str(tmp_path / 'music'))
+    h.loop.run_pending()
+    assert len(h.engine.playlist) == 2
+
+
+def test_next_follows_appends():
+    songs = Playlist(library(3))
+    order = PlayOrder(songs)
+    assert order.peek_next(2) == 0
+    songs.extend(['/music/new.mp3'])
+    assert order.next(2) == 3
+
+
+def test_previous_from_another_playlist():
+    # After open_playlist the current index is -1; going back and forth must not play index -1
+    order = PlayOrder(Playlist(library(10)))
+    order.remember(4)
+    assert order.previous(-1) == 4
+    assert order.forward == []
+    assert order.next(4) == 5
+
+
+def test_shuffle_plays_everything_once():
+    order = PlayOrder(Playlist(library(50)))
+    order.set_shuffle(True, current=0, seed=7)
+    played = [0]
+    for _ in range(49):
+        played.append(order.next(played[-1]))
+    assert sorted(played) == list(range(50))
+    back = order.previous(played[-1])
+    assert back == played[-2] and order.next(back) == played[-1]
+
+
+# Benchmarks: adding and looking up paths in a playlist of 100k, against a plain list
+
+@pytest.mark.parametrize('model', ('Playlist', 'list'))
+def test_add(benchmark, model):
+    # 100 new paths, each checked for being in the playlist first, as add_path does
+    songs = Playlist(library(100_000)) if model == 'Playlist' else library(100_000)
+    batches = itertools.count()
+
+    def add():
+        batch = next(batches)
+        for i in range(100):
+            path = f'/music/New/{batch:05d}/{i:03d}.mp3'
+            if path not in songs:
+                songs.append(path)
+
+    benchmark(add)
+    assert len(songs) == 100_000 + 100 * next(batches)
+
+
+@pytest.mark.parametrize('model', ('Playlist', 'list'))
+def test_lookup(benchmark, model):
+    paths = library(100_000)
+    songs = Playlist(paths) if model == 'Playlist' else list(paths)
+    probes = paths[::10_000] + ['/music/missing.mp3']
+    assert sum(benchmark(lambda: [probe in songs for probe in probes])) == len(probes) - 1
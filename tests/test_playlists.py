@@ -0,0 +1,106 @@
+import json
+import random
+import tracemalloc
+
+import pytest
+
+from fakes import library
+from playlists import CatalogStore, PlaylistCatalog, pack_ids, unpack_ids
+
+PLAYLISTS = 50
+PLAYLIST_TRACKS = 5000
+LIBRARY_TRACKS = 20_000
+
+
+def make_playlists(seed=0):
+    rng = random.Random(seed)
+    songs = library(LIBRARY_TRACKS)
+    return {f'Playlist {i:02d}': rng.sample(songs, PLAYLIST_TRACKS) for i in range(PLAYLISTS)}
+
+
+@pytest.fixture(scope='module')
+def catalog_file(tmp_path_factory):
+    db_file = str(tmp_path_factory.mktemp('catalog') / 'library.db')
+    catalog = PlaylistCatalog(db_file)
+    for name, songs in make_playlists().items():
+        catalog.create(name, songs)
+    catalog.close()
+    return db_file
+
+
+def traced(load):
+    # Python heap held by whatever load() returns
+    tracemalloc.start()
+    try:
+        kept = load()
+        return kept, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def test_ids_round_trip():
+    ids = [0, 1, 2 ** 32 - 1, 12345]
+    assert list(unpack_ids(pack_ids(ids))) == ids
+    assert pack_ids([1]) == b'\x01\x00\x00\x00'  # Little-endian on every machine
+
+
+def test_save_open_append(tmp_path):
+    db_file = str(tmp_path / 'library.db')
+    catalog = PlaylistCatalog(db_file)
+    catalog.create('Road trip', ['/music/a.mp3', '/music/b.mp3', '/music/a.mp3'])
+    assert catalog.append('Road trip', ['/music/b.mp3', '/music/c.mp3']) == 1
+    with pytest.raises(ValueError):
+        catalog.create('Road trip')
+    catalog.close()
+    catalog = PlaylistCatalog(db_file)
+    assert catalog.names() == ['Road trip']
+    assert catalog.songs('Road trip') == ['/music/a.mp3', '/music/b.mp3', '/music/a.mp3', '/music/c.mp3']
+    store = CatalogStore(catalog, 'Road trip')
+    store.record_remove(['/music/a.mp3'])
+    store.flush(['/music/b.mp3', '/music/c.mp3'])
+    assert PlaylistCatalog(db_file).songs('Road trip') == ['/music/b.mp3', '/music/c.mp3']
+    catalog.close()
+
+
+def test_packed_ids_use_a_fraction_of_the_memory(tmp_path, catalog_file):
+    # Every playlist open at once, against each one kept as its own list of path strings
+    # (what loading one JSON file per playlist gives)
+    files = []
+    for i, (name, songs) in enumerate(make_playlists().items()):
+        files.append(tmp_path / f'{i}.json')
+        files[-1].write_text(json.dumps(songs))
+
+    def open_catalog():
+        catalog = PlaylistCatalog(catalog_file)
+        for name in catalog.names():
+            catalog.track_ids(name)
+        catalog.load_paths()
+        return catalog
+
+    catalog, packed = traced(open_catalog)
+    lists, as_strings = traced(lambda: [json.loads(path.read_text()) for path in files])
+    assert sum(len(ids) for ids in catalog.loaded.values()) == PLAYLISTS * PLAYLIST_TRACKS
+    assert packed < as_strings / 4
+    catalog.close()
+
+
+# Benchmarks: opening and saving one 5k-track playlist
+
+def test_open(benchmark, catalog_file):
+    catalog = PlaylistCatalog(catalog_file)
+    catalog.load_paths()
+
+    def open_playlist():
+        catalog.loaded.clear()
+        return catalog.songs('Playlist 07')
+
+    assert len(benchmark(open_playlist)) == PLAYLIST_TRACKS
+    catalog.close()
+
+
+def test_save(benchmark, tmp_path):
+    catalog = PlaylistCatalog(str(tmp_path / 'library.db'))
+    songs = make_playlists()['Playlist 07']
+    catalog.create('Playlist 07', songs)
+    benchmark(catalog.save, 'Playlist 07', songs)
+    catalog.close()
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from fakes import FakeClock, FakeLoop
+from remote import MAX_QUEUED_REPLIES, WRITE_HIGH_WATER, RemoteControl
+
+SWARM = 200  # Polling clients in the load test
+FLOODERS = 10  # Clients in the load test that pipeline requests and never read
+REQUESTS = 20  # Requests each polling client sends, one at a time
+STATE = b'{"cmd": "state"}\n'
+
+
+class Owner:
+    # The UI thread's side: a FakeLoop the commands run on, and a player state that set_volume
+    # changes and publishes, as the app does
+    def __init__(self, **options):
+        self.loop = FakeLoop(FakeClock())
+        self.volumes = []
+        commands = {'set_volume': self.set_volume, 'next': lambda: None}
+        self.remote = RemoteControl(commands, self.loop.schedule, port=0, **options)
+        self.remote.publish({'playing': False, 'position': 0.0, 'volume': 1.0})
+
+    def set_volume(self, volume):
+        self.volumes.append(volume)
+        self.remote.publish({'playing': False, 'position': 0.0, 'volume': volume})
+
+    def on_loop(self, function):
+        # Runs function() on the remote control's event loop thread and returns its result
+        async def call():
+            return function()
+        return asyncio.run_coroutine_threadsafe(call(), self.remote.loop).result(5)
+
+    def queues(self):
+        # (unsent replies, bytes in the transport buffer) of every connected client
+        return self.on_loop(lambda: [(len(client.replies), client.writer.transport.get_write_buffer_size())
+                                     for client in self.remote.clients])
+
+
+@pytest.fixture
+def make_owner():
+    owners = []
+
+    def make(**options):
+        owners.append(Owner(**options))
+        return owners[-1]
+
+    yield make
+    for owner in owners:
+        owner.remote.close()
+
+
+def flood(port, seconds=0.5):
+    # Pipelines state requests without reading a reply until the server stops taking them.
+    # Returns the socket and how many whole requests went out.
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.connect(('127.0.0.1', port))
+    sock.setblocking(False)
+    sent = 0
+    chunk = STATE * 1000
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            sent += sock.send(chunk[sent % len(STATE):])
+        except BlockingIOError:
+            time.sleep(0.01)
+    return sock, sent // len(STATE)
+
+
+def test_pipelining_client_is_held_back(make_owner):
+    owner = make_owner()
+    sock, requests = flood(owner.remote.port)
+    assert requests > 10_000  # Far more than the queues may hold
+    # The server works through what the kernel buffered until the socket is full, then stops
+    deadline = time.monotonic() + 5
+    while owner.queues()[0][1] <= WRITE_HIGH_WATER and time.monotonic() < deadline:
+        time.sleep(0.05)
+    [(replies, buffered)] = owner.queues()
+    assert WRITE_HIGH_WATER < buffered < 2 * WRITE_HIGH_WATER
+    assert replies == MAX_QUEUED_REPLIES
+    time.sleep(0.2)
+    assert owner.queues() == [(replies, buffered)]  # Held there, not reading on
+    sock.close()
+
+
+def test_pipelined_replies_come_in_order(make_owner):
+    # Holding a client back loses nothing: every request is answered once it reads again
+    owner = make_owner()
+    sock = socket.create_connection(('127.0.0.1', owner.remote.port))
+    sock.settimeout(10)
+    count = 20 * MAX_QUEUED_REPLIES
+    sock.sendall(b''.join(json.dumps({'id': i, 'cmd': 'state'}).encode() + b'\n' for i in range(count)))
+    received = b''
+    while received.count(b'\n') < count:
+        received += sock.recv(1 << 16)
+    assert [json.loads(line)['id'] for line in received.splitlines()] == list(range(count))
+    sock.close()
+
+
+def test_stuck_client_is_dropped(make_owner):
+    owner = make_owner(stuck_timeout=0.2)
+    sock, _ = flood(owner.remote.port, seconds=0.3)
+    deadline = time.monotonic() + 5
+    while owner.on_loop(lambda: len(owner.remote.clients)) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert owner.on_loop(lambda: len(owner.remote.clients)) == 0
+    sock.close()
+
+
+async def poll(port, results):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    slowest = 0.0
+    for i in range(REQUESTS):
+        request = {'id': i, 'cmd': 'set_volume', 'volume': i / REQUESTS} if i % 2 else {'id': i, 'cmd': 'state'}
+        started = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b'\n')
+        reply = json.loads(await reader.readline())
+        slowest = max(slowest, time.perf_counter() - started)
+        assert reply['id'] == i and reply['ok']
+    writer.close()
+    results.append(slowest)
+
+
+async def swarm(port, results, flooders_ready):
+    flooders = []
+    for _ in range(FLOODERS):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(('127.0.0.1', port))
+        _, writer = await asyncio.open_connection(sock=sock)
+        writer.write(STATE * 20_000)  # Never read, never drained
+        flooders.append(writer)
+    await asyncio.sleep(0.2)
+    flooders_ready.set()
+    await asyncio.gather(*(poll(port, results) for _ in range(SWARM)))
+    return flooders
+
+
+def test_client_swarm(make_owner):
+    # SWARM clients polling state and setting the volume while FLOODERS others pipeline requests
+    # they never read. Pollers are answered, flooders' queues stay bounded, and commands reach the
+    # owner thread in batches rather than one wakeup each.
+    owner = make_owner()
+    results = []
+    flooders_ready = threading.Event()
+    outcome = {}
+    thread = threading.Thread(target=lambda: outcome.update(
+        flooders=asyncio.run(swarm(owner.remote.port, results, flooders_ready))))
+    thread.start()
+    flooders_ready.wait(10)
+    owner.loop.wait_until(lambda: len(results) == SWARM or not thread.is_alive(), timeout=60)
+    thread.join(10)
+    assert len(results) == SWARM
+    commands = SWARM * REQUESTS // 2
+    assert 0 < len(owner.volumes) <= owner.loop.wakeups < commands / 10  # Coalesced into few batches
+    assert max(results) < 5.0
+    deadline = time.monotonic() + 5
+    while len(owner.queues()) > FLOODERS and time.monotonic() < deadline:
+        time.sleep(0.05)  # Pollers that hung up are still being cleaned up
+    queues = owner.queues()
+    assert len(queues) == FLOODERS
+    assert all(replies <= MAX_QUEUED_REPLIES and buffered < 2 * WRITE_HIGH_WATER for replies, buffered in queues)
@@ -0,0 +1,89 @@
+import pytest
+
+from fakes import SIZES, library
+from rows import HIGHLIGHT_COLOR, TEXT_COLOR, PlaylistRows
+
+
+class CountingList(list):
+    # Stands in for the RecycleView's data list, counting the rows it would refresh
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.replaced = 0
+
+    def __setitem__(self, position, row):
+        self.replaced += 1
+        super().__setitem__(position, row)
+
+
+def populated_rows(songs, current_index=0):
+    rows = PlaylistRows()
+    rows.set_songs(songs, current_index)
+    rows.data = CountingList(rows.data)
+    return rows
+
+
+def test_highlight_touches_two_rows():
+    rows = populated_rows(library(1000), current_index=5)
+    rows.highlight(700)
+    assert rows.data.replaced == 2
+    assert rows.data[5]['text_color'] == TEXT_COLOR
+    assert rows.data[700]['text_color'] == HIGHLIGHT_COLOR
+
+
+def test_search_results_map_playlist_indices():
+    songs = library(100)
+    rows = PlaylistRows()
+    rows.set_results(songs, [10, 40, 90], current_index=40)
+    rows.highlight(90)
+    assert [row['index'] for row in rows.data] == [10, 40, 90]
+    assert [row['text_color'] for row in rows.data] == [TEXT_COLOR, TEXT_COLOR, HIGHLIGHT_COLOR]
+
+
+def test_saved_list_comes_back_without_rebuilding():
+    library_songs, other = library(1000), library(50)
+    rows = populated_rows(library_songs)
+    saved = rows.data
+    rows.show_list('Other', other, 0)
+    rows.show_list(None, library_songs, 3)
+    assert rows.data is saved
+    assert saved.replaced == 2  # The highlight moved from row 0 to row 3
+
+
+# Benchmarks. Building every row happens once, when the sidebar is first opened; what a tap, a
+# track change or an added song costs afterwards should not depend on the playlist length.
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_build(benchmark, tracks):
+    songs = library(tracks)
+    rows = PlaylistRows()
+    benchmark(rows.set_songs, songs, 0)
+    assert len(rows.data) == tracks
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_move_highlight(benchmark, tracks):
+    rows = populated_rows(library(tracks))
+    targets = iter(range(1, 10 ** 9))
+    benchmark(lambda: rows.highlight(next(targets) % tracks))
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_switch_saved_list(benchmark, tracks):
+    songs, other = library(tracks), library(500)
+    rows = populated_rows(songs)
+    rows.show_list('Other', other, 0)
+
+    def switch():
+        if rows.list_key:
+            rows.show_list(None, songs, 0)
+        else:
+            rows.show_list('Other', other, 0)
+
+    benchmark(switch)
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_extend(benchmark, tracks):
+    rows = populated_rows(library(tracks))
+    added = library(10)
+    benchmark(rows.extend_songs, added)
@@ -0,0 +1,105 @@
+import itertools
+import os
+
+import pytest
+
+from fakes import SIZES
+from scanner import LibraryScanner, walk_audio_files
+
+
+def make_tree(root, count, per_album=10, albums_per_artist=5):
+    # count empty .mp3 files laid out as artist/album/track, with a cover and a text file per
+    # album that the scanner must skip
+    paths = []
+    for i in range(count):
+        album = i // per_album
+        folder = os.path.join(root, f'Artist {album // albums_per_artist:05d}', f'Album {album:05d}')
+        if i % per_album == 0:
+            os.makedirs(folder)
+            for extra in ('cover.jpg', 'notes.txt'):
+                open(os.path.join(folder, extra), 'wb').close()
+        path = os.path.join(folder, f'{i % per_album + 1:02d} Track {i:06d}.mp3')
+        open(path, 'wb').close()
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture(scope='module')
+def trees(tmp_path_factory):
+    # Built once per size and shared; the tests below that change files use their own tree
+    made = {}
+
+    def tree(count):
+        if count not in made:
+            root = str(tmp_path_factory.mktemp(f'library{count}'))
+            made[count] = root, make_tree(root, count)
+        return made[count]
+    return tree
+
+
+class Changes:
+    def __init__(self):
+        self.added, self.modified, self.removed = [], [], []
+        self.calls = 0
+
+    def __call__(self, added, modified, removed):
+        self.calls += 1
+        self.added += added
+        self.modified += modified
+        self.removed += removed
+
+
+def test_walk_finds_only_audio(tmp_path):
+    paths = make_tree(str(tmp_path), 250)
+    found = [entry for batch in walk_audio_files(str(tmp_path), batch_size=64) for entry in batch]
+    assert sorted(path for path, _, _ in found) == sorted(paths)
+
+
+def test_rescan_reports_only_changes(tmp_path):
+    scanner = LibraryScanner(str(tmp_path / 'scan.db'))
+    root = str(tmp_path / 'music')
+    paths = make_tree(root, 1000)
+    first = Changes()
+    assert scanner.scan(root, first)['added'] == 1000
+    assert sorted(first.added) == sorted(paths)
+
+    unchanged = Changes()
+    counts = scanner.scan(root, unchanged)
+    assert counts == {'added': 0, 'modified': 0, 'removed': 0, 'unchanged': 1000}
+    assert unchanged.calls == 0
+
+    os.remove(paths[3])
+    with open(paths[5], 'wb') as f:
+        f.write(b'new tags')
+    new = os.path.join(os.path.dirname(paths[0]), '99 Bonus.mp3')
+    open(new, 'wb').close()
+    changes = Changes()
+    counts = scanner.scan(root, changes)
+    assert (changes.added, changes.modified, changes.removed) == ([new], [paths[5]], [paths[3]])
+    assert counts['unchanged'] == 998
+
+
+# Benchmarks: a first scan and an unchanged rescan of a tree of empty files
+
+@pytest.mark.parametrize('count', SIZES)
+def test_initial_scan(benchmark, tmp_path, trees, count):
+    root, _ = trees(count)
+    databases = itertools.count()
+
+    def fresh_scanner():
+        return (LibraryScanner(str(tmp_path / f'scan{next(databases)}.db')),), {}
+
+    def run(scanner):
+        return scanner.scan(root, lambda *changes: None)
+
+    counts = benchmark.pedantic(run, setup=fresh_scanner, rounds=3)
+    assert counts['added'] == count
+
+
+@pytest.mark.parametrize('count', SIZES)
+def test_rescan_unchanged(benchmark, tmp_path, trees, count):
+    root, _ = trees(count)
+    scanner = LibraryScanner(str(tmp_path / 'scan.db'))
+    scanner.scan(root, lambda *changes: None)
+    counts = benchmark.pedantic(scanner.scan, args=(root, lambda *changes: None), rounds=3)
+    assert counts['unchanged'] == count
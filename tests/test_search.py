@@ -0,0 +1,42 @@
+import pytest
+
+from fakes import SIZES, library
+
+QUERIES = {
+    'everything': 'track',  # Every song matches; only the first `limit` are returned
+    'short': 't',
+    'prefix': '0001',
+    'two terms': 'track 00012',
+    'nothing': 'zzz',
+}
+
+
+def searchable(make_engine, **options):
+    h = make_engine(**options)
+    h.engine.build_search_index()
+    h.loop.wait_until(lambda: h.engine.search_index is not None)
+    return h
+
+
+def test_limit_keeps_playlist_order(make_engine):
+    songs = library(1000)[::-1]  # Playlist order is the reverse of alphabetical order
+    h = searchable(make_engine, songs=songs)
+    assert h.engine.search('track', limit=10) == list(range(10))
+    assert h.engine.search('track 000999', limit=10) == [0]
+    assert h.engine.search('zzz') == []
+
+
+def test_added_songs_are_found(make_engine):
+    h = searchable(make_engine, tracks=100)
+    index = h.engine.add_path('/music/New/Bonus Song.mp3')
+    assert h.engine.search('bonus') == [index]
+
+
+# Benchmarks: query latency on the owner thread, by playlist size
+
+@pytest.mark.parametrize('tracks', SIZES)
+@pytest.mark.parametrize('query', QUERIES)
+def test_query(benchmark, make_engine, tracks, query):
+    h = searchable(make_engine, tracks=tracks)
+    results = benchmark(h.engine.search, QUERIES[query])
+    assert results == sorted(results) and len(results) <= 500
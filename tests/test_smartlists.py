@@ -0,0 +1,137 @@
+import pytest
+
+from history import PlayHistory
+from metadata import MetadataStore
+from playlist import Playlist
+from smartlists import PAGE_SIZE, SmartPlaylist, SmartResults
+
+TRACKS = 2000
+
+
+def tags(i):
+    # Every 13th track has no album and no duration, as files with sparse tags do
+    return {'title': f'Title {i * 7919 % TRACKS:04d}', 'artist': f'Artist {i % 7}',
+            'album': None if i % 13 == 0 else f'Album {i % 40}',
+            'duration': None if i % 13 == 0 else float(i % 600), 'bitrate': 128000 + i % 3 * 64000}
+
+
+class Library:
+    # A tag store, play history and playlist over one library.db, as the engine has them.
+    # store.page is counted, so tests can tell how much of the SQL query actually ran.
+    def __init__(self, db_file):
+        self.store = MetadataStore(db_file)
+        self.history = PlayHistory(db_file)
+        self.paths = [f'/music/{i:05d}.mp3' for i in range(TRACKS)]
+        self.store.put_many([(path, 0, 0, tags(i)) for i, path in enumerate(self.paths)])
+        self.playlist = Playlist(self.paths)
+        self.pages = 0
+        page = self.store.page
+
+        def counted_page(*args):
+            self.pages += 1
+            return page(*args)
+
+        self.store.page = counted_page
+
+    def results(self, **smart):
+        return SmartResults(SmartPlaylist('test', **smart), self.store, self.history, self.playlist)
+
+    def retag(self, path, **changes):
+        info = dict(self.store.cached(path))
+        info.update(changes)
+        self.store.put_many([(path, 0, 0, info)])
+
+    def expected(self, smart):
+        # Python's answer: every playlist path the rules match, in the playlist's sort order
+        smart = SmartPlaylist('test', **smart)
+        matches = [path for path in self.playlist if smart.matches(self.store, self.history, path)]
+        key = lambda path: (smart.sort_key(self.store, self.history, self.playlist, path), path)
+        return sorted(matches, key=key, reverse=smart.descending)[:smart.limit]
+
+
+@pytest.fixture
+def library(tmp_path):
+    library = Library(str(tmp_path / 'library.db'))
+    for i in range(0, TRACKS, 3):
+        for _ in range(i % 5):
+            library.history.record(library.paths[i], 0.0, 200.0, 200.0)
+    library.history.flush()
+    yield library
+    library.history.close()
+    library.store.close()
+
+
+def test_take_reads_only_the_pages_it_needs(library):
+    results = library.results(rules=[{'field': 'bitrate', 'op': '>', 'value': 0}], order='title')
+    assert len(results.take(10)) == 10 and library.pages == 1
+    assert len(results.take(PAGE_SIZE + 1)) == PAGE_SIZE + 1 and library.pages == 2
+    results.take(PAGE_SIZE)
+    assert library.pages == 2  # Rows already read are served again without a query
+
+
+def test_added_order_walks_only_part_of_the_playlist(library, monkeypatch):
+    results = library.results(rules=[{'field': 'artist', 'op': '=', 'value': 'Artist 3'}], order='-added')
+    checked = []
+    matches = results.smart.matches
+    monkeypatch.setattr(results.smart, 'matches', lambda *args: checked.append(args[-1]) or matches(*args))
+    assert results.take(5) == [path for path in reversed(library.paths) if int(path[7:12]) % 7 == 3][:5]
+    assert len(checked) == PAGE_SIZE and library.pages == 0
+
+
+@pytest.mark.parametrize('smart', [
+    {'rules': [{'field': 'duration', 'op': '<', 'value': 300}], 'order': 'title'},
+    {'rules': [{'field': 'duration', 'op': '>=', 'value': 300}], 'order': '-duration'},
+    {'rules': [{'field': 'album', 'op': '=', 'value': ''}], 'order': 'artist'},  # Missing tags match ''
+    {'rules': [{'field': 'album', 'op': '!=', 'value': 'Album 3'}, {'field': 'bitrate', 'op': '<=', 'value': 192000}],
+     'order': 'album'},
+    {'rules': [{'field': 'title', 'op': 'contains', 'value': 'tle 01'}], 'order': '-title'},
+    {'rules': [{'field': 'artist', 'op': '>', 'value': 'Artist 4'}], 'order': '-plays'},
+    {'rules': [{'field': 'plays', 'op': '>=', 'value': 3}], 'order': 'duration', 'limit': 50},
+    {'order': '-added', 'limit': 300},
+], ids=['numeric', 'numeric-desc', 'missing', 'two-rules', 'contains', 'plays-order', 'plays-rule', 'added'])
+def test_python_matching_agrees_with_sql(library, smart):
+    # update() relies on Rule.matches and sort_key giving what the SQL page query gives
+    expected = library.expected(smart)
+    assert expected  # Each case selects something
+    assert library.results(**smart).take(TRACKS) == expected
+
+
+def test_update_moves_rows_without_requerying(library):
+    smart = {'rules': [{'field': 'duration', 'op': '<', 'value': 300}], 'order': 'title'}
+    results = library.results(**smart)
+    results.take(TRACKS)
+    pages = library.pages
+
+    added = '/music/new.mp3'  # Indexed after the list was read
+    library.store.put_many([(added, 0, 0, dict(tags(1), title='Title 0000a', duration=10.0))])
+    library.playlist.append(added)
+    moved, removed = library.paths[250], library.paths[4]
+    library.retag(moved, title='Title 9999')
+    library.retag(removed, duration=450.0)
+    unmatched = library.paths[450]  # Retagged, still not a match
+    library.retag(unmatched, title='Title 0000b')
+    assert results.update([added, moved, removed, unmatched])
+    assert library.pages == pages
+
+    rows = results.take(TRACKS)
+    assert rows[1] == added and rows[-1] == moved
+    assert removed not in rows and unmatched not in rows
+    assert rows == library.expected(smart)
+    assert not results.update([library.paths[451]])  # Nothing about it changed
+
+
+def test_update_leaves_unread_rows_to_later_pages(library):
+    smart = {'rules': [{'field': 'duration', 'op': '<', 'value': 300}], 'order': 'title'}
+    results = library.results(**smart)
+    first = results.take(10)
+    late = library.paths[3]
+    library.retag(late, title='Title 5000')  # Sorts past the rows read so far
+    early = library.paths[5]
+    library.retag(early, title='Title 0000a')
+    results.update([late, early])
+    assert results.take(10) == library.expected(smart)[:10] and early in results.take(10)
+    assert late not in results.paths
+    pages = library.pages
+    assert results.take(TRACKS) == library.expected(smart)
+    assert library.pages > pages  # Picked up from the query, once
+    assert first[0] in results.take(TRACKS)
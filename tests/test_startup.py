@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import metadata
+import startup
+from formats import read_tags
+from media import music, write_wav
+from startup import StartupTimer
+
+# What main.py imports from the app, apart from Kivy
+APP_MODULES = ('engine', 'formats', 'artwork', 'instrumentation', 'lyrics', 'remote', 'rows', 'streaming', 'waveform')
+HEAVY_MODULES = ('numpy', 'mutagen', 'PIL')  # Imported on first use, never at startup
+
+
+def test_startup_leaves_heavy_modules_out():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = (f"import sys; import {', '.join(APP_MODULES)}; "
+              f"print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.split() == []
+
+
+def test_report_breaks_startup_down(tmp_path, monkeypatch):
+    ticks = iter([10.0, 10.25, 10.5, 10.5, 10.625, 10.875, 11.0, 11.125, 12.0])
+    monkeypatch.setattr(startup.time, 'perf_counter', lambda: next(ticks))
+    timer = StartupTimer()  # Started at 10.0
+    for name in ('import kivy', 'import kivymd', 'import player modules', 'build start', 'build end',
+                 'first frame', 'first frame', 'deferred startup done'):
+        timer.mark(name)  # The second 'first frame' (another flip) is not recorded again
+    report = timer.report()
+    assert list(report) == ['import kivy', 'import kivymd', 'import player modules', 'build start', 'build end',
+                            'first frame', 'deferred startup done']
+    assert report['import kivy'] == {'at_ms': 250.0, 'took_ms': 250.0}
+    assert report['import player modules'] == {'at_ms': 500.0, 'took_ms': 0.0}
+    assert report['first frame'] == {'at_ms': 1000.0, 'took_ms': 125.0}  # Time to first frame
+    assert report['deferred startup done']['took_ms'] == 125.0
+    path = str(tmp_path / 'startup.json')
+    timer.dump(path)
+    with open(path) as f:
+        assert json.load(f) == report
+
+
+def test_tags_are_read_only_after_first_frame(tmp_path, make_engine, monkeypatch):
+    # The app's order, without a window: build the engine, mark the first frame, then run the
+    # deferred work. No tag may be read before the mark.
+    songs = []
+    for i in range(20):
+        songs.append(str(tmp_path / f'{i:02d}.wav'))
+        write_wav(songs[-1], music(0.5, seed=i), title=f'Title {i}')
+    timer = StartupTimer()
+    reads = []
+    done = threading.Event()
+
+    def counted_read(path):
+        reads.append('first frame' in dict(timer.marks))
+        if len(reads) == len(songs):
+            done.set()
+        return read_tags(path)
+
+    monkeypatch.setattr(metadata, 'read_tags', counted_read)
+    timer.mark('build start')
+    h = make_engine(songs=songs)
+    timer.mark('build end')
+    assert reads == []
+    timer.mark('first frame')
+    h.engine.index_tags()
+    assert done.wait(10)
+    timer.mark('deferred startup done')
+    assert all(reads)
+    assert list(timer.report())[-2:] == ['first frame', 'deferred startup done']
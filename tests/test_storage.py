@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from fakes import SIZES, library
+from storage import PlaylistStore
+
+
+def test_edits_survive_reload(tmp_path):
+    songs = library(20)
+    store = PlaylistStore(str(tmp_path / 'playlist.json'))
+    store.compact(songs)
+    store.record_add(['/music/new.mp3'])
+    store.record_remove(songs[:2])
+    store.flush(songs[2:] + ['/music/new.mp3'])
+    assert PlaylistStore(str(tmp_path / 'playlist.json')).load() == songs[2:] + ['/music/new.mp3']
+
+
+def test_torn_log_line_is_skipped(tmp_path):
+    songs = library(5)
+    playlist_file = str(tmp_path / 'playlist.json')
+    store = PlaylistStore(playlist_file)
+    store.compact(songs)
+    store.record_add(['/music/a.mp3'])
+    store.flush(songs + ['/music/a.mp3'])
+    with open(store.log_file, 'a') as f:
+        f.write('{"op": "add", "paths": ["/music/b.mp')  # The app died mid-write
+    store = PlaylistStore(playlist_file)
+    assert store.load() == songs + ['/music/a.mp3']
+    store.record_add(['/music/c.mp3'])
+    store.flush(songs + ['/music/a.mp3', '/music/c.mp3'])
+    # Rewritten as a snapshot rather than appended after the torn line
+    assert PlaylistStore(playlist_file).load() == songs + ['/music/a.mp3', '/music/c.mp3']
+    with open(playlist_file) as f:
+        assert json.load(f) == songs + ['/music/a.mp3', '/music/c.mp3']
+
+
+def test_replay_after_snapshot_is_harmless(tmp_path):
+    # A crash after the snapshot was written but before the log was removed replays edits the
+    # snapshot already holds
+    songs = library(5)
+    store = PlaylistStore(str(tmp_path / 'playlist.json'))
+    store.compact(songs)
+    store.record_add(songs[-1:])
+    store.record_remove(['/music/gone.mp3'])
+    store.flush(songs)
+    assert PlaylistStore(str(tmp_path / 'playlist.json')).load() == songs
+
+
+def test_reload_counts_log_once(tmp_path):
+    # Loading again re-reads the whole log, so the count of logged edits must start over
+    songs = library(5)
+    store = PlaylistStore(str(tmp_path / 'playlist.json'), compact_every=3)
+    store.compact(songs)
+    store.record_add(['/music/a.mp3'])
+    store.record_add(['/music/b.mp3'])
+    store.flush(songs + ['/music/a.mp3', '/music/b.mp3'])
+    for _ in range(3):
+        store.load()
+    assert store.log_entries == 2
+    store.record_add(['/music/c.mp3'])
+    store.flush(songs + ['/music/a.mp3', '/music/b.mp3', '/music/c.mp3'])
+    assert store.log_entries == 3  # Still appended, not compacted early
+
+
+# Benchmarks: loading the snapshot, alone and with a log to replay, and saving one edit
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_load(benchmark, tmp_path, tracks):
+    store = PlaylistStore(str(tmp_path / 'playlist.json'))
+    store.compact(library(tracks))
+    assert len(benchmark(store.load)) == tracks
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_load_with_log(benchmark, tmp_path, tracks):
+    songs = library(tracks)
+    store = PlaylistStore(str(tmp_path / 'playlist.json'))
+    store.compact(songs)
+    added = [f'/music/Added/{i:03d}.mp3' for i in range(400)]
+    for path in added:
+        store.record_add([path])
+        store.flush(songs)
+    assert len(benchmark(lambda: PlaylistStore(store.playlist_file).load())) == tracks + len(added)
+
+
+@pytest.mark.parametrize('tracks', SIZES)
+def test_flush_edit(benchmark, tmp_path, tracks):
+    songs = library(tracks)
+    store = PlaylistStore(str(tmp_path / 'playlist.json'), compact_every=10 ** 9)
+    store.compact(songs)
+
+    def edit():
+        store.record_add(['/music/new.mp3'])
+        store.flush(songs)
+
+    benchmark(edit)
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import threading
+import tracemalloc
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from streaming import BUFFER_SIZE, CHUNK_SIZE, RELEASE_SPAN, HttpSource, MappedSource, StreamServer
+
+STREAM_SIZE = 64 * 1024 * 1024
+BLOCK = bytes(range(256)) * 256  # 64 KiB
+
+
+def block_at(offset, size):
+    # Content of the made-up stream at offset: BLOCK repeated, so any range can be checked
+    start = offset % len(BLOCK)
+    return (BLOCK * (2 + size // len(BLOCK)))[start:start + size]
+
+
+@pytest.fixture(scope='module')
+def big_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('stream') / 'long.flac'
+    with open(path, 'wb') as f:
+        for _ in range(STREAM_SIZE // len(BLOCK)):
+            f.write(BLOCK)
+    return str(path)
+
+
+class ChunkedHandler(BaseHTTPRequestHandler):
+    # A radio-style source: chunked transfer encoding, no length, no ranges
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        header = f'{len(BLOCK):x}\r\n'.encode()
+        try:
+            for _ in range(STREAM_SIZE // len(BLOCK)):
+                self.wfile.write(header)
+                self.wfile.write(BLOCK)
+                self.wfile.write(b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def chunked_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ChunkedHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/radio.mp3'
+    server.shutdown()
+    server.server_close()
+
+
+def read_through(source):
+    # Reads the whole source into one reused buffer; returns (bytes read, md5, Python heap peak)
+    buffer = bytearray(CHUNK_SIZE)
+    digest = hashlib.md5()
+    total = 0
+    tracemalloc.start()
+    try:
+        while True:
+            count = source.readinto(buffer)
+            if not count:
+                break
+            digest.update(memoryview(buffer)[:count])
+            total += count
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return total, digest.hexdigest(), peak
+
+
+def expected_md5():
+    digest = hashlib.md5()
+    for _ in range(STREAM_SIZE // len(BLOCK)):
+        digest.update(BLOCK)
+    return digest.hexdigest()
+
+
+def resident_file_bytes():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssFile:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def test_mapped_source_memory_is_flat(big_file):
+    with MappedSource(big_file) as source:
+        total, md5, peak = read_through(source)
+    assert total == STREAM_SIZE and md5 == expected_md5()
+    assert peak < 1024 * 1024  # Nothing is copied to the Python heap beyond the caller's buffer
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason='needs /proc')
+def test_mapped_source_releases_pages(big_file):
+    # Pages behind the read position go back to the OS, so resident memory stays near RELEASE_SPAN
+    buffer = bytearray(CHUNK_SIZE)
+    baseline = resident_file_bytes()
+    highest = 0
+    with MappedSource(big_file) as source:
+        while source.readinto(buffer):
+            highest = max(highest, resident_file_bytes() - baseline)
+    assert highest < 3 * RELEASE_SPAN < STREAM_SIZE
+
+
+def test_http_source_memory_is_flat(chunked_url):
+    source = HttpSource(chunked_url)
+    assert source.size is None
+    total, md5, peak = read_through(source)
+    source.close()
+    assert total == STREAM_SIZE and md5 == expected_md5()
+    # The ring buffer is allocated up front; only in-flight chunks come on top of it
+    assert peak < BUFFER_SIZE // 2
+
+
+def test_stream_server_ranges_and_seeks(big_file):
+    server = StreamServer()
+    try:
+        url = server.url_for(big_file)
+        assert url.endswith('.flac')
+        request = urllib.request.Request(url, headers={'Range': 'bytes=1000-1999'})
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 206 and response.read() == block_at(1000, 1000)
+        source = HttpSource(url, buffer_size=1024 * 1024, chunk_size=64 * 1024)
+        assert source.size == STREAM_SIZE
+        assert source.read(100) == block_at(0, 100)
+        source.seek(5000)  # Inside the buffered window
+        assert source.read(100) == block_at(5000, 100)
+        source.seek(40 * 1024 * 1024 + 7)  # Far ahead: a new range request
+        assert source.read(100) == block_at(40 * 1024 * 1024 + 7, 100)
+        source.seek(-10, 2)
+        assert source.read(100) == block_at(STREAM_SIZE - 10, 10)
+        source.close()
+    finally:
+        server.shutdown()
@@ -0,0 +1,98 @@
+import math
+
+import pytest
+
+from fakes import FakeClock, FakeSound, library
+from transitions import FADE_STEP, Crossfade
+
+LENGTH = 180.0
+FADE = 5.0
+
+
+def test_crossfade_curve_and_release():
+    clock = FakeClock()
+    outgoing, incoming = FakeSound('a', clock, LENGTH), FakeSound('b', clock, LENGTH)
+    outgoing.play()
+    incoming.play()
+    fade = Crossfade(outgoing, 0.8, incoming, 0.5, FADE, time_source=clock)
+    clock.advance(FADE / 2)
+    assert not fade.step()
+    assert outgoing.volume == pytest.approx(0.8 * math.cos(math.pi / 4))
+    assert incoming.volume == pytest.approx(0.5 * math.sin(math.pi / 4))
+    clock.advance(FADE)  # One late tick ends the fade instead of stretching it
+    assert fade.step()
+    assert incoming.volume == 0.5
+    assert outgoing.unloaded and outgoing.state == 'stop'
+
+
+@pytest.mark.parametrize('fade', (FADE, 0.0), ids=('crossfade', 'gapless'))
+def test_next_track_starts_at_length_minus_fade(make_engine, fade):
+    h = make_engine(tracks=3)
+    h.engine.set_crossfade(fade)
+    h.start(0)
+    first = h.engine.sound
+    started = h.clock()
+    h.advance(LENGTH - fade - 0.5)
+    assert h.engine.sound is first and h.engine.current_index == 0
+
+    h.advance(0.5)
+    second = h.engine.sound
+    assert second is not first and h.engine.current_index == 1
+    assert second.started == pytest.approx(started + LENGTH - fade)
+    if fade:
+        h.advance(fade / 2)
+        assert not first.unloaded and first.state == 'play'
+        assert first.volume == pytest.approx(math.cos(math.pi / 4), abs=0.05)
+        h.advance(fade / 2 + FADE_STEP)
+    assert first.unloaded and first.state == 'stop'
+    assert second.volume == 1.0 and h.engine.crossfade is None
+    # The outgoing track's own stop event doesn't skip the one that took over
+    h.advance(1)
+    assert h.engine.current_index == 1 and h.engine.sound is second
+
+
+def test_track_shorter_than_the_fade(make_engine):
+    # The second track hands off to the third while the fade into it is still running; the first
+    # track must be released then, not left playing out on its own
+    short = FADE - 1
+    h = make_engine(tracks=3, lengths={library(3)[1]: short})
+    h.engine.set_crossfade(FADE)
+    h.start(0)
+    first = h.engine.sound
+    h.advance(LENGTH - FADE)
+    second = h.engine.sound
+    assert h.engine.current_index == 1 and h.engine.crossfade.outgoing is first
+    h.wait_preloaded()
+    h.advance(short / 2)  # Overlap is capped at half the short track
+    third = h.engine.sound
+    assert h.engine.current_index == 2 and third is not second
+    assert first.unloaded and first.state == 'stop'
+    assert h.engine.crossfade.outgoing is second
+    h.advance(short / 2 + FADE_STEP)
+    assert second.unloaded and h.engine.crossfade is None
+    assert third.volume == 1.0
+    assert [sound for sound in h.backend.playing()] == [third]
+
+
+def test_seek_moves_the_handoff(make_engine):
+    h = make_engine(tracks=3)
+    h.engine.set_crossfade(FADE)
+    h.start(0)
+    started = h.clock()
+    h.advance(10)
+    h.engine.seek(100)
+    h.advance(LENGTH - FADE - 100)
+    assert h.engine.current_index == 1
+    assert h.engine.sound.started == pytest.approx(started + 10 + LENGTH - FADE - 100)
+
+
+def test_skip_cuts_the_fade_short(make_engine):
+    h = make_engine(tracks=3)
+    h.engine.set_crossfade(FADE)
+    h.start(0)
+    first = h.engine.sound
+    h.advance(LENGTH - FADE + 1)
+    h.wait_preloaded()
+    h.engine.next()
+    assert first.unloaded and h.engine.crossfade is None
+    assert h.engine.current_index == 2
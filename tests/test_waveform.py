@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from waveform import BLOCK_FRAMES, MIN_LEVEL_SIZE, ZOOM, PeakFile, build_levels, compute_peaks, render_waveform, \
+    write_peak_file
+
+RATE = 44100
+HOUR_BLOCKS = 3600 * RATE // (1 << 16)  # 64K-frame decoder blocks in an hour of audio
+
+
+def blocks_of(samples, size):
+    for start in range(0, len(samples), size):
+        yield RATE, samples[start:start + size]
+
+
+def test_peaks_do_not_depend_on_block_size():
+    rng = np.random.default_rng(3)
+    samples = (rng.standard_normal((10 * BLOCK_FRAMES + 37, 2)) * 0.2).astype(np.float32)
+    samples[5 * BLOCK_FRAMES + 3, 1] = -0.9
+    rate, peaks = compute_peaks(blocks_of(samples, 1 << 16))
+    assert rate == RATE and len(peaks) == 11
+    assert peaks[5] == round(0.9 * 255)
+    for size in (1000, BLOCK_FRAMES, 3 * BLOCK_FRAMES + 1):
+        assert np.array_equal(compute_peaks(blocks_of(samples, size))[1], peaks)
+
+
+def test_peak_file_round_trip(tmp_path):
+    peaks = np.random.default_rng(4).integers(0, 256, 5000, dtype=np.uint8)
+    levels = build_levels(peaks)
+    assert len(levels[-1]) <= MIN_LEVEL_SIZE
+    assert np.array_equal(levels[1][:10], peaks[:10 * ZOOM].reshape(-1, ZOOM).max(axis=1))
+    path = str(tmp_path / 'track.peaks')
+    write_peak_file(path, RATE, levels)
+    peak_file = PeakFile(path)
+    assert peak_file.duration() == pytest.approx(5000 * BLOCK_FRAMES / RATE)
+    assert all(np.array_equal(ours, theirs) for ours, theirs in zip(peak_file.levels, levels))
+    assert np.array_equal(peak_file.peaks(5000), peaks)
+    # Narrower bars come from a coarser level: no peak is lost, only merged with its neighbours
+    bar = peak_file.peaks(100)
+    assert len(bar) == 100 and bar.max() == peaks.max() and bar.min() >= peaks.reshape(100, -1).min(axis=1).min()
+
+
+def test_flat_line_needs_no_peaks():
+    # The line drawn before any peaks are ready is the same as for a silent track
+    for width, height in ((300, 48), (7, 1), (5, 2)):
+        silent = render_waveform(np.zeros(width, dtype=np.uint8), width, height)
+        assert render_waveform(None, width, height) == silent
+
+
+def test_render_follows_peaks():
+    pixels = np.frombuffer(render_waveform(np.array([0, 128, 255], dtype=np.uint8), 3, 48), np.uint8)
+    opaque = (pixels.reshape(48, 3, 4)[..., 3] == 255).sum(axis=0)
+    assert opaque[0] < opaque[1] < opaque[2] == 48
+
+
+# Benchmarks: an hour of 44.1 kHz stereo, from decoded blocks to a drawn bar
+
+@pytest.fixture(scope='module')
+def hour_of_blocks():
+    block = (np.random.default_rng(5).standard_normal((1 << 16, 2)) * 0.2).astype(np.float32)
+    return [block] * HOUR_BLOCKS
+
+
+@pytest.fixture(scope='module')
+def hour_peak_file(tmp_path_factory, hour_of_blocks):
+    rate, peaks = compute_peaks((RATE, block) for block in hour_of_blocks)
+    path = str(tmp_path_factory.mktemp('peaks') / 'hour.peaks')
+    write_peak_file(path, rate, build_levels(peaks))
+    return path
+
+
+def test_generate_hour(benchmark, tmp_path, hour_of_blocks):
+    # What the worker does after decoding: reduce, build the zoom levels and write the file
+    def run():
+        rate, peaks = compute_peaks((RATE, block) for block in hour_of_blocks)
+        write_peak_file(str(tmp_path / 'hour.peaks'), rate, build_levels(peaks))
+        return len(peaks)
+
+    assert benchmark.pedantic(run, rounds=5) == HOUR_BLOCKS * (1 << 16) // BLOCK_FRAMES
+
+
+def test_open_and_draw_hour(benchmark, hour_peak_file):
+    # What the UI thread does for a cached track: map the file, reduce to the bar width and draw
+    def run():
+        return render_waveform(PeakFile(hour_peak_file).peaks(1080), 1080, 96)
+
+    assert len(benchmark(run)) == 1080 * 96 * 4
+
+
+def test_draw_flat_line(benchmark):
+    assert len(benchmark(render_waveform, None, 1080, 96)) == 1080 * 96 * 4
@@ -0,0 +1,51 @@
+import math
+import time
+
+FADE_STEP = 0.05  # Seconds between volume updates during a crossfade
+HANDOFF_SLACK = 0.02  # A handoff timer firing this early is close enough; earlier than that it re-arms
+
+# Curve name -> t in [0, 1] -> (outgoing gain, incoming gain)
+CURVES = {
+    'linear': lambda t: (1.0 - t, t),
+    'equal_power': lambda t: (math.cos(t * math.pi / 2), math.sin(t * math.pi / 2)),
+    's_curve': lambda t: (1.0 - t * t * (3 - 2 * t), t * t * (3 - 2 * t)),
+    # Gapless: both at full volume, the outgoing track simply plays out its last moments
+    'gapless': lambda t: (1.0, 1.0),
+}
+
+
+class Crossfade:
+    # Ramps the outgoing sound down and the incoming one up over duration seconds. Gains are
+    # computed from elapsed time on every step, so a late tick never stretches the fade.
+    def __init__(self, outgoing, out_volume, incoming, in_volume, duration, curve='equal_power',
+                 time_source=time.monotonic):
+        self.outgoing = outgoing
+        self.out_volume = out_volume
+        self.incoming = incoming
+        self.in_volume = in_volume
+        self.duration = duration
+        self.curve = CURVES[curve]
+        self.time_source = time_source
+        self.started = time_source()
+        self.done = False
+
+    def step(self):
+        # Returns True once the fade has finished and the outgoing sound is released
+        if self.done:
+            return True
+        t = (self.time_source() - self.started) / self.duration if self.duration > 0 else 1.0
+        if t >= 1.0:
+            self.finish()
+            return True
+        out_gain, in_gain = self.curve(t)
+        self.outgoing.volume = self.out_volume * out_gain
+        self.incoming.volume = self.in_volume * in_gain
+        return False
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        self.incoming.volume = self.in_volume
+        self.outgoing.stop()
+        self.outgoing.unload()
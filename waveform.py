@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from formats import decode_blocks
+
+logger = logging.getLogger(__name__)
+
+PEAK_MAGIC = b'MPPK'
+PEAK_VERSION = 1
+HEADER = struct.Struct('<4sHHII')  # magic, version, level count, sample rate, frames per level-0 peak
+BLOCK_FRAMES = 256  # ~6 ms at 44.1 kHz: fine enough to zoom into, ~620 KB for an hour
+ZOOM = 4  # Each level keeps the max of ZOOM peaks from the level below
+MIN_LEVEL_SIZE = 256
+
+
+def compute_peaks(blocks, block_frames=BLOCK_FRAMES):
+    # Max absolute sample (across channels) per block_frames frames, quantized to 0-255.
+    # Returns (sample rate, level-0 peaks).
+    import numpy as np  # Imported on first use to keep it out of app startup
+    parts, carry, rate = [], None, 0
+    for rate, samples in blocks:
+        if carry is not None and len(carry):
+            samples = np.concatenate((carry, samples))
+        whole = len(samples) - len(samples) % block_frames
+        if whole:
+            # Rows are interleaved frames, so one reshape puts a block's samples from every channel in a row
+            rows = samples[:whole].reshape(-1, block_frames * samples.shape[1])
+            parts.append(np.maximum(rows.max(axis=1), -rows.min(axis=1)))
+        carry = samples[whole:]
+    if carry is not None and carry.size:
+        parts.append([np.abs(carry).max()])
+    peaks = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+    return rate, np.minimum(peaks * 255 + 0.5, 255).astype(np.uint8)
+
+
+def build_levels(peaks):
+    import numpy as np  # Imported on first use to keep it out of app startup
+    levels = [peaks]
+    while len(levels[-1]) > MIN_LEVEL_SIZE:
+        level = levels[-1]
+        padded = np.pad(level, (0, -len(level) % ZOOM))
+        levels.append(padded.reshape(-1, ZOOM).max(axis=1))
+    return levels
+
+
+def write_peak_file(path, rate, levels, block_frames=BLOCK_FRAMES):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(PEAK_MAGIC, PEAK_VERSION, len(levels), rate, block_frames))
+        f.write(struct.pack(f'<{len(levels)}I', *(len(level) for level in levels)))
+        for level in levels:
+            f.write(level.tobytes())
+    os.replace(tmp_path, path)
+
+
+class PeakFile:
+    # A peak file mapped read-only; each zoom level is a NumPy view straight onto the mapping
+    def __init__(self, path):
+        import numpy as np  # Imported on first use to keep it out of app startup
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.rate, self.block_frames = HEADER.unpack_from(self.map, 0)
+        if magic != PEAK_MAGIC or version != PEAK_VERSION:
+            raise ValueError(f"Not a peak file: {path}")
+        offset = HEADER.size + 4 * count
+        self.levels = []
+        for length in struct.unpack_from(f'<{count}I', self.map, HEADER.size):
+            self.levels.append(np.frombuffer(self.map, dtype=np.uint8, count=length, offset=offset))
+            offset += length
+
+    def duration(self):
+        return len(self.levels[0]) * self.block_frames / self.rate if self.rate else 0
+
+    def peaks(self, width):
+        # width peaks (0-255) covering the whole track, reduced from the coarsest level that is detailed enough
+        import numpy as np
+        level = next((level for level in reversed(self.levels) if len(level) >= width), self.levels[0])
+        if not len(level) or width <= 0:
+            return np.zeros(max(width, 0), dtype=np.uint8)
+        return np.maximum.reduceat(level, np.arange(width) * len(level) // width)
+
+
+def render_waveform(peaks, width, height):
+    # RGBA bytes, height rows of width pixels, with one column per peak mirrored around the middle;
+    # silence still shows a 1 px line. peaks=None draws only that line, without NumPy, for the bar
+    # shown before a track's peaks are ready.
+    if peaks is None:
+        middle = (height - 1) / 2
+        line, empty = b'\xff\xff\xff\xff' * width, b'\xff\xff\xff\x00' * width
+        return b''.join(line if abs(row - middle) <= 0.5 else empty for row in range(height))
+    import numpy as np
+    half = np.maximum(peaks / 255 * height / 2, 0.5)
+    rows = np.abs(np.arange(height) - (height - 1) / 2)[:, None]
+    pixels = np.full((height, width, 4), 255, dtype=np.uint8)
+    pixels[..., 3] = np.where(rows <= half, 255, 0)
+    return pixels.tobytes()
+
+
+class WaveformLoader:
+    # Computes peak files on a worker thread and keeps the last few open. request() returns a cached
+    # PeakFile at once (mapping an existing file is cheap); otherwise on_ready(path, peak_file) is
+    # called from the worker, with None when the track can't be decoded.
+    def __init__(self, cache_dir, on_ready, max_open=8):
+        self.cache_dir = cache_dir
+        self.on_ready = on_ready
+        self.max_open = max_open
+        self.open_files = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='waveform')
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_key(self, path):
+        stat = os.stat(path)
+        raw = f'{path}|{stat.st_mtime}|{stat.st_size}|{BLOCK_FRAMES}'
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def request(self, path):
+        try:
+            key = self.cache_key(path)
+        except OSError:
+            return None
+        peak_file = self.cached(key)
+        if peak_file is None:
+            self.executor.submit(self.generate, path, key)
+        return peak_file
+
+    def cached(self, key):
+        with self.lock:
+            peak_file = self.open_files.get(key)
+            if peak_file is not None:
+                self.open_files.move_to_end(key)
+                return peak_file
+        disk_path = os.path.join(self.cache_dir, key + '.peaks')
+        if not os.path.exists(disk_path):
+            return None
+        try:
+            peak_file = PeakFile(disk_path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning("Error opening peak file: %s", e)
+            return None
+        self.remember(key, peak_file)
+        return peak_file
+
+    def remember(self, key, peak_file):
+        with self.lock:
+            self.open_files[key] = peak_file
+            while len(self.open_files) > self.max_open:
+                self.open_files.popitem(last=False)
+
+    def generate(self, path, key):
+        peak_file = self.cached(key)
+        missing_path = os.path.join(self.cache_dir, key + '.none')
+        if peak_file is None and not os.path.exists(missing_path):
+            started = time.perf_counter()
+            try:
+                rate, peaks = compute_peaks(decode_blocks(path))
+                disk_path = os.path.join(self.cache_dir, key + '.peaks')
+                write_peak_file(disk_path, rate, build_levels(peaks))
+                peak_file = PeakFile(disk_path)
+                self.remember(key, peak_file)
+                logger.info("Waveform: %s in %.2f s", os.path.basename(path), time.perf_counter() - started)
+            except (OSError, ValueError, EOFError, wave.Error) as e:
+                logger.warning("Error computing waveform: %s", e)
+                open(missing_path, 'w').close()  # Remember undecodable tracks so we don't retry every play
+        self.on_ready(path, peak_file)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)